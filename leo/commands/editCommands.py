@@ -293,12 +293,20 @@ class EditCommandsClass(BaseEditCommandsClass):
         """Clear all of Leo's file caches."""
         g.app.global_cacher.clear()
         g.app.commander_cacher.clear()
+        if g.app.file_cacher:
+            g.app.file_cacher.clear()
         
     @cmd('dump-caches')
     def dumpCaches(self, event=None):
         """Dump, all of Leo's file caches."""
         g.app.global_cacher.dump()
         g.app.commander_cacher.dump()
+        
+    @cmd('show-file-cache-report')
+    def showFileCacheReport(self, event=None):
+        """Report the hits and invalidations of the external file cache."""
+        if g.app.file_cacher:
+            g.app.file_cacher.report()
     #@+node:ekr.20150514063305.118: *3* ec.doNothing
     @cmd('do-nothing')
     def doNothing(self, event):
@@ -1634,7 +1642,11 @@ class EditCommandsClass(BaseEditCommandsClass):
         inBrackets = ch and g.checkUnicode(ch) in brackets
         #@-<< set local vars >>
         assert g.isStrokeOrNone(stroke)
-        if g.doHook("bodykey1", c=c, p=p, ch=ch, oldSel=oldSel, undoType=undoType):
+        latency = c.k.latency
+        t = latency.start()
+        result = g.doHook("bodykey1", c=c, p=p, ch=ch, oldSel=oldSel, undoType=undoType)
+        latency.stop('bodykey1', t)
+        if result:
             return
         if ch == '\t':
             self.updateTab(p, w)
@@ -1662,7 +1674,9 @@ class EditCommandsClass(BaseEditCommandsClass):
         if changed:
             c.frame.body.onBodyChanged(undoType=undoType,
                 oldSel=oldSel, oldText=oldText, oldYview=None)
+        t = latency.start()
         g.doHook("bodykey2", c=c, p=p, ch=ch, oldSel=oldSel, undoType=undoType)
+        latency.stop('bodykey2', t)
     #@+node:ekr.20160924135613.1: *5* ec.doPlainChar
     def doPlainChar(self, action, ch, event, inBrackets, oldSel, stroke, w):
         c, p = self.c, self.c.p
@@ -6,7 +6,9 @@
 #@+node:ekr.20120219194520.10463: ** << imports >> (leoApp)
 import leo.core.leoGlobals as g
 import leo.core.leoExternalFiles as leoExternalFiles
+import leo.core.leoStartup as leoStartup
 import base64
+import hashlib
 import importlib
 import io
 StringIO = io.StringIO
@@ -15,7 +17,6 @@ import optparse
 import subprocess
 import string
 import sys
-import time
 import traceback
 import zipfile
 import platform
@@ -136,6 +137,8 @@ class LeoApp:
             # True when --global-docks is in effect.
         self.useIpython = False
             # True: add support for IPython.
+        self.use_file_cache = True
+            # False: --no-file-cache. Always parse external files.
         self.use_psyco = False
             # True: use psyco optimization.
         self.use_splash_screen = True
@@ -156,7 +159,7 @@ class LeoApp:
         self.log_listener = None
             # The process created by the 'listen-for-log' command.
         self.positions = 0
-            # The number of positions generated.
+            # Unused. Leo no longer counts generated positions.
         self.scanErrors = 0
             # The number of errors seen by g.scanError.
         self.structure_errors = 0
@@ -240,6 +243,8 @@ class LeoApp:
             # The singleton global db, managed by g.app.global_cacher.
         self.externalFilesController = None
             # The singleton ExternalFilesController instance.
+        self.file_cacher = None
+            # The singleton leoCacher.ExternalFileCacher instance.
         self.global_cacher = None
             # The singleton leoCacher.GlobalCacher instance.
         self.idleTimeManager = None
@@ -258,6 +263,8 @@ class LeoApp:
             # The singleton PluginsManager instance.
         self.sessionManager = None
             # The singleton SessionManager instance.
+        self.startupTracer = leoStartup.StartupTracer()
+            # The singleton StartupTracer instance, enabled by LM.load.
         # The Commands class...
         self.commandName = None
             # The name of the command being executed.
@@ -1138,6 +1145,7 @@ class LeoApp:
         g.app.db = g.app.global_cacher.db
         g.app.commander_cacher = leoCache.CommanderCacher()
         g.app.commander_db = g.app.commander_cacher.db
+        g.app.file_cacher = leoCache.ExternalFileCacher()
     #@+node:ekr.20031218072017.1978: *4* app.setLeoID & helpers
     def setLeoID(self, useDialog=True, verbose=True):
         """Get g.app.leoID from various sources."""
@@ -1340,6 +1348,8 @@ class LeoApp:
         if 'shutdown' in g.app.debug:
             g.trace(f"changed: {c.changed} {c.shortFileName()}")
         c.endEditing() # Commit any open edits.
+        c.atFileCommands.finishBackgroundWrites(wait=True)
+            # Finish writing external files.
         if c.promptingForClose:
             # There is already a dialog open asking what to do.
             return False
@@ -1355,6 +1365,7 @@ class LeoApp:
         #
         # Save the window state for *all* open files.
         g.app.saveWindowState(c)
+        c.findCommands.saveSearchIndex()
         g.app.commander_cacher.commit()
             # store cache, but don't close it.
         # This may remove frame from the window list.
@@ -1403,6 +1414,7 @@ class LeoApp:
             g.app.global_cacher.commit_and_close()
             g.app.commander_cacher.commit()
             g.app.commander_cacher.close()
+            g.app.file_cacher.commit_and_close()
         if g.app.ipk:
             g.app.ipk.cleanup_consoles()
         g.app.destroyAllOpenWithFiles()
@@ -2420,11 +2432,15 @@ class LoadManager:
         g.app.gui = oldGui
         return c if ok else None
     #@+node:ekr.20120213081706.10382: *4* LM.readGlobalSettingsFiles (changed)
-    def readGlobalSettingsFiles(self):
+    def readGlobalSettingsFiles(self, snapshot=True):
         """
         Read leoSettings.leo and myLeoSettings.leo using a null gui.
         
         New in Leo 6.1: this sets ivars for the ActiveSettingsOutline class.
+
+        snapshot: True: use the settings snapshot in g.app.db if no settings
+        file has changed. The ActiveSettingsOutline class needs the settings
+        commanders, so it uses snapshot=False.
         """
         trace = 'themes' in g.app.debug
         lm = self
@@ -2433,16 +2449,27 @@ class LoadManager:
         old_commanders = g.app.commanders()
         lm.leo_settings_path = lm.computeLeoSettingsPath()
         lm.my_settings_path = lm.computeMyLeoSettingsPath()
-        lm.leo_settings_c = lm.openSettingsFile(self.leo_settings_path)
-        lm.my_settings_c = lm.openSettingsFile(self.my_settings_path)
-        commanders = [lm.leo_settings_c, lm.my_settings_c]
-        commanders = [z for z in commanders if z]
-        settings_d, bindings_d = lm.createDefaultSettingsDicts()
-        for c in commanders:
-            # Merge the settings dicts from c's outline into
-            # *new copies of* settings_d and bindings_d.
-            settings_d, bindings_d = lm.computeLocalSettings(
-                c, settings_d, bindings_d, localFlag=False)
+        key = snapshot and lm.computeSettingsSnapshotKey(
+            [lm.leo_settings_path, lm.my_settings_path])
+        n_common = lm.countCommonScripts()
+        snapshot_d = lm.loadSettingsSnapshot('settings-snapshot', key)
+        if snapshot_d:
+            lm.leo_settings_c = lm.my_settings_c = None
+            commanders = []
+            settings_d, bindings_d = snapshot_d['settings'], snapshot_d['bindings']
+        else:
+            lm.leo_settings_c = lm.openSettingsFile(self.leo_settings_path)
+            lm.my_settings_c = lm.openSettingsFile(self.my_settings_path)
+            commanders = [lm.leo_settings_c, lm.my_settings_c]
+            commanders = [z for z in commanders if z]
+            settings_d, bindings_d = lm.createDefaultSettingsDicts()
+            for c in commanders:
+                # Merge the settings dicts from c's outline into
+                # *new copies of* settings_d and bindings_d.
+                settings_d, bindings_d = lm.computeLocalSettings(
+                    c, settings_d, bindings_d, localFlag=False)
+            if n_common == lm.countCommonScripts():
+                lm.saveSettingsSnapshot('settings-snapshot', key, settings_d, bindings_d)
         # Adjust the name.
         bindings_d.setName('lm.globalBindingsDict')
         lm.globalSettingsDict = settings_d
@@ -2451,12 +2478,23 @@ class LoadManager:
         # This must be done *after* reading myLeoSettigns.leo.
         lm.theme_path = lm.computeThemeFilePath()
         if lm.theme_path:
-            lm.theme_c = lm.openSettingsFile(lm.theme_path)
+            theme_key = key and lm.computeSettingsSnapshotKey([lm.theme_path], key)
+            n_common = lm.countCommonScripts()
+            snapshot_d = lm.loadSettingsSnapshot('theme-settings-snapshot', theme_key)
+            if snapshot_d:
+                lm.theme_c = None
+                lm.globalSettingsDict = settings_d = snapshot_d['settings']
+                g.app.theme_directory = g.os_path_dirname(lm.theme_path)
+            else:
+                lm.theme_c = lm.openSettingsFile(lm.theme_path)
             if lm.theme_c:
                 # Merge theme_c's settings into globalSettingsDict.
                 settings_d, junk_shortcuts_d = lm.computeLocalSettings(
                     lm.theme_c, settings_d, bindings_d, localFlag=False)
                 lm.globalSettingsDict = settings_d
+                if n_common == lm.countCommonScripts():
+                    lm.saveSettingsSnapshot(
+                        'theme-settings-snapshot', theme_key, settings_d, None)
                 # Set global vars
                 g.app.theme_directory = g.os_path_dirname(lm.theme_path)
                     # Used by the StyleSheetManager.
@@ -2476,6 +2514,102 @@ class LoadManager:
         for c in commanders:
             if c not in old_commanders:
                 g.app.forgetOpenFile(c.fileName())
+    #@+node:ekr.20191111102521.1: *4* LM.Settings snapshot
+    #@+at
+    # Opening leoSettings.leo and myLeoSettings.leo and parsing their
+    # @settings trees is a large part of Leo's startup time.
+    # LM.readGlobalSettingsFiles saves the resulting settings and shortcuts
+    # dicts in g.app.db. The key of this snapshot is a hash of the contents
+    # of all settings files and of the settings parser, so any change to
+    # these files forces a full parse. The key also contains sys.platform
+    # and the machine name, for @ifplatform and @ifhostname nodes. The
+    # snapshot contains the values of the environment variables tested by
+    # @ifenv nodes.
+    #@@c
+    #@+node:ekr.20191111102521.2: *5* LM.computeSettingsSnapshotKey
+    def computeSettingsSnapshotKey(self, paths, key=''):
+        """
+        Return a hash of key, the contents of all paths and the settings parser,
+        the platform and the machine name, or None if the snapshot must not be
+        used.
+        """
+        import leo.core.leoConfig as leoConfig
+        if g.app.trace_binding or g.app.trace_setting:
+            return None # Always trace the full parse.
+        h = hashlib.sha1(key.encode('utf-8'))
+        h.update(repr((sys.platform, self.computeMachineName())).encode('utf-8'))
+        for path in paths + [leoConfig.__file__]:
+            h.update(repr(path).encode('utf-8'))
+            try:
+                with open(path, 'rb') as f:
+                    h.update(f.read())
+            except Exception:
+                h.update(b'\0') # A missing file.
+        return h.hexdigest()
+    #@+node:ekr.20191111102521.3: *5* LM.countCommonScripts
+    def countCommonScripts(self):
+        """
+        Return the number of @button, @command and @<file> nodes in the
+        @settings trees of all settings files.
+
+        @button and @command nodes contain positions, and the snapshot's key
+        does not include external files, so settings files containing these
+        nodes get no snapshot.
+        """
+        config = g.app.config
+        return (
+            len(config.atCommonButtonsList) + len(config.atCommonCommandsList) +
+            config.atFileSettingsCount)
+    #@+node:ekr.20191111102521.4: *5* LM.loadSettingsSnapshot
+    # The ivars of g.app.config set by the settings parser.
+    snapshot_ivars = (
+        'buttonsFileName', 'context_menus',
+        'enabledPluginsFileName', 'enabledPluginsString',
+        'menusFileName', 'menusList', 'modeCommandsDict',
+    )
+
+    def loadSettingsSnapshot(self, name, key):
+        """
+        Return the snapshot dict with the given name in g.app.db if its key
+        matches the given key and the environment variables tested by @ifenv
+        nodes are unchanged, setting the g.app.config ivars that it contains.
+        Return None if there is no such snapshot.
+        """
+        if not key:
+            return None
+        try:
+            d = g.app.db.get(name)
+            if not isinstance(d, dict) or d.get('key') != key:
+                return None
+            for env_name, val in d.get('env', {}).items():
+                if os.getenv(env_name) != val:
+                    return None
+            for ivar, val in d['config'].items():
+                setattr(g.app.config, ivar, val)
+            if 'startup' in g.app.debug:
+                print(f"using {name}")
+            return d
+        except Exception:
+            g.es_exception()
+            return None
+    #@+node:ekr.20191111102521.5: *5* LM.saveSettingsSnapshot
+    def saveSettingsSnapshot(self, name, key, settings_d, bindings_d):
+        """Save a snapshot of the settings dicts and g.app.config ivars in g.app.db."""
+        if not key:
+            return
+        config = g.app.config
+        try:
+            g.app.db[name] = {
+                'key': key,
+                'settings': settings_d,
+                'bindings': bindings_d,
+                'env': {z: os.getenv(z) for z in config.ifEnvNames},
+                'config': {
+                    ivar: getattr(config, ivar) for ivar in self.snapshot_ivars
+                        if hasattr(config, ivar)},
+            }
+        except Exception:
+            g.es_exception()
     #@+node:ekr.20120214165710.10838: *4* LM.traceSettingsDict
     def traceSettingsDict(self, d, verbose=False):
         if verbose:
@@ -2502,14 +2636,18 @@ class LoadManager:
     def load(self, fileName=None, pymacs=None):
         """Load the indicated file"""
         lm = self
-        t1 = time.process_time()
+        tracer = g.app.startupTracer
+        tracer.start()
+        load_phase = tracer.begin('LM.load')
         # Phase 1: before loading plugins.
         # Scan options, set directories and read settings.
         print('') # Give some separation for the coming traces.
         if not lm.isValidPython():
             return
+        phase = tracer.begin('LM.doPrePluginsInit')
         lm.doPrePluginsInit(fileName, pymacs)
             # sets lm.options and lm.files
+        tracer.end(phase)
         g.app.computeSignon()
         g.app.printSignon()
         if lm.options.get('version'):
@@ -2520,7 +2658,9 @@ class LoadManager:
             # Disable redraw until all files are loaded.
         #
         # Phase 2: load plugins: the gui has already been set.
+        phase = tracer.begin('plugins')
         g.doHook("start1")
+        tracer.end(phase)
         if g.app.killed:
             return
         g.app.idleTimeManager.start()
@@ -2529,9 +2669,13 @@ class LoadManager:
         if lm.options.get('script') and not self.files:
             ok = True
         else:
+            phase = tracer.begin('LM.doPostPluginsInit')
             ok = lm.doPostPluginsInit()
+            tracer.end(phase)
             # Fix #579: Key bindings don't take for commands defined in plugins
+            phase = tracer.begin('app.makeAllBindings')
             g.app.makeAllBindings()
+            tracer.end(phase)
             if ok and g.app.diff:
                 lm.doDiff()
         if not ok:
@@ -2540,12 +2684,30 @@ class LoadManager:
         g.es('') # Clears horizontal scrolling in the log pane.
         if g.app.listen_to_log_flag:
             g.app.listenToLog()
-        if 'startup' in g.app.debug:
-            t2 = time.process_time()
-            g.es_print('startup time: %5.2f sec' % (t2 - t1))
+        tracer.end(load_phase)
+        lm.finishStartupTracer()
         g.app.gui.runMainLoop()
         # For scripts, the gui is a nullGui.
         # and the gui.setScript has already been called.
+    #@+node:ekr.20191111113947.8: *4* LM.finishStartupTracer
+    def finishStartupTracer(self):
+        """Summarize startup. Handle --trace=startup and --startup-report."""
+        lm = self
+        tracer = g.app.startupTracer
+        pc = g.app.pluginsController
+        tracer.finish(
+            loaded_plugins=sorted(pc.getLoadedPlugins()) if pc else [],
+            lazy_plugins=sorted(pc.getLazyPlugins()) if pc else [],
+        )
+        if 'startup' in g.app.debug:
+            g.es_print('\n'.join(tracer.report()))
+        fn = lm.options.get('startup_report_fn')
+        if fn:
+            try:
+                with open(fn, 'w', encoding='utf-8') as f:
+                    f.write(tracer.to_json())
+            except IOError:
+                g.es_print(f"can not write startup report: {fn}")
     #@+node:ekr.20150225133846.7: *4* LM.doDiff
     def doDiff(self):
         """Support --diff option after loading Leo."""
@@ -2620,7 +2782,9 @@ class LoadManager:
         g.app.logInited = True
         g.app.initComplete = True
         c.setLog()
+        phase = g.app.startupTracer.begin('first redraw')
         c.redraw()
+        g.app.startupTracer.end(phase)
         g.doHook("start2", c=c, p=c.p, fileName=c.fileName())
         c.initialFocusHelper()
         screenshot_fn = lm.options.get('screenshot_fn')
@@ -2692,15 +2856,19 @@ class LoadManager:
         lm.reportDirectories(verbose)
         # Read settings *after* setting g.app.config and *before* opening plugins.
         # This means if-gui has effect only in per-file settings.
+        phase = g.app.startupTracer.begin('LM.readGlobalSettingsFiles')
         lm.readGlobalSettingsFiles()
             # reads only standard settings files, using a null gui.
             # uses lm.files[0] to compute the local directory
             # that might contain myLeoSettings.leo.
+        g.app.startupTracer.end(phase)
         # Read the recent files file.
         localConfigFile = lm.files[0] if lm.files else None
         g.app.recentFilesManager.readRecentFiles(localConfigFile)
         # Create the gui after reading options and settings.
+        phase = g.app.startupTracer.begin('LM.createGui')
         lm.createGui(pymacs)
+        g.app.startupTracer.end(phase)
         # We can't print the signon until we know the gui.
         g.app.computeSignon() # Set app.signon/signon1 for commanders.
     #@+node:ekr.20170302093006.1: *5* LM.createAllImporetersData & helpers
@@ -2966,6 +3134,8 @@ class LoadManager:
             'script': script,
             'select': options.select and options.select.strip('"'),
                 # --select=headline
+            'startup_report_fn': options.startup_report and options.startup_report.strip('"'),
+                # --startup-report=fn
             'theme_path': options.theme,
                 # --theme=name
             'version': options.version,
@@ -3001,6 +3171,7 @@ class LoadManager:
         add_bool('--maximized',     'start maximized')
         add_bool('--minimized',     'start minimized')
         add_bool('--no-dock',       'use legacy look & feel')
+        add_bool('--no-file-cache', 'always parse external files')
         add_bool('--no-plugins',    'disable all plugins')
         add_bool('--no-splash',     'disable the splash screen')
         add_other('--screen-shot',  'take a screen shot and then exit', m='PATH')
@@ -3008,6 +3179,7 @@ class LoadManager:
         add_bool('--script-window', 'execute script using default gui')
         add_other('--select',       'headline or gnx of node to select', m='ID')
         add_bool('--silent',        'disable all log messages')
+        add_other('--startup-report', 'write startup times to a json file', m='PATH')
         add_other('--theme',        'use the named theme file', m='NAME')
         add_other('--trace',        'add one or more strings to g.app.debug', m=trace_m)
         add_other('--trace-binding', 'trace commands bound to a key', m='KEY')
@@ -3113,6 +3285,9 @@ class LoadManager:
         # #1171: retain --no-dock indefinitely.
         if options.no_dock:
             g.app.dock = False
+        # --no-file-cache
+        if options.no_file_cache:
+            g.app.use_file_cache = False
         # --no-plugins
         if options.no_plugins:
             g.app.enablePlugins = False
@@ -3296,7 +3471,9 @@ class LoadManager:
         previousSettings = lm.getPreviousSettings(fn)
         # Step 2: open the outline in the requested gui.
         # For .leo files (and zipped .leo file) this opens the file a second time.
+        phase = g.app.startupTracer.begin('LM.openFileByName')
         c = lm.openFileByName(fn, gui, old_c, previousSettings)
+        g.app.startupTracer.end(phase)
         if c:
             g.app.restoreWindowState(c)
         return c
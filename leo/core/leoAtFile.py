@@ -9,10 +9,15 @@
 import leo.core.leoGlobals as g
 import leo.core.leoBeautify as leoBeautify
 import leo.core.leoNodes as leoNodes
+import copy
+import hashlib
 import os
 import re
+import stat
 import sys
+import tempfile
 import time
+import traceback
 #@-<< imports >>
 #@+others
 #@+node:ekr.20160514120655.1: ** class AtFile
@@ -48,15 +53,36 @@ class AtFile:
         self.encoding = 'utf-8' # 2014/08/13
         self.fileCommands = c.fileCommands
         self.errors = 0 # Make sure at.error() works even when not inited.
+        self.parsed_data = {}
+            # Keys are full paths, values are (cache_key, data).
+            # Set by at.parseFilesInParallel, used by at.readFromFileCache.
         # **Only** at.writeAll manages these flags.
         # promptForDangerousWrite sets cancelFlag and yesToAll only if canCancelFlag is True.
         self.canCancelFlag = False
         self.cancelFlag = False
         self.yesToAll = False
+        self.write_stats = {
+            'generated': 0, # The contents of the file were computed.
+            'compared': 0, # The file was read and compared with the contents.
+            'written': 0, # The file was created or changed.
+            'skipped': 0, # Neither the tree nor the file changed since the last write.
+        }
+        self.write_racy_delta = 2.0
+            # Don't trust file time stamps within this many seconds of writing.
+        # Background writes: see at.startBackgroundWrite.
+        self.background_executor = None
+            # A thread pool, created when first needed.
+        self.background_jobs = []
+            # A list of (future, job) tuples, in the order the jobs started.
+        self.background_report = None
+            # The args to at.reportEndOfWrite, called when all jobs finish.
+        self.background_timer = None
+            # The IdleTime instance that calls at.finishBackgroundWrites.
         # User options: set in reloadSettings.
         self.checkPythonCodeOnWrite = False
         self.runPyFlakesOnWrite = False
         self.underindentEscapeString = '\\-'
+        self.write_threads = 0
         self.reloadSettings()
     #@+node:ekr.20171113152939.1: *5* at.reloadSettings
     def reloadSettings(self):
@@ -68,6 +94,8 @@ class AtFile:
             c.config.getBool('run-pyflakes-on-write', default=False)
         self.underindentEscapeString = \
             c.config.getString('underindent-escape-string') or '\\-'
+        self.write_threads = \
+            c.config.getInt('write-external-files-threads') or 0
     #@+node:ekr.20150509194251.1: *4* at.cmd (decorator)
     def cmd(name):
         """Command decorator for the AtFileCommands class."""
@@ -328,6 +356,11 @@ class AtFile:
         at.fromString = fromString
         if at.errors:
             return False
+        use_cache = not fromString and not importFileName and not atShadow
+        cache_key = root.gnx, at.encoding
+            # The data depends on the root's gnx and the default encoding.
+        if use_cache and at.readFromFileCache(root, cache_key):
+            return True
         fileName, file_s = at.openFileForReading(fromString=fromString)
             # For @shadow files, calls x.updatePublicAndPrivateFiles.
             # Calls at.initReadLine(s), where s is the file contents.
@@ -350,7 +383,37 @@ class AtFile:
                 # at.tab_width
         gnx2vnode = c.fileCommands.gnxDict
         contents = fromString or file_s
-        FastAtRead(c, gnx2vnode).read_into_root(contents, fileName, root)
+        fast_at = FastAtRead(c, gnx2vnode)
+        data = fast_at.parse(contents, fileName, root.gnx)
+        if data:
+            fast_at.graft_into_root(data, fileName, root)
+            if use_cache and fileName and data[1] is not None and g.app.file_cacher:
+                g.app.file_cacher.put(fileName, '@file', cache_key, data)
+        root.clearDirty()
+        return True
+    #@+node:ekr.20191020072657.9: *6* at.readFromFileCache
+    def readFromFileCache(self, root, cache_key):
+        """
+        Read root's tree from at.parsed_data or from g.app.file_cacher if the
+        external file has not changed. Return True if the data was found.
+        """
+        at, c = self, self.c
+        cacher = g.app.file_cacher
+        fn = g.fullPath(c, root)
+        key, data = at.parsed_data.pop(fn, (None, None))
+        if key != cache_key:
+            data = cacher.get(fn, '@file', cache_key) if cacher else None
+        elif data and data[1] is not None and cacher:
+            # Cache the data from parse_external_file.
+            cacher.put(fn, '@file', cache_key, data)
+        if not data:
+            return False
+        at.setPathUa(root, fn)
+        c.setFileTimeStamp(fn)
+        at.warnOnReadOnlyFile(fn)
+        root.clearVisitedInTree()
+        gnx2vnode = c.fileCommands.gnxDict
+        FastAtRead(c, gnx2vnode).graft_into_root(data, fn, root)
         root.clearDirty()
         return True
     #@+node:ekr.20100122130101.6174: *6* at.deleteTnodeList
@@ -465,8 +528,14 @@ class AtFile:
         t1 = time.time()
         c.init_error_dialogs()
         files = at.findFilesToRead(force, root)
+        if g.app.file_cacher:
+            g.app.file_cacher.begin()
+        at.parseFilesInParallel(files)
         for p in files:
             at.readFileAtPosition(force, p)
+        at.parsed_data = {}
+        if g.app.file_cacher:
+            g.app.file_cacher.commit()
         for p in files:
             p.v.clearDirty()
         if not g.unitTesting:
@@ -481,40 +550,90 @@ class AtFile:
     def findFilesToRead(self, force, root):
 
         c = self.c
-        p = root.copy()
+        t = leoNodes.Traverser()
         scanned_tnodes = set()
         files = []
-        after = p.nodeAfterTree() if force else None
-        while p and p != after:
-            data = (p.gnx, g.fullPath(c, p))
+        # force: scan only root's tree. Otherwise, scan from root to the end.
+        for v, childIndex, level in (t.walk_tree(root) if force else t.walk_from(root)):
             # skip clones referring to exactly the same paths.
-            if data in scanned_tnodes:
-                p.moveToNodeAfterTree()
-                continue
-            scanned_tnodes.add(data)
-            if not p.h.startswith('@'):
-                p.moveToThreadNext()
-            elif p.isAtIgnoreNode():
-                if p.isAnyAtFileNode():
-                    c.ignored_at_file_nodes.append(p.h)
-                p.moveToNodeAfterTree()
+            # Only clones and their descendants can appear more than once.
+            if len(v.parents) > 1 or any(len(z.parents) > 1 for z, i in t.stack):
+                data = (v.gnx, g.fullPath(c, t.position(copy=False)))
+                if data in scanned_tnodes:
+                    t.prune()
+                    continue
+                scanned_tnodes.add(data)
+            if not v.h.startswith('@'):
+                pass
+            elif v.isAtIgnoreNode():
+                if v.isAnyAtFileNode():
+                    c.ignored_at_file_nodes.append(v.h)
+                t.prune()
             elif (
-                p.isAtThinFileNode() or
-                p.isAtAutoNode() or
-                p.isAtEditNode() or
-                p.isAtShadowFileNode() or
-                p.isAtFileNode() or
-                p.isAtCleanNode() # 1134.
+                v.isAtThinFileNode() or
+                v.isAtAutoNode() or
+                v.isAtEditNode() or
+                v.isAtShadowFileNode() or
+                v.isAtFileNode() or
+                v.isAtCleanNode() # 1134.
             ):
-                files.append(p.copy())
-                p.moveToNodeAfterTree()
-            elif p.isAtAsisFileNode() or p.isAtNoSentFileNode():
+                files.append(t.position())
+                t.prune()
+            elif v.isAtAsisFileNode() or v.isAtNoSentFileNode():
                 # Note (see #1081): @asis and @nosent can *not* be updated automatically.
                 # Doing so using refresh-from-disk will delete all child nodes.
-                p.moveToNodeAfterTree()
-            else:
-                p.moveToThreadNext()
+                t.prune()
         return files
+    #@+node:ekr.20191020091836.1: *6* at.parseFilesInParallel
+    def parseFilesInParallel(self, files, processes=None):
+        """
+        Use a pool of processes to parse the @file nodes in files.
+
+        Set at.parsed_data. at.readFromFileCache grafts the results, in the
+        order given by files, so the results are the same as for serial reads.
+
+        processes: the number of worker processes. None: use the
+        @int read-external-files-processes setting. 0: do nothing.
+        """
+        at, c = self, self.c
+        at.parsed_data = {}
+        if processes is None:
+            processes = c.config.getInt('read-external-files-processes') or 0
+        if processes < 1:
+            return
+        cacher = g.app.file_cacher
+        encoding = c.config.default_derived_file_encoding
+            # at.read uses this encoding unless the file specifies another.
+        jobs = []
+        for p in files:
+            if not (p.isAtThinFileNode() or p.isAtFileNode()):
+                continue
+            fn = g.fullPath(c, p)
+            if fn in at.parsed_data:
+                continue
+            cache_key = p.gnx, encoding
+            data = cacher.get(fn, '@file', cache_key) if cacher else None
+            at.parsed_data[fn] = cache_key, data
+            if not data:
+                jobs.append((fn, p.gnx, encoding),)
+        if len(jobs) < 2:
+            return
+        t1 = time.time()
+        try:
+            import concurrent.futures as futures
+            chunksize = max(1, len(jobs) // (4 * processes))
+            with futures.ProcessPoolExecutor(max_workers=processes) as executor:
+                results = list(executor.map(
+                    parse_external_file, *zip(*jobs), chunksize=chunksize))
+        except Exception:
+            g.es_print('can not parse files in parallel')
+            g.es_exception()
+            return
+        for (fn, gnx, encoding), data in zip(jobs, results):
+            # at.read handles files for which data is None.
+            at.parsed_data[fn] = (gnx, encoding), data
+        if 'cache' in g.app.debug:
+            g.trace(f"{len(jobs)} files, {processes} processes, {time.time()-t1:4.2f} sec.")
     #@+node:ekr.20190108054803.1: *6* at.readFileAtPosition
     def readFileAtPosition(self, force, p):
         '''Read the @<file> node at p.'''
@@ -652,6 +771,10 @@ class AtFile:
             g.es_print(f"not found: {fileName}", color='red', nodeLink=root.get_UNL(with_proto=True))
             return False
         at.rememberReadPath(fileName, root)
+        cacher = g.app.file_cacher
+        if cacher and cacher.get(fileName, '@clean', at.cleanTreeHash(root)):
+            # Neither the file nor the tree has changed since the last read.
+            return True
         at.initReadIvars(root, fileName)
             # Must be called before at.scanAllDirectives.
         at.scanAllDirectives(root)
@@ -666,16 +789,27 @@ class AtFile:
         else:
             new_private_lines = []
             root.b = ''.join(new_public_lines)
-            return True
-        if new_private_lines == old_private_lines:
-            return True
-        if not g.unitTesting:
-            g.es("updating:", root.h)
-        root.clearVisitedInTree()
-        gnx2vnode = at.fileCommands.gnxDict
-        contents = ''.join(new_private_lines)
-        FastAtRead(c, gnx2vnode).read_into_root(contents, fileName, root)
+        if old_public_lines and new_private_lines != old_private_lines:
+            if not g.unitTesting:
+                g.es("updating:", root.h)
+            root.clearVisitedInTree()
+            gnx2vnode = at.fileCommands.gnxDict
+            contents = ''.join(new_private_lines)
+            FastAtRead(c, gnx2vnode).read_into_root(contents, fileName, root)
+        if cacher:
+            cacher.put(fileName, '@clean', at.cleanTreeHash(root), True)
         return True # Errors not detected.
+    #@+node:ekr.20191020080410.1: *6* at.cleanTreeHash
+    def cleanTreeHash(self, root):
+        """Return a hash of the structure, headlines and bodies of root's tree."""
+        h = hashlib.md5()
+        level0 = len(root.stack)
+        t = leoNodes.Traverser()
+        for v, childIndex, level in t.walk_tree(root):
+            b = v._bodyString
+            h.update(f"{level-level0}:{v.gnx}:{len(b)}:{v._headString}\n".encode('utf-8', 'replace'))
+            h.update(b.encode('utf-8', 'replace'))
+        return h.hexdigest()
     #@+node:ekr.20150204165040.7: *6* at.dump_lines
     def dump(self, lines, tag):
         """Dump all lines."""
@@ -1029,6 +1163,17 @@ class AtFile:
             else:
                 g.es("no @shadow nodes in the selected tree")
         return found
+    #@+node:ekr.20191110130435.6: *6* at.showWriteReport
+    @cmd('show-write-report')
+    def showWriteReport(self, event=None):
+        """
+        Report how many external files Leo has generated, compared, written
+        and skipped since this outline was opened.
+        """
+        d = self.write_stats
+        g.es_print(f"external files written by {self.c.shortFileName()}...")
+        for key in ('generated', 'compared', 'written', 'skipped'):
+            g.es_print(f"{key:>9}: {d.get(key)}")
     #@+node:ekr.20041005105605.157: *5* at.putFile & helper
     def putFile(self, root, fromString='', sentinels=True):
         '''Write the contents of the file to the output stream.'''
@@ -1056,6 +1201,7 @@ class AtFile:
         at.cancelFlag = False
         at.yesToAll = False
         files, root = at.findFilesToWrite(all)
+        n_jobs = len(at.background_jobs)
         for p in files:
             try:
                 at.writeAllHelper(p, root)
@@ -1066,7 +1212,12 @@ class AtFile:
         at.cancelFlag = False
         at.yesToAll = False
         # Say the command is finished.
-        at.reportEndOfWrite(files, all, dirty)
+        if len(at.background_jobs) > n_jobs:
+            # at.finishBackgroundWrites reports the end of the write.
+            at.background_report = files, all, dirty
+            at.startBackgroundTimer()
+        else:
+            at.reportEndOfWrite(files, all, dirty)
         if c.isChanged():
             # Save the outline if only persistence data nodes are dirty.
             at.saveOutlineIfPossible()
@@ -1166,22 +1317,32 @@ class AtFile:
             return
         if p.isDirty():
             at.autoBeautify(p)
+        background = at.write_threads > 0 and not g.unitTesting
         # Tricky: @ignore not recognised in @asis nodes.
         if p.isAtAsisFileNode():
-            at.asisWrite(p)
+            if background:
+                at.startBackgroundWrite(p)
+            else:
+                at.asisWrite(p)
         elif p.isAtIgnoreNode():
             return # Handled in caller.
         elif p.isAtAutoNode():
             at.writeOneAtAutoNode(p)
             # Do *not* clear the dirty bits the entries in @persistence tree here!
         elif p.isAtCleanNode() or p.isAtNoSentFileNode():
-            at.write(p, sentinels=False)
+            if background:
+                at.startBackgroundWrite(p, sentinels=False)
+            else:
+                at.write(p, sentinels=False)
         elif p.isAtEditNode():
             at.writeOneAtEditNode(p)
         elif p.isAtShadowFileNode():
             at.writeOneAtShadowNode(p)
         elif p.isAtThinFileNode() or p.isAtFileNode():
-            at.write(p)
+            if background:
+                at.startBackgroundWrite(p)
+            else:
+                at.write(p)
         #
         # Clear the dirty bits in all descendant nodes.
         # The persistence data may still have to be written.
@@ -1228,6 +1389,158 @@ class AtFile:
                 raise IOError
             at.setPathUa(p, newPath) # Remember that we have changed paths.
         return pathChanged
+    #@+node:ekr.20191110141901.1: *5* at.Background writes
+    #@+node:ekr.20191110141901.2: *6* at.finishBackgroundWrites & helper
+    def finishBackgroundWrites(self, wait=False):
+        """
+        Report the results of finished background writes, in the order in
+        which the writes started. Return True if no writes remain.
+
+        wait: True: wait for all writes to finish.
+        """
+        at, c = self, self.c
+        while at.background_jobs:
+            future, job = at.background_jobs[0]
+            if not wait and not future.done():
+                break
+            at.background_jobs.pop(0)
+            try:
+                status = future.result()
+            except Exception:
+                at.internalWriteError(job.root)
+            else:
+                at.finishBackgroundWrite(job, status)
+        if at.background_jobs:
+            return False
+        if at.background_report:
+            files, all, dirty = at.background_report
+            at.background_report = None
+            at.reportEndOfWrite(files, all, dirty)
+            if c.orphan_at_file_nodes:
+                c.raise_error_dialogs(kind='write')
+        return True
+    #@+node:ekr.20191110141901.3: *7* at.finishBackgroundWrite
+    def finishBackgroundWrite(self, job, status):
+        """
+        Handle the results of one background write in the main thread.
+        status is the value returned by bat.writeSnapshot.
+        """
+        at, c = self, self.c
+        bat, fileName, root = job.bat, job.fileName, job.root
+        for func, args, keys in bat.messages:
+            func(*args, **keys)
+        for key, n in bat.write_stats.items():
+            at.write_stats[key] += n
+        if bat.orphaned:
+            # Like at.addToOrphanList. root may no longer exist.
+            job.v.setOrphan()
+            c.orphan_at_file_nodes.append(job.v.h)
+        if not status:
+            return
+        if bat.write_record:
+            c.db[at.writeRecordKey(fileName)] = bat.write_record
+        sfn = g.shortFileName(fileName)
+        timestamp = at.getWriteTimeStamp()
+        if status == 'unchanged':
+            at.sameFiles += 1
+            if not g.unitTesting and c.config.getBool('report-unchanged-files', default=True):
+                g.es(f"{timestamp}unchanged: {sfn}")
+        else:
+            c.setFileTimeStamp(fileName)
+            if not g.unitTesting:
+                g.es(f"{timestamp}{status}: {fileName if status == 'created' else sfn}")
+        if c.positionExists(root):
+            at.checkPythonCode(bat.contents, fileName, root,
+                pyflakes_errors_only=status == 'unchanged')
+    #@+node:ekr.20191110141901.4: *6* at.isWritingInBackground
+    def isWritingInBackground(self, fileName):
+        """Return True if a background write of fileName has not been reported."""
+        if not self.background_jobs:
+            return False
+        fileName = g.os_path_realpath(fileName)
+        return any(job.fileName == fileName for future, job in self.background_jobs)
+    #@+node:ekr.20191110141901.5: *6* at.snapshotTree
+    def snapshotTree(self, root):
+        """
+        Return a position for a copy of root's tree.
+
+        The copies have the same gnxs, headlines, bodies and structure as
+        the originals, including clones within the tree, but the tree
+        shares no lists with the outline. The copy of root is the only
+        top-level node of its own hidden root.
+        """
+        hidden = copy.copy(root.v.context.hiddenRootNode)
+        hidden.children, hidden.parents = [], []
+        hidden.context = context = g.Bunch(hiddenRootNode=hidden)
+        d = {} # Keys are vnodes, values are copies.
+        level0 = len(root.stack)
+        t = leoNodes.Traverser()
+        for v, childIndex, level in t.walk_tree(root):
+            parent = d[t.stack[-1][0]] if level > level0 else hidden
+            v2 = d.get(v)
+            if v2:
+                # A clone: its children have already been copied.
+                t.prune()
+            else:
+                v2 = d[v] = copy.copy(v)
+                v2.children, v2.parents = [], []
+                v2.context = context
+            parent.children.append(v2)
+            v2.parents.append(parent)
+        return leoNodes.Position(d[root.v])
+    #@+node:ekr.20191110141901.6: *6* at.startBackgroundTimer
+    def startBackgroundTimer(self):
+        """Call at.finishBackgroundWrites at idle time until all writes finish."""
+        at = self
+        if at.background_timer:
+            return
+
+        def handler(timer):
+            if at.finishBackgroundWrites():
+                timer.stop()
+                at.background_timer = None
+
+        timer = g.IdleTime(handler, delay=100, tag='at.finishBackgroundWrites')
+        if timer:
+            at.background_timer = timer
+            timer.start()
+        else:
+            # No idle-time events: wait for the writes here.
+            at.finishBackgroundWrites(wait=True)
+    #@+node:ekr.20191110141901.7: *6* at.startBackgroundWrite
+    def startBackgroundWrite(self, root, sentinels=True):
+        """
+        Write the @asis, @clean, @file or @nosent node at root in a worker thread.
+
+        at.snapshotTree copies root's tree in the main thread, so edits
+        made while the worker runs can't change the written file.
+        at.finishBackgroundWrites reports the results in the main thread.
+        """
+        at, c = self, self.c
+        c.endEditing()
+        isAsis = root.isAtAsisFileNode()
+        name = root.atAsisFileNodeName() if isAsis else root.anyAtFileNodeName()
+        bat = BackgroundAtFile(c)
+        fileName = bat.initWriteIvars(root, name, sentinels=sentinels)
+        # A pending write of the same file has already passed the precheck.
+        pending = [future for future, job in at.background_jobs if job.fileName == fileName]
+        if not pending and not at.precheck(fileName, root):
+            at.addToOrphanList(root)
+            return
+        writeKey = bat.writeKey(root, fileName, '@asis' if isAsis else '@file')
+        if not pending and at.skipUnchangedFile(fileName, root, writeKey):
+            return
+        root.clearDirty()
+        bat.root = at.snapshotTree(root)
+        if not at.background_executor:
+            import concurrent.futures as futures
+            at.background_executor = futures.ThreadPoolExecutor(
+                max_workers=max(1, at.write_threads),
+                thread_name_prefix='leo-write')
+        future = at.background_executor.submit(bat.writeSnapshot,
+            fileName, isAsis, writeKey, pending[-1] if pending else None)
+        job = g.Bunch(bat=bat, fileName=fileName, root=root.copy(), v=root.v)
+        at.background_jobs.append((future, job),)
     #@+node:ekr.20190109172025.1: *5* at.writeAtAutoContents
     def writeAtAutoContents(self, fileName, root):
         '''Common helper for atAutoToString and writeOneAtAutoNode.'''
@@ -1268,11 +1581,14 @@ class AtFile:
             if not at.precheck(fileName, root):
                 at.addToOrphanList(root)
                 return
+            writeKey = at.writeKey(root, fileName, '@asis')
+            if at.skipUnchangedFile(fileName, root, writeKey):
+                return
             at.openOutputStream()
             for p in root.self_and_subtree(copy=False):
                 at.writeAsisNode(p)
             contents = at.closeOutputStream()
-            at.replaceFile(contents, at.encoding, fileName, root)
+            at.replaceFile(contents, at.encoding, fileName, root, writeKey=writeKey)
         except Exception:
             at.writeException(fileName, root)
 
@@ -1304,6 +1620,9 @@ class AtFile:
             if not at.precheck(fileName, root):
                 at.addToOrphanList(root)
                 return
+            writeKey = at.writeKey(root, fileName, '@file')
+            if at.skipUnchangedFile(fileName, root, writeKey):
+                return
             at.openOutputStream()
             at.putFile(root, sentinels=sentinels)
             at.warnAboutOrphandAndIgnoredNodes()
@@ -1312,7 +1631,7 @@ class AtFile:
                 g.es("not written:", g.shortFileName(fileName))
                 at.addToOrphanList(root)
             else:
-                at.replaceFile(contents, at.encoding, fileName, root)
+                at.replaceFile(contents, at.encoding, fileName, root, writeKey=writeKey)
         except Exception:
             if hasattr(self.root.v, 'tnodeList'):
                 delattr(self.root.v, 'tnodeList')
@@ -1902,7 +2221,7 @@ class AtFile:
             # @ignore must not stop expansion here!
             return True
         if p.isAtIgnoreNode():
-            g.error('did not write @ignore node', p.v.h)
+            at.message(g.error, 'did not write @ignore node', p.v.h)
             return False
         return True
     #@+node:ekr.20041005105605.174: *6* at.putCodeLine
@@ -1989,7 +2308,7 @@ class AtFile:
             for ch, j in (('<', n1 + 2), ('>', n2 + 2)):
                 if g.match(s, j, ch):
                     line = g.get_line(s, i)
-                    g.es('dubious brackets in', line)
+                    self.message(g.es, 'dubious brackets in', line)
                     break
             name = s[n1:n2+2]
             return name, n1, n2+2
@@ -2650,33 +2969,36 @@ class AtFile:
                 if line:
                     self.putSentinel("@comment " + line)
     #@+node:ekr.20190111172114.1: *5* at.replaceFile & helpers
-    def replaceFile(self, contents, encoding, fileName, root, ignoreBlankLines=False):
+    def replaceFile(self, contents, encoding, fileName, root,
+        ignoreBlankLines=False, writeKey=None,
+    ):
         '''
         Write or create the given file from the contents.
         Return True if the original file was changed.
+
+        writeKey: None or the result of at.writeKey. If given, remember the
+        file's state so that at.skipUnchangedFile can skip the next write.
         '''
         at, c = self, self.c
         if root:
             root.clearDirty()
-        #
-        # Create the timestamp (only for messages).
-        if c.config.getBool('log-show-save-time', default=False):
-            format = c.config.getString('log-timestamp-format') or "%H:%M:%S"
-            timestamp = time.strftime(format) + ' '
-        else:
-            timestamp = ''
+        at.write_stats['generated'] += 1
+        timestamp = at.getWriteTimeStamp()
         #
         # Adjust the contents.
         assert g.isUnicode(contents), g.callers()
         if at.output_newline != '\n':
             contents = contents.replace('\r', '').replace('\n', at.output_newline)
+        data = g.toEncodedString(contents, encoding=encoding)
         #
         # If file does not exist, create it from the contents.
         fileName = g.os_path_realpath(fileName)
         sfn = g.shortFileName(fileName)
         if not g.os_path_exists(fileName):
-            ok = g.writeFile(contents, encoding, fileName)
+            ok = g.writeFile(data, encoding, fileName)
             if ok:
+                at.write_stats['written'] += 1
+                at.putWriteRecord(fileName, writeKey, data)
                 c.setFileTimeStamp(fileName)
                 if not g.unitTesting:
                     g.es(f"{timestamp}created: {fileName}")
@@ -2690,12 +3012,25 @@ class AtFile:
             return False # No change to original file.
         #
         # Compare the old and new contents.
-        old_contents = g.readFileIntoUnicodeString(fileName,
-            encoding=at.encoding, silent=True)
-        unchanged = (
-            contents == old_contents or
-            (not at.explicitLineEnding and at.compareIgnoringLineEndings(old_contents, contents)) or
-            ignoreBlankLines and at.compareIgnoringBlankLines(old_contents, contents))
+        record = writeKey and c.db.get(at.writeRecordKey(fileName))
+        if (
+            record and record.get('md5') == hashlib.md5(data).hexdigest()
+            and at.fileMatchesWriteRecord(fileName, record)
+        ):
+            # The file contains exactly the new contents.
+            old_contents, unchanged = None, True
+            at.putWriteRecord(fileName, writeKey, data)
+        else:
+            at.write_stats['compared'] += 1
+            old_contents = g.readFileIntoUnicodeString(fileName,
+                encoding=at.encoding, silent=True)
+            unchanged = (
+                contents == old_contents or
+                (not at.explicitLineEnding and at.compareIgnoringLineEndings(old_contents, contents)) or
+                ignoreBlankLines and at.compareIgnoringBlankLines(old_contents, contents))
+            if unchanged:
+                # The file may differ from the contents in its line endings.
+                at.putWriteRecord(fileName, writeKey, data if contents == old_contents else None)
         if unchanged:
             at.sameFiles += 1
             if not g.unitTesting and c.config.getBool('report-unchanged-files', default=True):
@@ -2713,8 +3048,10 @@ class AtFile:
                 g.warning("correcting line endings in:", fileName)
         #
         # Write a changed file.
-        ok = g.writeFile(contents, encoding, fileName)
+        ok = g.writeFile(data, encoding, fileName)
         if ok:
+            at.write_stats['written'] += 1
+            at.putWriteRecord(fileName, writeKey, data)
             c.setFileTimeStamp(fileName)
             if not g.unitTesting:
                 g.es(f"{timestamp}wrote: {sfn}")
@@ -2748,6 +3085,130 @@ class AtFile:
         s1 = s1.replace('\r', '')
         s2 = s2.replace('\r', '')
         return s1 == s2
+    #@+node:ekr.20191110130435.3: *6* at.fileMatchesWriteRecord
+    def fileMatchesWriteRecord(self, fileName, record):
+        """
+        Return True if fileName still contains the bytes described by the
+        record that at.putWriteRecord saved.
+
+        Like the external file cacher, don't trust a time stamp close to the
+        time the record was saved. Hash the file instead.
+        """
+        at, c = self, self.c
+        try:
+            st = os.stat(fileName)
+        except OSError:
+            return False
+        if st.st_size != record.get('size'):
+            return False
+        if (
+            st.st_mtime == record.get('mtime')
+            and st.st_mtime < record.get('stamp', 0) - at.write_racy_delta
+        ):
+            return True
+        try:
+            with open(fileName, 'rb') as f:
+                md5 = hashlib.md5(f.read()).hexdigest()
+        except Exception:
+            return False
+        if md5 != record.get('md5'):
+            return False
+        # The file has been touched, but not changed.
+        record['mtime'] = st.st_mtime
+        record['stamp'] = time.time()
+        c.db[at.writeRecordKey(fileName)] = record
+        return True
+    #@+node:ekr.20191110130435.5: *6* at.getWriteTimeStamp
+    def getWriteTimeStamp(self):
+        """Return the timestamp used in messages about written files."""
+        c = self.c
+        if c.config.getBool('log-show-save-time', default=False):
+            format = c.config.getString('log-timestamp-format') or "%H:%M:%S"
+            return time.strftime(format) + ' '
+        return ''
+    #@+node:ekr.20191110130435.4: *6* at.make/putWriteRecord & writeRecordKey
+    def makeWriteRecord(self, fileName, writeKey, data):
+        """
+        Return the write record for fileName, or None.
+
+        data is the file's contents, or None if the contents on disk differ
+        from data only in line endings.
+
+        This method does not use c, so worker threads may call it.
+        """
+        if not writeKey:
+            return None
+        try:
+            st = os.stat(fileName)
+            if data is None:
+                with open(fileName, 'rb') as f:
+                    data = f.read()
+        except Exception:
+            return None
+        return {
+            'key': writeKey,
+            'md5': hashlib.md5(data).hexdigest(),
+            'size': st.st_size,
+            'mtime': st.st_mtime,
+            'stamp': time.time(),
+        }
+
+    def putWriteRecord(self, fileName, writeKey, data):
+        """
+        Remember that fileName was generated from the tree described by
+        writeKey. data is as in at.makeWriteRecord.
+        """
+        at, c = self, self.c
+        record = at.makeWriteRecord(fileName, writeKey, data)
+        if record:
+            c.db[at.writeRecordKey(fileName)] = record
+
+    def writeRecordKey(self, fileName):
+        """Return the c.db key for the write record of fileName."""
+        return 'at-file-write:' + g.os_path_normcase(g.os_path_realpath(fileName))
+    #@+node:ekr.20191110130435.2: *6* at.skipUnchangedFile
+    def skipUnchangedFile(self, fileName, root, writeKey):
+        """
+        Return True if neither root's tree nor fileName have changed since
+        Leo last wrote fileName from root's tree.
+        """
+        at, c = self, self.c
+        if not writeKey:
+            return False
+        record = c.db.get(at.writeRecordKey(fileName))
+        if not record or record.get('key') != writeKey:
+            return False
+        if not at.fileMatchesWriteRecord(fileName, record):
+            return False
+        root.clearDirty()
+        at.sameFiles += 1
+        at.write_stats['skipped'] += 1
+        if not g.unitTesting and c.config.getBool('report-unchanged-files', default=True):
+            g.es(f"{at.getWriteTimeStamp()}unchanged: {g.shortFileName(fileName)}")
+        return True
+    #@+node:ekr.20191110130435.1: *6* at.writeKey
+    def writeKey(self, root, fileName, kind):
+        """
+        Return a hash of everything that affects the contents of the external
+        file written from root, or None if the contents can't be predicted.
+
+        at.initWriteIvars must already have been called.
+        """
+        at, c = self, self.c
+        initial_comment = c.config.output_initial_comment or ''
+        if at.runPyFlakesOnWrite or '@date' in initial_comment:
+            return None
+        import leo.core.leoVersion as leoVersion
+        settings = (
+            leoVersion.version, kind, g.os_path_realpath(fileName),
+            at.sentinels, at.encoding, at.output_newline, at.explicitLineEnding,
+            at.language, at.startSentinelComment, at.endSentinelComment,
+            at.tab_width, at.page_width, at.force_newlines_in_at_nosent_bodies,
+            at.underindentEscapeString, initial_comment,
+        )
+        h = hashlib.md5(repr(settings).encode('utf-8', 'replace'))
+        h.update(at.cleanTreeHash(root).encode('ascii'))
+        return h.hexdigest()
     #@+node:ekr.20041005105605.216: *5* at.warnAboutOrpanAndIgnoredNodes
     # Called from putFile.
 
@@ -2760,7 +3221,7 @@ class AtFile:
             if not p.v.isVisited():
                 at.writeError("Orphan node:  " + p.h)
                 if p.hasParent():
-                    g.blue("parent node:", p.parent().h)
+                    at.message(g.blue, "parent node:", p.parent().h)
         p = root.copy()
         after = p.nodeAfterTree()
         while p and p != after:
@@ -2771,14 +3232,14 @@ class AtFile:
                 if p.isOrphan():
                     at.writeError("Orphan node: " + p.h)
                     if p.hasParent():
-                        g.blue("parent node:", p.parent().h)
+                        at.message(g.blue, "parent node:", p.parent().h)
                 p.moveToThreadNext()
     #@+node:ekr.20041005105605.217: *5* at.writeError
     def writeError(self, message):
         '''Issue an error while writing an @<file> node.'''
         at = self
         if at.errors == 0:
-            g.es_error("errors writing: " + at.targetFileName)
+            at.message(g.es_error, "errors writing: " + at.targetFileName)
         at.error(message)
         at.addToOrphanList(at.root)
     #@+node:ekr.20041005105605.218: *5* at.writeException
@@ -2804,13 +3265,20 @@ class AtFile:
         """Print an error message that may contain non-ascii characters."""
         at = self
         if at.errors:
-            g.error(*args)
+            at.message(g.error, *args)
         else:
-            g.warning(*args)
+            at.message(g.warning, *args)
     #@+node:ekr.20041005105605.221: *4* at.exception
     def exception(self, message):
         self.error(message)
         g.es_exception()
+    #@+node:ekr.20191110141901.8: *4* at.message
+    def message(self, func, *args, **keys):
+        """
+        Call func(*args, **keys), where func is g.es, g.error or a similar
+        function. BackgroundAtFile.message defers the call to the main thread.
+        """
+        func(*args, **keys)
     #@+node:ekr.20050104131929: *4* at.file operations...
     #@+at The difference, if any, between these methods and the corresponding g.utils_x
     # functions is that these methods may call self.error.
@@ -3067,6 +3535,153 @@ class AtFile:
     #@-others
 
 atFile = AtFile # compatibility
+#@+node:ekr.20191110141901.9: ** class BackgroundAtFile
+class BackgroundAtFile(AtFile):
+    """
+    An AtFile that writes one external file in a worker thread.
+
+    at.startBackgroundWrite creates instances in the main thread and sets
+    bat.root to a snapshot of the @<file> tree. Instances never touch the
+    outline or the log: at.finishBackgroundWrite reports their messages and
+    errors in the main thread.
+    """
+
+    def __init__(self, c):
+        super().__init__(c)
+        self.contents = None
+            # The generated contents, for at.checkPythonCode.
+        self.messages = []
+            # A list of (func, args, keys) tuples. See bat.message.
+        self.orphaned = False
+            # True: the write failed. See bat.addToOrphanList.
+        self.write_record = None
+            # The record to be saved by at.finishBackgroundWrite.
+
+    #@+others
+    #@+node:ekr.20191110141901.11: *3* bat.addToOrphanList & exception & message
+    def addToOrphanList(self, root):
+        """Remember to mark the original root as erroneous."""
+        self.orphaned = True
+
+    def exception(self, message):
+        self.error(message)
+        self.message(g.es_print, traceback.format_exc(), color='red')
+
+    def message(self, func, *args, **keys):
+        """Defer func(*args, **keys) to the main thread."""
+        self.messages.append((func, args, keys),)
+    #@+node:ekr.20191110145614.1: *3* bat.writeFileAtomically
+    def writeFileAtomically(self, fileName, data):
+        """
+        Write data to fileName. Replace an existing file in a single step,
+        so that a crash can't leave a partially written file.
+        """
+        if not g.os_path_exists(fileName):
+            with open(fileName, 'wb') as f:
+                f.write(data)
+            return
+        mode = stat.S_IMODE(os.stat(fileName).st_mode)
+        fd, tempName = tempfile.mkstemp(
+            prefix=g.shortFileName(fileName) + '.',
+            suffix='.tmp',
+            dir=g.os_path_dirname(fileName))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.chmod(tempName, mode)
+            os.replace(tempName, fileName)
+        except Exception:
+            if os.path.exists(tempName):
+                os.remove(tempName)
+            raise
+    #@+node:ekr.20191110145614.2: *3* bat.writeSnapshot
+    def writeSnapshot(self, fileName, isAsis, writeKey, previous=None):
+        """
+        Generate the external file from bat.root and write it if it has
+        changed. Called in a worker thread.
+
+        previous: None, or the future of an earlier write of the same file.
+
+        Return 'created', 'unchanged' or 'wrote', or None if there were errors.
+        """
+        at = self
+        if previous:
+            previous.exception()
+                # Wait for the earlier write. Its errors have been reported.
+        try:
+            at.openOutputStream()
+            if isAsis:
+                for p in at.root.self_and_subtree(copy=False):
+                    at.writeAsisNode(p)
+            else:
+                at.putFile(at.root, sentinels=at.sentinels)
+                at.warnAboutOrphandAndIgnoredNodes()
+            contents = at.closeOutputStream()
+            if at.errors:
+                at.message(g.es, "not written:", g.shortFileName(fileName))
+                at.addToOrphanList(at.root)
+                return None
+            at.write_stats['generated'] += 1
+            if at.output_newline != '\n':
+                contents = contents.replace('\r', '').replace('\n', at.output_newline)
+            at.contents = contents
+            data = g.toEncodedString(contents, encoding=at.encoding)
+            if not g.os_path_exists(fileName):
+                at.writeFileAtomically(fileName, data)
+                at.write_stats['written'] += 1
+                at.write_record = at.makeWriteRecord(fileName, writeKey, data)
+                return 'created'
+            at.write_stats['compared'] += 1
+            with open(fileName, 'rb') as f:
+                old_data = f.read()
+            if old_data == data:
+                at.write_record = at.makeWriteRecord(fileName, writeKey, data)
+                return 'unchanged'
+            old_contents = g.toUnicode(old_data, encoding=at.encoding)
+            same = at.compareIgnoringLineEndings(old_contents, contents)
+            if same and not at.explicitLineEnding:
+                at.write_record = at.makeWriteRecord(fileName, writeKey, None)
+                return 'unchanged'
+            if at.explicitLineEnding and not same:
+                # Like at.replaceFile.
+                at.message(g.warning, "correcting line endings in:", fileName)
+            at.writeFileAtomically(fileName, data)
+            at.write_stats['written'] += 1
+            at.write_record = at.makeWriteRecord(fileName, writeKey, data)
+            return 'wrote'
+        except Exception:
+            at.message(g.error, "exception writing:", fileName)
+            at.message(g.es_print, traceback.format_exc(), color='red')
+            at.addToOrphanList(at.root)
+            return None
+    #@-others
+#@+node:ekr.20191020091836.2: ** function: parse_external_file
+def parse_external_file(fn, root_gnx, encoding):
+    """
+    Read and parse the external file fn without using a commander.
+
+    Return the data for fast_at.graft, or None if at.read must handle the
+    file in the usual way. This function runs in worker processes.
+    """
+    try:
+        with open(fn, 'rb') as f:
+            s = f.read()
+        e, s = g.stripBOM(s)
+        if not e:
+            # Get the encoding from the @+leo sentinel, as at.scanHeader does.
+            s_temp = s.decode('ascii', 'replace').replace('\r\n', '\n')
+            for line in g.splitLines(s_temp):
+                m = FastAtRead.header_pattern.match(line)
+                if m:
+                    e = (m.group(6) or encoding).rstrip(',')
+                    break
+            else:
+                return None
+        s = s.decode(e, 'strict').replace('\r\n', '\n')
+    except Exception:
+        # Let at.read report the error.
+        return None
+    return FastAtRead(c=None, gnx2vnode={}).parse(s, fn, root_gnx)
 #@+node:ekr.20180602102448.1: ** class FastAtRead
 class FastAtRead:
     '''
@@ -3114,6 +3729,123 @@ class FastAtRead:
         )
         # Return the compiled patterns, in alphabetical order.
         return (re.compile(pattern) for pattern in patterns)
+    #@+node:ekr.20191020064944.1: *3* fast_at.graft
+    def graft(self, data):
+        '''
+        Create and link the vnodes described by data, the result of
+        fast_at.scan_lines. Return (root_v, last_lines).
+
+        Only this method uses gnx2vnode, so the clone logic is the same
+        no matter how the data was computed.
+        '''
+        nodes, gnx2body, last_lines = data
+        #
+        # Init the parent vnode for testing.
+        #
+        if self.test:
+            root_gnx = 'root-gnx'
+                # The node that we are reading.
+                # start with the gnx for the @file node.
+            gnx_head =  '<hidden top vnode>'
+                # The headline of the root node.
+            context = None
+            parent_v = self.VNode(context=context, gnx=root_gnx)
+            parent_v._headString = gnx_head
+                # Corresponds to the @files node itself.
+        else:
+            # Production.
+            root_gnx = self.root.gnx
+            context = self.c
+            parent_v = self.root.v
+        root_v = parent_v
+            # Does not change.
+        clone_v = None
+            # The root of the clone tree.
+            # When not None, we are scanning a clone and all it's descendants.
+        gnx2vnode = self.gnx2vnode
+            # Keys are gnx's, values are vnodes.
+        gnx2vnode[root_gnx] = parent_v
+            # Add gnx to the keys
+        level_stack = [(root_v, False)]
+            # Entries are (vnode, in_clone_tree)
+        root_seen = False
+            # False: The next +@node sentinel denotes the root, regardless of gnx.
+            # Needed to handle #1065 so reads will not create spurious child nodes.
+        #@+<< define dump_v >>
+        #@+node:ekr.20180613061743.1: *4* << define dump_v >>
+        def dump_v():
+            """Dump the level stack and v."""
+            print('----- LEVEL', level, v.h)
+            print('       PARENT', parent_v.h)
+            print('[')
+            for i, data in enumerate(level_stack):
+                v2, in_tree = data
+                print('%2s %5s %s' % (i+1, in_tree, v2.h))
+            print(']')
+            print('PARENT.CHILDREN...')
+            g.printObj([v3.h for v3 in parent_v.children])
+            print('PARENTS...')
+            g.printObj([v4.h for v4 in v.parents])
+        #@-<< define dump_v >>
+        for gnx, head, level in nodes:
+            v = gnx2vnode.get(gnx)
+            #
+            # Case 1: The root @file node. Don't change the headline.
+            if not root_seen:
+                # Fix #1064: The node represents the root, regardless of the gnx!
+                root_seen = True
+                clone_v = None
+                if not v:
+                    # Fix #1064.
+                    v = root_v
+                    # This message is annoying when using git-diff.
+                        # if gnx != root_gnx:
+                            # g.es_print("using gnx from external file: %s" % (v.h), color='blue')
+                    gnx2vnode [gnx] = v
+                    v.fileIndex = gnx
+                v.children = []
+                continue
+            #
+            # Case 2: We are scanning the descendants of a clone.
+            parent_v, clone_v = level_stack[level-2]
+            if v and clone_v:
+                # The last version of the body and headline wins..
+                v._headString = head
+                # Update the level_stack.
+                level_stack = level_stack[:level-1]
+                level_stack.append((v, clone_v),)
+                # Always clear the children!
+                v.children=[]
+                parent_v.children.append(v)
+                continue
+            #
+            # Case 3: we are not already scanning the descendants of a clone.
+            if v:
+                # The *start* of a clone tree. Reset the children.
+                clone_v = v
+                v.children = []
+            else:
+                # Make a new vnode.
+                v = self.VNode(context=context, gnx=gnx)
+            #
+            # The last version of the body and headline wins.
+            gnx2vnode[gnx] = v
+            v._headString = head
+            #
+            # Update the stack.
+            level_stack = level_stack[:level-1]
+            level_stack.append((v, clone_v),)
+            #
+            # Update the links.
+            assert v != root_v
+            parent_v.children.append(v)
+            v.parents.append(parent_v)
+            # dump_v()
+        if gnx2body is None:
+            # No @-leo sentinel.
+            return None, []
+        self.post_pass(gnx2body, gnx2vnode, root_v)
+        return root_v, last_lines
     #@+node:ekr.20180603060721.1: *3* fast_at.post_pass
     def post_pass(self, gnx2body, gnx2vnode, root_v):
         '''Set all body text.'''
@@ -3132,7 +3864,7 @@ class FastAtRead:
             for key in vkeys:
                 v = gnx2vnode.get(key)
                 body = gnx2body.get(key)
-                v._bodyString = ''.join(body)
+                v._bodyString = body
         else:
             assert root_v.gnx in gnx2vnode, root_v
             assert root_v.gnx in gnx2body, root_v
@@ -3141,7 +3873,7 @@ class FastAtRead:
                 body = gnx2body.get(key)
                 v = gnx2vnode.get(key)
                 assert v, (key, v)
-                v._bodyString = g.toUnicode(''.join(body))
+                v._bodyString = g.toUnicode(body)
     #@+node:ekr.20180602103135.2: *3* fast_at.scan_header
     header_pattern = re.compile(r'''
         ^(.+)@\+leo
@@ -3165,17 +3897,20 @@ class FastAtRead:
             first_lines.append(line)
         return None
     #@+node:ekr.20180602103135.8: *3* fast_at.scan_lines
-    def scan_lines(self, delims, first_lines, lines, path, start, test=False):
-        '''Scan all lines of the file, creating vnodes.'''
+    def scan_lines(self, delims, first_lines, lines, path, start, root_gnx):
+        '''
+        Scan all lines of the file, *without* creating vnodes.
+
+        Return (nodes, gnx2body, last_lines), a picklable description of the
+        file. gnx2body is None if there is no @-leo sentinel.
+        fast_at.graft creates the vnodes.
+        '''
         #@+<< init scan_lines >>
         #@+node:ekr.20180602103135.9: *4* << init scan_lines >>
         #
         # Simple vars...
         afterref = False
             # A special verbatim line follows @afterref.
-        clone_v = None
-            # The root of the clone tree.
-            # When not None, we are scanning a clone and all it's descendants.
         delim_start, delim_end = delims
             # The start/end delims.
         doc_skip = (delim_start + '\n', delim_end + '\n')
@@ -3190,13 +3925,8 @@ class FastAtRead:
             # True: cweb hack in effect.
         indent = 0 
             # The current indentation.
-        level_stack = []
-            # Entries are (vnode, in_clone_tree)
         n_last_lines = 0
             # The number of @@last directives seen.
-        root_seen = False
-            # False: The next +@node sentinel denotes the root, regardless of gnx.
-            # Needed to handle #1065 so reads will not create spurious child nodes.
         sentinel = delim_start + '@'
             # Faster than a regex!
         stack = []
@@ -3209,62 +3939,23 @@ class FastAtRead:
         #
         # Init the data for the root node.
         #
-
-        #
-        # Init the parent vnode for testing.
-        #
-        if self.test:
-            root_gnx = gnx = 'root-gnx'
-                # The node that we are reading.
-                # start with the gnx for the @file node.
-            gnx_head =  '<hidden top vnode>'
-                # The headline of the root node.
-            context = None
-            parent_v = self.VNode(context=context, gnx=gnx)
-            parent_v._headString = gnx_head
-                # Corresponds to the @files node itself.
-        else:
-            # Production.
-            root_gnx = gnx = self.root.gnx
-            context = self.c
-            parent_v = self.root.v
-        root_v = parent_v
-            # Does not change.
-        level_stack.append((root_v, False),)
-        #
-        # Init the gnx dict last.
-        #
-        gnx2vnode = self.gnx2vnode
-            # Keys are gnx's, values are vnodes.
+        gnx = root_gnx
+            # The node that we are reading.
+            # start with the gnx for the @file node.
         gnx2body = {}
             # Keys are gnxs, values are list of body lines.
-        gnx2vnode[gnx] = parent_v
-            # Add gnx to the keys
         gnx2body[gnx] = body = first_lines
             # Add gnx to the keys.
             # Body is the list of lines presently being accumulated.
+        nodes = []
+            # Entries are (gnx, head, level), in file order.
+            # fast_at.graft creates and links the vnodes.
         #
         # get the patterns.
         after_pat, all_pat, code_pat, comment_pat, delims_pat,\
         doc_pat, end_raw_pat, first_pat, last_pat, \
         node_start_pat, others_pat, raw_pat, ref_pat = self.get_patterns(delims)
         #@-<< init scan_lines >>
-        #@+<< define dump_v >>
-        #@+node:ekr.20180613061743.1: *4* << define dump_v >>
-        def dump_v():
-            """Dump the level stack and v."""
-            print('----- LEVEL', level, v.h)
-            print('       PARENT', parent_v.h)
-            print('[')
-            for i, data in enumerate(level_stack):
-                v2, in_tree = data
-                print('%2s %5s %s' % (i+1, in_tree, v2.h))
-            print(']')
-            print('PARENT.CHILDREN...')
-            g.printObj([v3.h for v3 in parent_v.children])
-            print('PARENTS...')
-            g.printObj([v4.h for v4 in v.parents])
-        #@-<< define dump_v >>
         i = 0 # To keep pylint happy.
         for i, line in enumerate(lines[start:]):
             # Order matters.
@@ -3360,62 +4051,9 @@ class FastAtRead:
                 gnx, head = m.group(2), m.group(5)
                 level = int(m.group(3)) if m.group(3) else 1 + len(m.group(4))
                     # m.group(3) is the level number, m.group(4) is the number of stars.
-                v = gnx2vnode.get(gnx)
-                #
-                # Case 1: The root @file node. Don't change the headline.
-                if not root_seen:
-                    # Fix #1064: The node represents the root, regardless of the gnx!
-                    root_seen = True
-                    clone_v = None
-                    gnx2body[gnx] = body = []
-                    if not v:
-                        # Fix #1064.
-                        v = root_v
-                        # This message is annoying when using git-diff.
-                            # if gnx != root_gnx:
-                                # g.es_print("using gnx from external file: %s" % (v.h), color='blue')
-                        gnx2vnode [gnx] = v
-                        v.fileIndex = gnx
-                    v.children = []
-                    continue
-                #
-                # Case 2: We are scanning the descendants of a clone.
-                parent_v, clone_v = level_stack[level-2]
-                if v and clone_v:
-                    # The last version of the body and headline wins..
-                    gnx2body[gnx] = body = []
-                    v._headString = head
-                    # Update the level_stack.
-                    level_stack = level_stack[:level-1]
-                    level_stack.append((v, clone_v),)
-                    # Always clear the children!
-                    v.children=[]
-                    parent_v.children.append(v)
-                    continue
-                #
-                # Case 3: we are not already scanning the descendants of a clone.
-                if v:
-                    # The *start* of a clone tree. Reset the children.
-                    clone_v = v
-                    v.children = []
-                else:
-                    # Make a new vnode.
-                    v = self.VNode(context=context, gnx=gnx)
-                #
-                # The last version of the body and headline wins.
-                gnx2vnode[gnx] = v
+                nodes.append((gnx, head, level),)
+                # The last version of the body wins.
                 gnx2body[gnx] = body = []
-                v._headString = head
-                #
-                # Update the stack.
-                level_stack = level_stack[:level-1]
-                level_stack.append((v, clone_v),)
-                #
-                # Update the links.
-                assert v != root_v
-                parent_v.children.append(v)
-                v.parents.append(parent_v)
-                # dump_v()
                 continue
             #@-<< handle node_start >>
             #@+<< handle end of @doc & @code parts >>
@@ -3616,41 +4254,64 @@ class FastAtRead:
             #@-<< Last 3. handle remaining @ lines >>
         else:
             # No @-leo sentinel
-            return None, []
+            return nodes, None, []
         # Handle @last lines.
         last_lines = lines[start+i:]
         if last_lines:
             last_lines = ['@last ' + z for z in last_lines]
             gnx2body[root_gnx] = gnx2body[root_gnx] + last_lines
-        self.post_pass(gnx2body, gnx2vnode, root_v)
-        return root_v, last_lines
-    #@+node:ekr.20180603170614.1: *3* fast_at.read_into_root
-    def read_into_root(self, contents, path, root):
+        # Join the bodies here, so the result is compact and picklable.
+        gnx2body = {key: ''.join(body) for key, body in gnx2body.items()}
+        return nodes, gnx2body, last_lines
+    #@+node:ekr.20191020064944.2: *3* fast_at.parse
+    def parse(self, contents, path, root_gnx):
         '''
-        Parse the file's contents, creating a tree of vnodes
-        anchored in root.v.
+        Parse the file's contents without creating any vnodes.
+
+        Return the data for fast_at.graft, or None if the file is invalid.
+        The data contains only strings, so it may be cached or computed in
+        another process.
         '''
         trace = False
         t1 = time.process_time()
         self.path = path
-        self.root = root
         sfn = g.shortFileName(path)
         contents = contents.replace('\r','')
         lines = g.splitLines(contents)
         data = self.scan_header(lines)
         if not data:
             g.trace(f"Invalid external file: {sfn}")
-            return False
-        # Clear all children.
-        # Previously, this had been done in readOpenFile.
-        root.v._deleteAllChildren()
+            return None
         delims, first_lines, start_i = data
-        self.scan_lines(
-            delims, first_lines, lines, path, start_i)
+        result = self.scan_lines(
+            delims, first_lines, lines, path, start_i, root_gnx)
         if trace:
             t2 = time.process_time()
             g.trace('%5.2f sec. %s' % ((t2-t1), path))
+        return result
+    #@+node:ekr.20180603170614.1: *3* fast_at.read_into_root
+    def read_into_root(self, contents, path, root):
+        '''
+        Parse the file's contents, creating a tree of vnodes
+        anchored in root.v.
+        '''
+        data = self.parse(contents, path, root.gnx)
+        if not data:
+            return False
+        self.graft_into_root(data, path, root)
         return True
+    #@+node:ekr.20191020064944.3: *3* fast_at.graft_into_root
+    def graft_into_root(self, data, path, root):
+        '''
+        Replace root's tree by the tree described by data,
+        the result of fast_at.parse.
+        '''
+        self.path = path
+        self.root = root
+        # Clear all children.
+        # Previously, this had been done in readOpenFile.
+        root.v._deleteAllChildren()
+        self.graft(data)
     #@-others
 #@-others
 #@@language python
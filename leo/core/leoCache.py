@@ -5,9 +5,11 @@
 #@+node:ekr.20100208223942.10436: ** << imports >> (leoCache)
 import leo.core.leoGlobals as g
 import fnmatch
+import hashlib
 import pickle
 import os
 import stat
+import time
 import zlib
 import sqlite3
 #@-<< imports >>
@@ -132,6 +134,168 @@ class CommanderWrapper:
     def __setitem__ (self, key, value):
         self.user_keys.add(key)
         self.db[f"{self.key}:::{key}"] = value
+#@+node:ekr.20191020072657.1: ** class ExternalFileCacher
+class ExternalFileCacher:
+    """
+    A singleton, content-addressed cache of parsed external files, g.app.file_cacher.
+
+    Keys are full paths. Values are dicts describing the file's size,
+    modification time and md5 hash, along with the data computed from the
+    file. The data is valid only while the file's contents and the
+    caller's key (for example, the root's gnx) remain unchanged.
+    """
+
+    racy_delta = 2.0
+        # Time stamps within this many seconds of caching are suspect.
+
+    def __init__(self):
+        """Ctor for the ExternalFileCacher class."""
+        self.enabled = g.app.use_file_cache
+            # False: --no-file-cache.
+        self.fingerprints = {}
+            # Keys are paths, values are (size, mtime, md5) tuples computed by get.
+        self.invalidated = []
+            # Entries are (path, reason) tuples.
+        self.stats = {
+            'hits': 0, # Size and mtime matched.
+            'touched': 0, # The mtime changed, the contents did not.
+            'new': 0, # No entry.
+            'changed': 0, # The contents changed.
+            'outline': 0, # The caller's key changed.
+            'stored': 0,
+        }
+        self.db = {}
+        if self.enabled:
+            try:
+                path = join(g.app.homeLeoDir, 'db', 'file_cache')
+                self.db = SqlitePickleShare(path)
+            except Exception:
+                self.db = {}
+
+    #@+others
+    #@+node:ekr.20191020072657.2: *3* file_cacher.begin/commit_and_close
+    def begin(self):
+        """Start a transaction. The next commit ends it."""
+        if hasattr(self.db, 'conn') and not self.db.conn.in_transaction:
+            # pylint: disable=no-member
+            self.db.conn.execute('begin')
+
+    def commit_and_close(self):
+        # Careful: self.db may be a dict.
+        if hasattr(self.db, 'conn'):
+            # pylint: disable=no-member
+            self.commit()
+            self.db.conn.close()
+            self.db = {}
+
+    def commit(self):
+        # Careful: self.db may be a dict.
+        if hasattr(self.db, 'conn') and self.db.conn.in_transaction:
+            # pylint: disable=no-member
+            self.db.conn.commit()
+    #@+node:ekr.20191020072657.3: *3* file_cacher.clear
+    def clear(self):
+        """Clear the external file cache."""
+        try:
+            self.db.clear()
+        except Exception:
+            g.trace('unexpected exception')
+            g.es_exception()
+            self.db = {}
+        self.fingerprints = {}
+    #@+node:ekr.20191020072657.4: *3* file_cacher.content_hash
+    def content_hash(self, fn):
+        """Return the md5 hash of the contents of file fn, or None."""
+        try:
+            with open(fn, 'rb') as f:
+                return hashlib.md5(f.read()).hexdigest()
+        except Exception:
+            return None
+    #@+node:ekr.20191020072657.5: *3* file_cacher.get
+    def get(self, fn, kind, key):
+        """
+        Return the data cached for file fn, or None.
+
+        kind: the kind of data: '@file' or '@clean'.
+        key:  any picklable value. It must match the value given to put.
+
+        On a miss, remember the file's fingerprint for file_cacher.put.
+        Computing the fingerprint *before* the caller reads the file
+        ensures that a file changed during the read will be read again.
+        """
+        if not self.enabled:
+            return None
+        try:
+            st = os.stat(fn)
+        except OSError:
+            return None
+        size, mtime = st.st_size, st.st_mtime
+        db_key = self.db_key(fn)
+        entry = self.db.get(db_key)
+        same_key = bool(entry) and entry['kind'] == kind and entry['key'] == key
+        if (
+            same_key and entry['size'] == size and entry['mtime'] == mtime
+            # Like git, don't trust a time stamp close to the time of caching.
+            and mtime < entry['stamp'] - self.racy_delta
+        ):
+            self.stats['hits'] += 1
+            return entry['data']
+        md5 = self.content_hash(fn)
+        if md5 is None:
+            return None
+        self.fingerprints[fn] = size, mtime, md5
+        if not entry:
+            reason = 'new'
+        elif entry['md5'] != md5:
+            reason = 'changed'
+        elif same_key:
+            # The file has been touched, but not changed.
+            entry['mtime'] = mtime
+            entry['stamp'] = time.time()
+            self.db[db_key] = entry
+            self.stats['touched'] += 1
+            return entry['data']
+        else:
+            reason = 'outline'
+        self.stats[reason] += 1
+        if reason != 'new':
+            self.invalidated.append((fn, reason))
+        return None
+    #@+node:ekr.20191020072657.6: *3* file_cacher.db_key
+    def db_key(self, fn):
+        """Return the db key for file fn."""
+        return 'fcache:::' + normcase(abspath(fn))
+    #@+node:ekr.20191020072657.7: *3* file_cacher.put
+    def put(self, fn, kind, key, data):
+        """
+        Cache the data computed from file fn.
+        Do nothing unless file_cacher.get has just missed.
+        """
+        fingerprint = self.fingerprints.pop(fn, None)
+        if not self.enabled or not fingerprint:
+            return
+        size, mtime, md5 = fingerprint
+        self.db[self.db_key(fn)] = {
+            'size': size, 'mtime': mtime, 'md5': md5,
+            'kind': kind, 'key': key, 'data': data,
+            'stamp': time.time(),
+        }
+        self.stats['stored'] += 1
+    #@+node:ekr.20191020072657.8: *3* file_cacher.report
+    def report(self):
+        """Report the cache's hits and invalidations."""
+        if not self.enabled:
+            g.es_print('external file cache disabled by --no-file-cache')
+            return
+        d = self.stats
+        g.es_print('external file cache...')
+        for key in ('hits', 'touched', 'new', 'changed', 'outline', 'stored'):
+            g.es_print(f"{key:>8}: {d.get(key)}")
+        if self.invalidated:
+            g.es_print('invalidated files...')
+            for fn, reason in self.invalidated:
+                g.es_print(f"{reason:>8}: {fn}")
+    #@-others
 #@+node:ekr.20180627041556.1: ** class GlobalCacher
 class GlobalCacher:
     """A singleton global cacher, g.app.db"""
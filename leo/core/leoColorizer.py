@@ -9,13 +9,15 @@
 
 #@+<< imports >>
 #@+node:ekr.20140827092102.18575: ** << imports >> (leoColorizer.py)
+import collections
+import os
 import re
 import string
 import sys
 import time
 assert time
 import leo.core.leoGlobals as g
-from leo.core.leoQt import Qsci, QtGui, QtWidgets
+from leo.core.leoQt import Qsci, QtCore, QtGui, QtWidgets
 from leo.core.leoColor import leo_color_database
 #
 # Recover gracefully if pygments can not be imported.
@@ -34,6 +36,43 @@ def make_colorizer(c, widget, wrapper):
     if use_pygments:
         return PygmentsColorizer(c, widget, wrapper)
     return JEditColorizer(c, widget, wrapper)
+#@+node:ekr.20191110191645.1: ** command: build-mode-tables
+@g.command('build-mode-tables')
+def build_mode_tables(event=None):
+    """
+    Build the cached tables for all modes in leo/modes.
+
+    Leo builds each table the first time it uses a mode, so this command
+    just removes that delay.
+    """
+    path = ModeTables.modes_path()
+    n, names = 0, sorted(os.listdir(path))
+    for fn in names:
+        language, ext = os.path.splitext(fn)
+        if ext == '.py' and language != '__init__':
+            if ModeTables.get_table(language, path):
+                n += 1
+    g.es_print(f"built {n} mode tables")
+#@+node:ekr.20191111140839.1: ** command: show-colorizer-stats
+@g.command('show-colorizer-stats')
+def show_colorizer_stats(event=None):
+    """
+    Print the number of lines that the body's colorizer has colored,
+    deferred to idle time and skipped since it started recoloring the
+    entire body.
+    """
+    c = event and event.get('c')
+    if not c:
+        return
+    x = c.frame.body.colorizer
+    if not isinstance(x, JEditColorizer):
+        g.es_print('only the jEdit colorizer counts lines')
+        return
+    if x.old_v:
+        g.es_print(f"colorizer stats for {x.old_v.h}")
+    g.es_print(
+        f"{x.n_colored} lines colored, {x.n_deferred} deferred, "
+        f"{x.n_skipped} skipped (longer than {x.max_line_length} characters)")
 #@+node:ekr.20170127141855.1: ** class BaseColorizer (object)
 class BaseColorizer:
     """The base class for all Leo colorizers."""
@@ -200,6 +239,7 @@ class BaseJEditColorizer (BaseColorizer):
                         if rules:
                             aList.extend(rules)
                             self.rulesDict[key] = aList
+                            CompiledRuleset.invalidate(self.compiled_rulesets, self.rulesDict)
             self.initModeFromBunch(savedBunch)
     #@+node:ekr.20110605121601.18577: *3* bjc.addLeoRules
     def addLeoRules(self, theDict):
@@ -247,6 +287,7 @@ class BaseJEditColorizer (BaseColorizer):
                 else:
                     theList.append(rule)
                 theDict[ch] = theList
+                CompiledRuleset.invalidate(self.compiled_rulesets, theDict)
     #@+node:ekr.20111024091133.16702: *3* bjc.configure_hard_tab_width
     def configure_hard_tab_width(self):
         """Set the width of a hard tab.
@@ -677,12 +718,14 @@ class BaseJEditColorizer (BaseColorizer):
             self.language = language # 2011/05/30
             return True
         # Don't try to import a non-existent language.
-        path = g.os_path_join(g.app.loadDir, '..', 'modes')
+        path = ModeTables.modes_path()
         fn = g.os_path_join(path, f"{language}.py")
-        if g.os_path_exists(fn):
-            mode = g.importFromPath(moduleName=language, path=path)
-        else:
+        if not g.os_path_exists(fn):
             mode = None
+        elif self.use_mode_tables:
+            mode = ModeTables.get_mode(language, path)
+        else:
+            mode = g.importFromPath(moduleName=language, path=path)
         return self.init_mode_from_module(name, mode)
     #@+node:btheado.20131124162237.16303: *4* bjc.init_mode_from_module (changed)
     def init_mode_from_module(self, name, mode):
@@ -784,17 +827,14 @@ class BaseJEditColorizer (BaseColorizer):
          """
         # Add any new user keywords to leoKeywordsDict.
         d = self.keywordsDict
-        keys = list(d.keys())
         for s in g.globalDirectiveList:
             key = '@' + s
-            if key not in keys:
+            if key not in d:
                 d[key] = 'leokeyword'
         # Create a temporary chars list.  It will be converted to a dict later.
         chars = [z for z in string.ascii_letters + string.digits]
-        for key in list(d.keys()):
-            for ch in key:
-                if ch not in chars:
-                    chars.append(g.checkUnicode(ch))
+        for ch in sorted(set(''.join(d.keys())) - set(chars)):
+            chars.append(g.checkUnicode(ch))
         # jEdit2Py now does this check, so this isn't really needed.
         # But it is needed for forth.py.
         for ch in (' ', '\t'):
@@ -878,6 +918,9 @@ class BaseJEditColorizer (BaseColorizer):
         self.trace_match_flag = False
         # Profiling...
         self.recolorCount = 0 # Total calls to recolor
+        self.n_colored = 0 # Lines colored by jedit.recolor.
+        self.n_deferred = 0 # Lines deferred to idle-time slices.
+        self.n_skipped = 0 # Lines longer than max_line_length.
         self.stateCount = 0 # Total calls to setCurrentState
         self.totalStates = 0
         self.maxStateNumber = 0
@@ -889,9 +932,12 @@ class BaseJEditColorizer (BaseColorizer):
         self.initLanguage = None
         self.prev = None # The previous token.
         self.fonts = {} # Keys are config names.  Values are actual fonts.
+        self.line_spans = None # The tags set in the present line, or None.
         self.keywords = {} # Keys are keywords, values are 0..5.
             # Keys are state ints, values are language names.
         self.modes = {} # Keys are languages, values are modes.
+        self.compiled_rulesets = {}
+            # Keys are id(rulesDict), values are CompiledRuleset instances.
         self.mode = None # The mode object for the present language.
         self.modeBunch = None # A bunch fully describing a mode.
         self.modeStack = []
@@ -929,6 +975,13 @@ class BaseJEditColorizer (BaseColorizer):
         #
         # Init all settings ivars.
         self.color_tags_list = []
+        self.compile_rulesets    = getBool('colorizer-compile-rulesets', default=True)
+        self.line_cache_size     = c.config.getInt('colorizer-line-cache-size') or 0
+        self.use_mode_tables     = getBool('colorizer-use-mode-tables', default=True)
+        self.max_line_length     = c.config.getInt('colorizer-max-line-length') or 0
+        self.slice_time          = c.config.getInt('colorizer-slice-time') or 0
+        self.sync_time           = c.config.getInt('colorizer-sync-time') or 0
+        self.lex_cache_size      = c.config.getInt('colorizer-lex-cache-size') or 0
         self.showInvisibles      = getBool("show-invisibles-by-default")
         self.underline_undefined = getBool("underline-undefined-section-names")
         self.use_hyperlinks      = getBool("use-hyperlinks")
@@ -1021,6 +1074,9 @@ class BaseJEditColorizer (BaseColorizer):
         wrapper = self.wrapper # A QTextEditWrapper
         if not tag.strip():
             return
+        if self.line_spans is not None:
+            # Remember the tag for jedit.replayLine.
+            self.line_spans.append((tag, i, j))
         tag = tag.lower().strip()
         # A hack to allow continuation dots on any tag.
         dots = tag.startswith('dots')
@@ -1106,6 +1162,17 @@ class JEditColorizer(BaseJEditColorizer):
         # State data used only by this class...
         self.after_doc_language = None
         self.initialStateNumber = -1
+        self.first_deferred = None # The number of the first deferred block.
+        self.in_slice = False
+        self.pass_start = None # The starting time of the present pass.
+        self.pass_visible = None # The last visible block in the present pass.
+        self.slice_block = None # The first block of the present slice.
+        self.slice_pending = False
+        self.slice_start = None
+        self.line_cache = collections.OrderedDict()
+            # Keys are gnx's, values are g.Bunches describing line states.
+        self.line_states = []
+            # Entries are line records, indexed by block number.
         self.old_v = None
         self.nextState = 1 # Dont use 0.
         self.n2languageDict = {-1: c.target_language}
@@ -1128,6 +1195,10 @@ class JEditColorizer(BaseJEditColorizer):
             # self.stateNameDict = {}
             # self.restartDict = {}
         self.init_mode(self.language)
+        if self.compile_rulesets and isinstance(self.rulesDict, dict):
+            # Recompile if a plugin has changed the rules.
+            CompiledRuleset.get(
+                self.compiled_rulesets, self.rulesDict, self.__class__, check=True)
         self.clearState()
         # Used by matchers.
         self.prev = None
@@ -1144,6 +1215,10 @@ class JEditColorizer(BaseJEditColorizer):
         self.restartDict = {}
         self.stateDict = {}
         self.stateNameDict = {}
+        self.line_states = []
+        self.first_deferred = None
+        # Start counting the lines of this full recolor.
+        self.n_colored = self.n_deferred = self.n_skipped = 0
     #@+node:ekr.20190326183005.1: *4* jedit.reloadSettings
     def reloadSettings(self):
         """Complete the initialization of all settings."""
@@ -1151,6 +1226,8 @@ class JEditColorizer(BaseJEditColorizer):
             print('reloading jEdit settings.')
         # Do the basic inits.
         BaseJEditColorizer.reloadSettings(self)
+        # Cached line states may use the old settings.
+        self.line_cache.clear()
         # Init everything else.
         self.init_style_ivars()
         self.defineLeoKeywordsDict()
@@ -1294,6 +1371,7 @@ class JEditColorizer(BaseJEditColorizer):
             k = g.skip_ws(s, j)
             self.colorRangeWithTag(s, i, k, 'leokeyword')
             c.frame.setWrap(c.p, force=True)
+            self.line_spans = None # Don't replay this line.
             return k - i
         return 0
     #@+node:ekr.20110605121601.18601: *5* jedit.match_blanks
@@ -1431,6 +1509,7 @@ class JEditColorizer(BaseJEditColorizer):
         if k == -1:
             return 0
         j = k + 2
+        self.line_spans = None # The colors depend on other nodes.
         self.colorRangeWithTag(s, i, i + 2, 'namebrackets')
         ref = g.findReference(s[i: j], p)
         if ref:
@@ -2143,6 +2222,8 @@ class JEditColorizer(BaseJEditColorizer):
             self.n2languageDict [n] = self.language
         return n
     #@+node:ekr.20110605121601.18637: *3* jedit.colorRangeWithTag
+    url_leadin_pattern = re.compile(r'[fhuFHU]')
+
     def colorRangeWithTag(self, s, i, j, tag, delegate='', exclude_match=False):
         """
         Actually colorize the selected range.
@@ -2193,15 +2274,16 @@ class JEditColorizer(BaseJEditColorizer):
             # Allow UNL's and URL's *everywhere*.
             j = min(j, len(s))
             while i < j:
-                ch = s[i].lower()
-                if ch == 'u':
+                # Skip directly to the next possible leadin.
+                m = self.url_leadin_pattern.search(s, i, j)
+                if not m:
+                    break
+                i = m.start()
+                if s[i] in 'uU':
                     n = self.match_unl(s, i)
-                    i += max(1, n)
-                elif ch in 'fh': # file|ftp|http|https
+                else: # file|ftp|http|https
                     n = self.match_any_url(s, i)
-                    i += max(1, n)
-                else:
-                    i += 1
+                i += max(1, n)
     #@+node:ekr.20110605121601.18638: *3* jedit.mainLoop
     tot_time = 0.0
 
@@ -2210,6 +2292,8 @@ class JEditColorizer(BaseJEditColorizer):
         t1 = time.process_time()
         f = self.restartDict.get(n)
         i = f(s) if f else 0
+        if self.compile_rulesets:
+            i = self.compiledLoop(s, i)
         while i < len(s):
             progress = i
             functions = self.rulesDict.get(s[i], [])
@@ -2232,6 +2316,219 @@ class JEditColorizer(BaseJEditColorizer):
             assert i > progress
         # Don't even *think* about changing state here.
         self.tot_time += time.process_time() - t1
+    #@+node:ekr.20191110164753.10: *4* jedit.compiledLoop
+    def compiledLoop(self, s, i):
+        """
+        Colorize s[i:] using the CompiledRuleset for self.rulesDict.
+
+        This is equivalent to the loop in mainLoop. Return the index at
+        which mainLoop must continue.
+        """
+        rulesDict, ruleset = None, None
+        while i < len(s):
+            if self.rulesDict is not rulesDict:
+                # A rule has changed the mode.
+                rulesDict = self.rulesDict
+                if not isinstance(rulesDict, dict):
+                    # Simulated dicts, like plain.RulesDict, can't be compiled.
+                    return i
+                ruleset = CompiledRuleset.get(
+                    self.compiled_rulesets, rulesDict, self.__class__)
+            if not ruleset.leadin_re:
+                break
+            m = ruleset.leadin_re.search(s, i)
+            if not m:
+                break
+            i = progress = m.start()
+            for literal, f in ruleset.table[s[i]]:
+                if literal and not s.startswith(literal, i):
+                    continue
+                n = f(self, s, i)
+                if n is None:
+                    g.trace('Can not happen: n is None', repr(f))
+                    break
+                elif n > 0: # Success. The match has already been colored.
+                    i += n
+                    break
+                elif n < 0: # Total failure.
+                    i += -n
+                    break
+            else:
+                i += 1
+            assert i > progress
+        return len(s)
+    #@+node:ekr.20191110180219.1: *3* jedit.Line-state cache
+    #@+at
+    # recolor remembers the state and the tags of each line it colors.
+    # When the user selects another node, cacheLineStates saves these line
+    # records, along with the state tables that give the state numbers their
+    # meaning. Revisiting the node restores them, and replayLine paints each
+    # unchanged line without calling mainLoop.
+    # 
+    # line_cache is a bounded LRU cache. Lines containing section
+    # references or @wrap are never replayed, because their coloring
+    # depends on other nodes or has side effects.
+    #@@c
+    #@+node:ekr.20191110180219.2: *4* jedit.cacheLineStates
+    def cacheLineStates(self):
+        """Cache the line states and tags of self.old_v."""
+        v = self.old_v
+        if v and self.line_cache_size and any(self.line_states):
+            self.line_cache[v.gnx] = g.Bunch(
+                key=(hash(v.b), self.n2languageDict.get(-1), self.enabled),
+                line_states=self.line_states[:v.b.count('\n') + 1],
+                n2languageDict=self.n2languageDict,
+                nextState=self.nextState,
+                restartDict=self.restartDict,
+                stateDict=self.stateDict,
+                stateNameDict=self.stateNameDict,
+            )
+        while len(self.line_cache) > self.line_cache_size:
+            self.line_cache.popitem(last=False)
+    #@+node:ekr.20191110180219.3: *4* jedit.recordLine
+    def recordLine(self, block_n, n, s):
+        """
+        Remember the state and tags of line s, which started in state n.
+        Match_section_ref and match_at_wrap disable recording.
+        """
+        spans, self.line_spans = self.line_spans, None
+        if block_n < 0:
+            return
+        aList = self.line_states
+        if block_n >= len(aList):
+            aList.extend([None] * (block_n + 1 - len(aList)))
+        if spans is None:
+            aList[block_n] = None
+        else:
+            aList[block_n] = (s, n, self.currentState(), self.after_doc_language, spans)
+    #@+node:ekr.20191110180219.4: *4* jedit.replayLine
+    def replayLine(self, block_n, n, s):
+        """
+        Paint line s from its line record if s and its starting state n are
+        unchanged. Return True if the line has been colored.
+        """
+        if not 0 <= block_n < len(self.line_states):
+            return False
+        record = self.line_states[block_n]
+        if not record or record[0] != s or record[1] != n:
+            return False
+        s, n, new_n, self.after_doc_language, spans = record
+        for tag, i, j in spans:
+            self.setTag(tag, s, i, j)
+        self.setState(new_n)
+        return True
+    #@+node:ekr.20191110180219.5: *4* jedit.restoreLineStates
+    def restoreLineStates(self, v):
+        """Restore the cached line states for v, if they are still valid."""
+        d = self.line_cache.pop(v.gnx, None)
+            # cacheLineStates will cache the new states when v is unselected.
+        if not d or d.key != (hash(v.b), self.language, self.enabled):
+            return
+        self.line_states = d.line_states
+        self.n2languageDict = d.n2languageDict
+        self.nextState = d.nextState
+        self.restartDict = d.restartDict
+        self.stateDict = d.stateDict
+        self.stateNameDict = d.stateNameDict
+    #@+node:ekr.20191110195358.1: *3* jedit.Scheduling
+    #@+at
+    # QSyntaxHighlighter colors all blocks of a new body synchronously. For
+    # huge bodies, jedit.recolor colors only the visible blocks, and as many
+    # others as it can in sync_time msec. It marks all later blocks with
+    # deferred_state, without coloring them.
+    # 
+    # colorSlice colors deferred blocks at idle time, in slices of at most
+    # slice_time msec. QSyntaxHighlighter stops coloring when a block's
+    # state doesn't change, so marking a deferred block again ends a slice.
+    # 
+    # Lines longer than max_line_length are never colored.
+    #@@c
+
+    deferred_state = -2
+    #@+node:ekr.20191110195358.2: *4* jedit.colorSlice
+    def colorSlice(self):
+        """Color deferred blocks for about slice_time msec."""
+        self.slice_pending = False
+        v, h = self.old_v, self.highlighter
+        if self.first_deferred is None or not v or v != self.c.p.v:
+            return
+        block = h.document().findBlockByNumber(self.first_deferred)
+        while block.isValid() and block.userState() != self.deferred_state:
+            block = block.next()
+        if not block.isValid():
+            self.first_deferred = None
+            return
+        self.first_deferred = self.slice_block = block.blockNumber()
+        self.in_slice = True
+        self.slice_start = time.perf_counter()
+        try:
+            h.rehighlightBlock(block)
+        finally:
+            self.in_slice = False
+        if self.first_deferred is not None:
+            self.scheduleSlice()
+    #@+node:ekr.20191110195358.3: *4* jedit.deferLine
+    def deferLine(self, block_n, n):
+        """
+        Return True if the block should be colored later. n is the ending
+        state of the previous block.
+        """
+        if not self.sync_time or not QtCore or block_n < 1:
+            return False
+        if n == self.deferred_state:
+            # The previous block hasn't been colored.
+            defer = True
+        elif self.in_slice:
+            defer = (
+                block_n > self.slice_block and
+                time.perf_counter() - self.slice_start > self.slice_time / 1000.0)
+        else:
+            defer = (
+                time.perf_counter() - self.pass_start > self.sync_time / 1000.0 and
+                block_n > self.lastVisibleBlock())
+        if not defer:
+            if block_n == self.first_deferred:
+                self.first_deferred += 1
+            return False
+        self.setState(self.deferred_state)
+        self.n_deferred += 1
+        if self.first_deferred is None or block_n < self.first_deferred:
+            self.first_deferred = block_n
+        self.scheduleSlice()
+        return True
+    #@+node:ekr.20191110195358.4: *4* jedit.lastVisibleBlock
+    def lastVisibleBlock(self):
+        """Return an estimate of the number of the last visible block."""
+        if self.pass_visible is None:
+            w = self.widget
+            try:
+                top = w.verticalScrollBar().value()
+                height = w.viewport().height()
+                spacing = max(1, w.fontMetrics().lineSpacing())
+                self.pass_visible = (top + height) // spacing + 1
+            except Exception:
+                self.pass_visible = sys.maxsize # Never defer.
+        return self.pass_visible
+    #@+node:ekr.20191110195358.5: *4* jedit.scheduleSlice
+    def scheduleSlice(self):
+        """Call colorSlice at idle time."""
+        if not self.slice_pending:
+            self.slice_pending = True
+            QtCore.QTimer.singleShot(0, self.colorSlice)
+    #@+node:ekr.20191110195358.6: *4* jedit.startPass & endPass
+    def startPass(self):
+        """
+        Start a pass: a run of calls to recolor within one event.
+        QSyntaxHighlighter colors blocks synchronously, so the pass ends
+        when Qt's event loop next runs.
+        """
+        if self.sync_time and QtCore:
+            self.pass_start = time.perf_counter()
+            self.pass_visible = None
+            QtCore.QTimer.singleShot(0, self.endPass)
+
+    def endPass(self):
+        self.pass_start = None
     #@+node:ekr.20110605121601.18640: *3* jedit.recolor
     def recolor(self, s):
         """
@@ -2242,11 +2539,17 @@ class JEditColorizer(BaseJEditColorizer):
         self.recolorCount += 1
         block_n = self.currentBlockNumber()
         n = self.prevState()
+        if self.pass_start is None:
+            self.startPass()
         if p.v != self.old_v:
+            self.cacheLineStates()
             self.updateSyntaxColorer(p) # Force a full recolor
             assert self.language
             self.init_all_state(p.v)
+            self.restoreLineStates(p.v)
             self.init(p)
+        elif self.deferLine(block_n, n):
+            return
         else:
             new_language = self.n2languageDict.get(n)
             if new_language != self.language:
@@ -2255,9 +2558,18 @@ class JEditColorizer(BaseJEditColorizer):
         if block_n == 0:
             n = self.initBlock0()
         n = self.setState(n) # Required.
+        if self.max_line_length and len(s) > self.max_line_length:
+            # Don't color the line. The next line starts in the same state.
+            self.n_skipped += 1
+            return
+        self.n_colored += 1
+        if self.replayLine(block_n, n, s):
+            return
+        self.line_spans = []
         # Always color the line, even if colorizing is disabled.
         if s:
             self.mainLoop(n, s)
+        self.recordLine(block_n, n, s)
     #@+node:ekr.20170126100139.1: *4* jedit.initBlock0
     def initBlock0 (self):
         """
@@ -2317,6 +2629,343 @@ class JEditColorizer(BaseJEditColorizer):
                     aList.insert(0, wiki_rule)
                     d [ch] = aList
         self.rulesDict = d
+        CompiledRuleset.invalidate(self.compiled_rulesets, d)
+    #@-others
+#@+node:ekr.20191110164753.1: ** class CompiledRuleset
+class CompiledRuleset:
+    """
+    A jEdit ruleset (a rulesDict) compiled for JEditColorizer.mainLoop.
+
+    Each rule in leo/modes/*.py is a function that calls one of the
+    colorizer's pattern matchers. The compiler calls each rule once with a
+    RuleRecorder to discover that matcher and its arguments. It then:
+
+    - removes rules that never match (match_blanks, match_tabs and
+      match_mark_previous),
+    - guards rules that must start with a literal string (seq, span,
+      eol_span, mark_following and word_and_regexp rules), so mainLoop
+      calls them only if the literal starts at s[i],
+    - makes one regex that finds the next character starting any rule, so
+      mainLoop skips all other characters in a single search.
+
+    The compiler does not change rules that it does not understand.
+    mainLoop always calls them, so it colors exactly as before.
+    """
+    # Matchers that succeed only if their literal argument starts at s[i].
+    literal_args = {
+        'match_eol_span': 'seq',
+        'match_mark_following': 'pattern',
+        'match_seq': 'seq',
+        'match_span': 'begin',
+        'match_word_and_regexp': 'word',
+    }
+    # Matchers that always fail without side effects.
+    null_matchers = ('match_blanks', 'match_mark_previous', 'match_tabs')
+    #@+others
+    #@+node:ekr.20191110164753.2: *3* cr.__init__
+    def __init__(self, rulesDict, colorizer_class):
+        self.colorizer_class = colorizer_class
+        self.rulesDict = rulesDict
+        self.signature = self.computeSignature(rulesDict)
+        self.n_guarded = 0
+        self.n_opaque = 0
+        self.n_removed = 0
+        self.table = {}
+            # Keys are leadin characters.
+            # Values are tuples of (literal, rule), where literal may be None.
+        for ch, rules in rulesDict.items():
+            aList = []
+            for rule in rules:
+                kind, literal, rule = self.compileRule(rule)
+                if kind == 'removed':
+                    self.n_removed += 1
+                else:
+                    aList.append((literal, rule))
+                    if literal:
+                        self.n_guarded += 1
+                    else:
+                        self.n_opaque += 1
+            if aList and len(ch) == 1:
+                self.table[ch] = tuple(aList)
+        leadins = ''.join(sorted(self.table))
+        self.leadin_re = re.compile('[%s]' % re.escape(leadins)) if leadins else None
+    #@+node:ekr.20191110164753.3: *3* cr.compileRule
+    def compileRule(self, rule):
+        """
+        Return (kind, literal, rule) for the given rule.
+
+        kind is 'removed', 'guarded' or 'opaque'. The returned rule may
+        be the colorizer's own matcher, saving one call per match.
+        """
+        if isinstance(rule, ModeRule):
+            name, keys = rule.matcher_name, rule.keys
+        else:
+            # Leo's own matchers are methods of the colorizer class.
+            name = getattr(rule, '__name__', None)
+            if name in self.null_matchers and rule is getattr(self.colorizer_class, name, None):
+                return 'removed', None, rule
+            if getattr(rule, '__module__', None) == __name__:
+                return 'opaque', None, rule
+            recorder = RuleRecorder()
+            data = recorder.record(rule)
+            if not data:
+                return 'opaque', None, rule
+            name, keys = data
+        if name in (None, 'match_mark_previous'):
+            return 'removed', None, rule
+        if name == 'match_keywords' and not keys:
+            # The rule is just colorer.match_keywords(s, i).
+            return 'opaque', None, self.colorizer_class.match_keywords
+        literal = keys.get(self.literal_args.get(name))
+        if literal and isinstance(literal, str):
+            return 'guarded', literal, rule
+        return 'opaque', None, rule
+    #@+node:ekr.20191110164753.4: *3* cr.computeSignature
+    @staticmethod
+    def computeSignature(rulesDict):
+        """Return a cheap signature of rulesDict."""
+        return len(rulesDict), sum(len(z) for z in rulesDict.values())
+    #@+node:ekr.20191110164753.5: *3* cr.get & invalidate (classmethods)
+    @classmethod
+    def get(cls, cache, rulesDict, colorizer_class, check=False):
+        """
+        Return the CompiledRuleset for the given rulesDict.
+
+        cache: the colorizer's compiled_rulesets dict. Each colorizer owns
+        its rulesDicts, so their rulesets die with the colorizer.
+
+        check: True if rulesDict may have changed without a call to
+        invalidate. jedit.init checks once for each full recolor.
+        """
+        ruleset = cache.get(id(rulesDict))
+        if (
+            ruleset is None
+            or ruleset.rulesDict is not rulesDict
+            or ruleset.colorizer_class is not colorizer_class
+            or check and ruleset.signature != cls.computeSignature(rulesDict)
+        ):
+            ruleset = cls(rulesDict, colorizer_class)
+            cache[id(rulesDict)] = ruleset
+        return ruleset
+
+    @classmethod
+    def invalidate(cls, cache, rulesDict):
+        """
+        Forget the compiled form of rulesDict.
+
+        Code that changes a colorizer's rulesDict should call this method
+        with the colorizer's compiled_rulesets dict.
+        """
+        cache.pop(id(rulesDict), None)
+    #@-others
+#@+node:ekr.20191110164753.6: ** class RuleRecorder
+class RuleRecorder:
+    """
+    A stand-in for the colorer argument of jEdit rules.
+
+    record(rule) calls the rule and returns (matcher name, keyword args)
+    if the rule does nothing but call a single pattern matcher with
+    constant keyword arguments. It returns (None, {}) if the rule always
+    fails without calling a matcher. Otherwise it returns None.
+    """
+    #@+others
+    #@+node:ekr.20191110164753.7: *3* recorder.__getattr__
+    def __getattr__(self, name):
+        if not name.startswith('match_'):
+            raise AttributeError(name)
+
+        def matcher(*args, **keys):
+            self.calls.append((name, args, keys))
+            return self
+
+        return matcher
+    #@+node:ekr.20191110164753.8: *3* recorder.record
+    def record(self, rule):
+        """Return (name, keys) for the given rule, or None."""
+        self.calls = []
+        s, i = RuleProbe(), RuleProbe()
+        try:
+            result = rule(self, s, i)
+        except Exception:
+            return None # The rule looked at s or i.
+        if type(result) is int and result == 0 and not self.calls:
+            return None, {}
+        if result is not self or len(self.calls) != 1:
+            return None
+        name, args, keys = self.calls[0]
+        if len(args) != 2 or args[0] is not s or args[1] is not i:
+            return None
+        if not all(isinstance(z, (bool, str, type(None))) for z in keys.values()):
+            return None
+        return name, keys
+    #@-others
+#@+node:ekr.20191110164753.9: ** class RuleProbe
+class RuleProbe:
+    """
+    A stand-in for the s and i arguments of jEdit rules.
+
+    Comparing, indexing, testing or doing arithmetic with a probe raises
+    an exception, so RuleRecorder.record rejects rules that look at s or i.
+    """
+
+    def __bool__(self):
+        raise TypeError('RuleProbe')
+
+    def __eq__(self, other):
+        raise TypeError('RuleProbe')
+
+    __ne__ = __eq__
+    __hash__ = None
+#@+node:ekr.20191110191645.2: ** class ModeRule
+class ModeRule:
+    """
+    A jEdit rule loaded from a mode table.
+
+    Calling a ModeRule has the same effect as calling the rule in
+    leo/modes/*.py from which it was made.
+    """
+
+    def __init__(self, name, matcher_name, keys):
+        self.__name__ = name
+        self.keys = keys
+        self.matcher_name = matcher_name
+            # None for rules that always fail.
+
+    def __call__(self, colorer, s, i):
+        if self.matcher_name is None:
+            return 0
+        return getattr(colorer, self.matcher_name)(s, i, **self.keys)
+
+    def __repr__(self):
+        return f"<ModeRule {self.__name__}: {self.matcher_name}>"
+#@+node:ekr.20191110191645.3: ** class ModeTables
+class ModeTables:
+    """
+    Precomputed tables for the modes in leo/modes.
+
+    Some modes are thousands of lines long, and importing them takes
+    hundreds of milliseconds. A mode table contains the data that
+    init_mode_from_module needs, with each rule replaced by the name of
+    its matcher and its keyword arguments. Tables are pickled in g.app.db,
+    loaded on first use and shared by all commanders.
+
+    Modes whose rules do more than call a single matcher can't be tabled.
+    Leo imports those modes as before.
+    """
+    #@+others
+    #@+node:ekr.20191110191645.4: *3* ModeTables data
+    tables = {}
+        # Keys are languages, values are g.Bunches: (stamp, table).
+    version = 1
+        # Change this whenever the format of the tables changes.
+    #@+node:ekr.20191110191645.5: *3* ModeTables.get_mode
+    @classmethod
+    def get_mode(cls, language, path):
+        """
+        Return a mode object for the given language: either a module or a
+        g.Bunch with the same attributes created from the mode's table.
+        """
+        table = cls.get_table(language, path)
+        if not table:
+            return g.importFromPath(moduleName=language, path=path)
+        # Copy everything the colorizer might change.
+        return g.Bunch(
+            attributesDictDict={
+                key: dict(d) for key, d in table['attributesDictDict'].items()},
+            importDict={
+                key: list(aList) for key, aList in table['importDict'].items()},
+            keywordsDictDict={
+                key: dict(d) for key, d in table['keywordsDictDict'].items()},
+            properties=dict(table['properties']),
+            rulesDictDict={
+                key: {ch: list(rules) for ch, rules in d.items()}
+                    for key, d in table['rulesDictDict'].items()},
+        )
+    #@+node:ekr.20191110191645.6: *3* ModeTables.get_table
+    @classmethod
+    def get_table(cls, language, path):
+        """
+        Return the table for the given language, or None if the mode can't
+        be tabled. Build the table if it doesn't exist or is out of date.
+        """
+        fn = g.os_path_join(path, f"{language}.py")
+        try:
+            st = os.stat(fn)
+        except OSError:
+            return None
+        stamp = (cls.version, st.st_size, st.st_mtime_ns)
+        bunch = cls.tables.get(language)
+        if bunch and bunch.stamp == stamp:
+            return bunch.table
+        key = f"mode-table-{language}"
+        data = g.app.db.get(key) if g.app.db is not None else None
+        if not isinstance(data, dict) or data.get('stamp') != stamp:
+            mode = g.importFromPath(moduleName=language, path=path)
+            data = {'stamp': stamp, 'table': cls.make_table(mode)}
+            try:
+                g.app.db[key] = data
+            except Exception:
+                pass # g.app.db is optional.
+        table = cls.load_table(data['table'])
+        cls.tables[language] = g.Bunch(stamp=stamp, table=table)
+        return table
+    #@+node:ekr.20191110191645.7: *3* ModeTables.load_table
+    @staticmethod
+    def load_table(table):
+        """Replace the rule descriptions in the table by ModeRules."""
+        if not table:
+            return None
+        rules = {}
+        rulesDictDict = {}
+        for rulesetName, d in table['rulesDictDict'].items():
+            d2 = rulesDictDict[rulesetName] = {}
+            for ch, aList in d.items():
+                d2[ch] = []
+                for name, matcher_name, keys in aList:
+                    rule = rules.get(name)
+                    if not rule:
+                        rule = rules[name] = ModeRule(name, matcher_name, keys)
+                    d2[ch].append(rule)
+        table = dict(table)
+        table['rulesDictDict'] = rulesDictDict
+        return table
+    #@+node:ekr.20191110191645.8: *3* ModeTables.make_table
+    @staticmethod
+    def make_table(mode):
+        """
+        Return a table describing the given mode module, or None if the mode
+        can't be described with plain data.
+        """
+        if not mode or hasattr(mode, 'pre_init_mode'):
+            return None
+        table = {}
+        for ivar in ('attributesDictDict', 'importDict', 'keywordsDictDict', 'properties'):
+            # #1334: Careful: getattr(mode, ivar, {}) might be None!
+            table[ivar] = getattr(mode, ivar, None) or {}
+        for ivar in ('attributesDictDict', 'keywordsDictDict'):
+            if not all(isinstance(z, dict) for z in table[ivar].values()):
+                return None
+        recorder = RuleRecorder()
+        rules = {} # Keys are rule names, values are rules.
+        rulesDictDict = table['rulesDictDict'] = {}
+        for rulesetName, rulesDict in (getattr(mode, 'rulesDictDict', None) or {}).items():
+            if not isinstance(rulesDict, dict):
+                return None # plain.RulesDict, for example.
+            d = rulesDictDict[rulesetName] = {}
+            for ch, aList in rulesDict.items():
+                d[ch] = []
+                for rule in aList:
+                    data = recorder.record(rule)
+                    name = getattr(rule, '__name__', None)
+                    if not data or rules.setdefault(name, rule) is not rule:
+                        return None
+                    matcher_name, keys = data
+                    d[ch].append((name, matcher_name, keys))
+        return table
+    #@+node:ekr.20191110191645.9: *3* ModeTables.modes_path
+    @staticmethod
+    def modes_path():
+        return g.os_path_join(g.app.loadDir, '..', 'modes')
     #@-others
 #@+node:ekr.20110605121601.18565: ** class LeoHighlighter (QSyntaxHighlighter)
 # Careful: we may be running from the bridge.
@@ -2537,6 +3186,10 @@ class PygmentsColorizer(BaseJEditColorizer):
         #
         # State unique to this class...
         self.color_enabled = self.enabled
+        self.lex_cache = collections.OrderedDict()
+            # Keys are (language, color_enabled, stack, line).
+            # Values are (spans, stack, state_n, color_enabled).
+        self.lex_cacheable = False
         self.old_v = None
         #
         # Init common data...
@@ -2566,6 +3219,8 @@ class PygmentsColorizer(BaseJEditColorizer):
             print('reloading pygments settings.')
         # Do basic inits.
         BaseJEditColorizer.reloadSettings(self)
+        # The cached formats may be out of date.
+        self.lex_cache.clear()
         # Bind methods.
         if self.use_pygments_styles:
             self.getDefaultFormat = QtGui.QTextCharFormat
@@ -2587,8 +3242,14 @@ class PygmentsColorizer(BaseJEditColorizer):
         
     traced_dict = {}
 
+    legacy_format_dict = {}
+        # Keys are tokens, values are jEdit tags.
+
     def getLegacyFormat(self, token, text):
         """Return a jEdit tag for the given pygments token."""
+        r = self.legacy_format_dict.get(token)
+        if r:
+            return r
         r = repr(token).lstrip('Token.').lstrip('Literal.').lower()
             # Tables and setTag assume lower-case.
         if r == 'name':
@@ -2598,6 +3259,7 @@ class PygmentsColorizer(BaseJEditColorizer):
             if r not in self.traced_dict:
                 self.traced_dict [r] = r
                 g.trace(r)
+        self.legacy_format_dict [token] = r
         return r
 
     def getPygmentsFormat(self, token, text):
@@ -2638,7 +3300,6 @@ class PygmentsColorizer(BaseJEditColorizer):
         #
         # Restore the state.
         # Based on Jupyter code: (c) Jupyter Development Team.
-        stack_ivar = '_saved_state_stack'
         prev_data = highlighter.currentBlock().previous().userData()
         if prev_data is not None:
             # New code by EKR. Restore the language if necessary.
@@ -2647,13 +3308,56 @@ class PygmentsColorizer(BaseJEditColorizer):
                 self.language = prev_data.leo_language
                 # g.trace('RESTORE:', self.language)
                 lexer = self.set_lexer()
-            setattr(lexer, stack_ivar, prev_data.syntax_stack)
+            self.color_enabled = prev_data.color_enabled
+            stack = prev_data.syntax_stack
+        else:
+            # The first line.
+            self.color_enabled = self.enabled
+            stack = None
+        #
+        # Use the cached results if possible.
+        key = (self.language, self.color_enabled, stack, s)
+        cached = self.lex_cache.get(key) if self.lex_cache_size else None
+        if cached:
+            self.lex_cache.move_to_end(key)
+            spans, stack, state_n, self.color_enabled = cached
+            for index, length, format in spans:
+                self.setFormat(index, length, format, s)
+        else:
+            spans, stack, state_n = self.lex(lexer, s, stack)
+            if self.lex_cacheable and self.lex_cache_size:
+                self.lex_cache [key] = spans, stack, state_n, self.color_enabled
+                if len(self.lex_cache) > self.lex_cache_size:
+                    self.lex_cache.popitem(last=False)
+        #
+        # Save the state.
+        # Based on Jupyter code: (c) Jupyter Development Team.
+        data = PygmentsBlockUserData(
+            color_enabled=self.color_enabled,
+            leo_language=self.language,
+            syntax_stack=stack,
+        )
+        highlighter.currentBlock().setUserData(data)
+        highlighter.setCurrentBlockState(state_n)
+        self.tot_time += time.process_time() - t1
+    #@+node:ekr.20191110203111.1: *4* pyg_c.lex
+    def lex(self, lexer, s, stack):
+        """
+        Lex and color line s, starting with the given lexer stack.
+        Return (spans, stack, state_n) for the end of the line.
+        """
+        stack_ivar = '_saved_state_stack'
+        if stack:
+            setattr(lexer, stack_ivar, list(stack))
         elif hasattr(lexer, stack_ivar):
             delattr(lexer, stack_ivar)
         # g.trace(self.color_enabled, self.language, repr(s))
         #
         # The main loop. Warning: this can change self.language.
-        index = 0
+        language = self.language
+        self.lex_cacheable = True
+            # Callbacks clear this if the coloring depends on more than s.
+        index, spans = 0, []
         for token, text in lexer.get_tokens(s):
             length = len(text)
             # print('%5s %25r %r' % (self.color_enabled, repr(token).lstrip('Token.'), text))
@@ -2662,29 +3366,31 @@ class PygmentsColorizer(BaseJEditColorizer):
             else:
                 format = self.getDefaultFormat()
             self.setFormat(index, length, format, s)
+            spans.append((index, length, format))
             index += length
+        if self.language != language:
+            self.lex_cacheable = False
         #
-        # Save the state.
-        # Based on Jupyter code: (c) Jupyter Development Team.
+        # Get the stack.
         stack = getattr(lexer, stack_ivar, None)
         if stack:
-            data = PygmentsBlockUserData(syntax_stack=stack, leo_language=self.language)
-            highlighter.currentBlock().setUserData(data)
+            stack = tuple(stack)
             # Clean up for the next go-round.
             delattr(lexer, stack_ivar)
+        else:
+            stack = None
         #
         # New code by EKR:
         # - Fixes a bug so multiline tokens work.
         # - State supports Leo's color directives.
-        state_s = '%s; %s: %r' % (self.language, self.color_enabled, stack)
+        state_s = '%s; %s: %r' % (self.language, self.color_enabled, stack and list(stack))
         state_n = self.state_s_dict.get(state_s)
         if state_n is None:
             state_n = self.state_index
             self.state_index += 1
             self.state_s_dict [state_s] = state_n
             self.state_n_dict [state_n] = state_s
-        highlighter.setCurrentBlockState(state_n)
-        self.tot_time += time.process_time() - t1
+        return spans, stack, state_n
     #@+node:ekr.20190323045655.1: *4* pyg_c.at_color_callback
     def at_color_callback(self, lexer, match):
         from pygments.token import Name, Text
@@ -2758,6 +3464,8 @@ class PygmentsColorizer(BaseJEditColorizer):
     def section_ref_callback(self, lexer, match):
         """pygments callback for section references."""
         c = self.c
+        self.lex_cacheable = False
+            # The coloring depends on other nodes.
         from pygments.token import Comment, Name
         name, ref, start = match.group(1), match.group(0), match.start()
         found = g.findReference(ref, c.p)
@@ -3044,6 +3752,7 @@ if pygments:
         class PygmentsBlockUserData(QtGui.QTextBlockUserData):
             """ Storage for the user data associated with each line."""
         
+            color_enabled = True
             syntax_stack = ('root',)
         
             def __init__(self, **kwds):
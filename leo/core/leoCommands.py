@@ -788,14 +788,20 @@ class Commands:
     def all_nodes(self):
         """A generator returning all vnodes in the outline, in outline order."""
         c = self
-        for p in c.all_positions():
-            yield p.v
+        for v, childIndex, level in leoNodes.Traverser().walk_outline(c):
+            yield v
 
     def all_unique_nodes(self):
         """A generator returning each vnode of the outline."""
         c = self
-        for p in c.all_unique_positions(copy=False):
-            yield p.v
+        t = leoNodes.Traverser()
+        seen = set()
+        for v, childIndex, level in t.walk_outline(c):
+            if v in seen:
+                t.prune()
+            else:
+                seen.add(v)
+                yield v
 
     # Compatibility with old code...
     all_tnodes_iter = all_nodes
@@ -806,10 +812,9 @@ class Commands:
     def all_positions(self, copy=True):
         """A generator return all positions of the outline, in outline order."""
         c = self
-        p = c.rootPosition()
-        while p:
-            yield p.copy() if copy else p
-            p.moveToThreadNext()
+        t = leoNodes.Traverser()
+        for v, childIndex, level in t.walk_outline(c):
+            yield t.position(copy)
 
     # Compatibility with old code...
     all_positions_iter = all_positions
@@ -836,19 +841,14 @@ class Commands:
             g.es_print(f"not a VNode: {v!r}")
             return # Stop the generator.
 
-        def allinds(v, target_v):
-            """Yield all indices i such that v.children[i] == target_v."""
-            for i, x in enumerate(v.children):
-                if x is target_v:
-                    yield i
-
         def stack2pos(stack):
             """Convert the stack to a position."""
             v, i = stack[-1]
             return leoNodes.Position(v, i, stack[:-1])
 
         for v2 in set(v.parents):
-            for i in allinds(v2, v):
+            # Use the parent-path index.
+            for i in v.childIndices(v2):
                 stack.insert(0, (v, i))
                 if v2 is c.hiddenRootNode:
                     yield stack2pos(stack)
@@ -872,13 +872,11 @@ class Commands:
             def predicate(p):
                 return p.isAnyAtFileNode()
 
-        p = c.rootPosition()
-        while p:
-            if predicate(p):
-                yield p.copy() # 2017/02/19
-                p.moveToNodeAfterTree()
-            else:
-                p.moveToThreadNext()
+        t = leoNodes.Traverser()
+        for v, childIndex, level in t.walk_outline(c):
+            if predicate(t.position(copy=False)):
+                yield t.position() # 2017/02/19
+                t.prune()
 
     #@+node:ekr.20091001141621.6062: *5* c.all_unique_positions
     def all_unique_positions(self, copy=True):
@@ -887,15 +885,14 @@ class Commands:
         Returns only the first position for each vnode.
         """
         c = self
-        p = c.rootPosition()
+        t = leoNodes.Traverser()
         seen = set()
-        while p:
-            if p.v in seen:
-                p.moveToNodeAfterTree()
+        for v, childIndex, level in t.walk_outline(c):
+            if v in seen:
+                t.prune()
             else:
-                seen.add(p.v)
-                yield p.copy() if copy else p
-                p.moveToThreadNext()
+                seen.add(v)
+                yield t.position(copy)
 
     # Compatibility with old code...
     all_positions_with_unique_tnodes_iter = all_unique_positions
@@ -918,14 +915,12 @@ class Commands:
                 return p.isAnyAtFileNode()
 
         seen = set()
-        p = c.rootPosition()
-        while p:
-            if p.v not in seen and predicate(p):
-                seen.add(p.v)
-                yield p.copy() if copy else p
-                p.moveToNodeAfterTree()
-            else:
-                p.moveToThreadNext()
+        t = leoNodes.Traverser()
+        for v, childIndex, level in t.walk_outline(c):
+            if v not in seen and predicate(t.position(copy=False)):
+                seen.add(v)
+                yield t.position(copy)
+                t.prune()
     #@+node:ekr.20150316175921.5: *5* c.safe_all_positions
     def safe_all_positions(self, copy=True):
         """
@@ -1102,6 +1097,14 @@ class Commands:
         c = self
         if not p or not p.v:
             return False
+        if root is None:
+            # Check each link of p.stack, without creating positions.
+            parent_v = c.hiddenRootNode
+            for v, childIndex in p.stack:
+                if not v.isNthChildOf(childIndex, parent_v):
+                    return False
+                parent_v = v
+            return bool(p.v.isNthChildOf(p._childIndex, parent_v))
         if root and p == root:
             return True
         p = p.copy()
@@ -1249,9 +1252,9 @@ class Commands:
     #@+node:ekr.20031218072017.2985: *5* c.clearAllVisited
     def clearAllVisited(self):
         c = self
-        for p in c.all_unique_positions(copy=False):
-            p.v.clearVisited()
-            p.v.clearWriteBit()
+        for v in c.all_unique_nodes():
+            v.clearVisited()
+            v.clearWriteBit()
     #@+node:ekr.20060906211138: *5* c.clearMarked
     def clearMarked(self, p):
         c = self
@@ -1499,6 +1502,37 @@ class Commands:
         g.es_print('check-links: %4.2f sec. %s %s nodes' % (
             t2 - t1, c.shortFileName(), count), color='blue')
         return errors
+    #@+node:ekr.20191110092117.1: *5* c.checkParentIndex
+    def checkParentIndex(self):
+        """
+        Check the parent-path index (v.childIndices) and all queries that
+        use it against a full traversal of the outline.
+        """
+        c = self
+        t1 = time.time()
+        positions = {}
+            # Keys are vnodes, values are lists of positions.
+        for p in c.all_positions():
+            positions.setdefault(p.v, []).append(p)
+        errors = 0
+        for v, expected in positions.items():
+            for parent_v in set(v.parents):
+                indices = [i for i, z in enumerate(parent_v.children) if z is v]
+                if v.childIndices(parent_v) != indices:
+                    g.es_print(f"bad child indices: {v.h} in {parent_v.h}", color='red')
+                    errors += 1
+            found = list(c.all_positions_for_v(v))
+            if (
+                len(found) != len(expected) or
+                any(p not in found for p in expected) or
+                any(not c.positionExists(p) for p in found)
+            ):
+                g.es_print(f"bad positions for {v.h}", color='red')
+                errors += 1
+        t2 = time.time()
+        g.es_print('check-parent-index: %4.2f sec. %s %s nodes' % (
+            t2 - t1, c.shortFileName(), len(positions)), color='blue')
+        return errors
     #@+node:ekr.20040314035615.2: *5* c.checkParentAndChildren
     def checkParentAndChildren(self, p):
         """Check consistency of parent and child data structures."""
@@ -1636,6 +1670,8 @@ class Commands:
         structure_errors = c.checkGnxs()
         if check_links and not structure_errors:
             structure_errors += c.checkLinks()
+        if check_links and not structure_errors:
+            structure_errors += c.checkParentIndex()
         return structure_errors
     #@+node:ekr.20031218072017.1765: *4* c.validateOutline
     # Makes sure all nodes are valid.
@@ -282,6 +282,7 @@ class ParserBaseClass:
         if not aList:
             return 'skip'
         name = aList[0]
+        g.app.config.ifEnvNames.add(name)
         env = os.getenv(name)
         env = env.lower().strip() if env else 'none'
         for s in aList[1:]:
@@ -889,6 +890,8 @@ class ParserBaseClass:
             return self.shortcutsDict, self.settingsDict
         after = p.nodeAfterTree()
         while p and p != after:
+            if p.isAnyAtFileNode():
+                g.app.config.atFileSettingsCount += 1
             result = self.visitNode(p)
             if result == "skip":
                 # g.warning('skipping settings in',p.h)
@@ -959,7 +962,7 @@ class ActiveSettingsOutline:
         Open hidden commanders for leoSettings.leo, myLeoSettings.leo and theme.leo.
         """
         lm = g.app.loadManager
-        lm.readGlobalSettingsFiles()
+        lm.readGlobalSettingsFiles(snapshot=False)
         # Make sure to reload the local file.
         c = g.app.commanders()[0]
         fn = c.fileName()
@@ -1321,6 +1324,8 @@ class GlobalConfigManager:
         self.create_nonexistent_directories = False # Required to keep pylint happy.
         self.atCommonButtonsList = [] # List of info for common @buttons nodes.
         self.atCommonCommandsList = [] # List of info for common @commands nodes.
+        self.atFileSettingsCount = 0 # The number of @<file> nodes in @settings trees.
+        self.ifEnvNames = set() # The names of environment variables tested by @ifenv nodes.
         self.atLocalButtonsList = [] # List of positions of @button nodes.
         self.atLocalCommandsList = [] # List of positions of @command nodes.
         self.buttonsFileName = ''
@@ -535,6 +535,9 @@ class ExternalFilesController:
             return False
         if g.os_path_isdir(path):
             return False
+        if c.atFileCommands.isWritingInBackground(path):
+            # at.finishBackgroundWrite will update the time stamp.
+            return False
         #
         # First, check the modification times.
         old_time = self.get_time(path)
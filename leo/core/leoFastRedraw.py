@@ -10,20 +10,93 @@ https://groups.google.com/forum/#!topic/leo-editor/hpHyHU2sWtM
 
 """
 import leo.core.leoGlobals as g
-import difflib
-import re
+import leo.core.leoNodes as leoNodes
 import time
 
 class FastRedraw:
+    """
+    Flatten the visible part of an outline into a list of integer keys, and
+    compute the opcodes that change one such list into another.
+
+    Keys are interned (level, gnx) tuples, so comparing rows is comparing ints.
+    """
+
+    def __init__(self):
+        self.key_dict = {} # Keys are (level, gnx) tuples, values are ints.
+        self.key_list = [] # The (level, gnx) tuples, indexed by key.
     #@+others
+    #@+node:ekr.20191111075629.1: ** FastRedraw.diff & helper
+    def diff(self, a, b):
+        """
+        Return a list of difflib-style opcodes (tag, i1, i2, j1, j2) that
+        change list a into list b.
+
+        This takes linear time. After removing the common prefix and suffix,
+        keys that appear exactly once in what remains of a and b are anchors:
+        when a[i] != b[j], the shorter of the jumps to the next occurrence of
+        a[i] in b or of b[j] in a becomes an insert or a delete. Moving one
+        block of rows becomes a delete and an insert of just that block.
+        """
+        n, m = len(a), len(b)
+        lo = 0
+        while lo < n and lo < m and a[lo] == b[lo]:
+            lo += 1
+        hi_a, hi_b = n, m
+        while hi_a > lo and hi_b > lo and a[hi_a-1] == b[hi_b-1]:
+            hi_a -= 1
+            hi_b -= 1
+        where_a = self.anchors(a, lo, hi_a)
+        where_b = self.anchors(b, lo, hi_b)
+        opcodes = []
+
+        def add(tag, i1, i2, j1, j2):
+            if i1 == i2 and j1 == j2:
+                return
+            if opcodes and opcodes[-1][0] == tag:
+                opcodes[-1][2], opcodes[-1][4] = i2, j2
+            else:
+                opcodes.append([tag, i1, i2, j1, j2])
+
+        add('equal', 0, lo, 0, lo)
+        i, j = lo, lo
+        while i < hi_a or j < hi_b:
+            if i == hi_a:
+                tag, i2, j2 = 'insert', i, hi_b
+            elif j == hi_b:
+                tag, i2, j2 = 'delete', hi_a, j
+            elif a[i] == b[j]:
+                tag, i2, j2 = 'equal', i + 1, j + 1
+            else:
+                ia = where_a.get(b[j], -1)
+                jb = where_b.get(a[i], -1)
+                if jb > j and (ia <= i or jb - j <= ia - i):
+                    tag, i2, j2 = 'insert', i, jb
+                elif ia > i:
+                    tag, i2, j2 = 'delete', ia, j
+                else:
+                    tag, i2, j2 = 'replace', i + 1, j + 1
+            add(tag, i, i2, j, j2)
+            i, j = i2, j2
+        add('equal', hi_a, n, hi_b, m)
+        return [tuple(z) for z in opcodes]
+    #@+node:ekr.20191111075629.2: *3* FastRedraw.anchors
+    def anchors(self, aList, i, j):
+        """
+        Return a dict whose keys are the items of aList[i:j] and whose values
+        are their indices in aList, or -1 for items that appear more than once.
+        """
+        d = {}
+        for k in range(i, j):
+            key = aList[k]
+            d[key] = -1 if key in d else k
+        return d
     #@+node:ekr.20181202060924.4: ** LeoGui.dump_diff_op_codes
     def dump_diff_op_codes(self, a, b, op_codes):
-        """Dump the opcodes returned by difflib.SequenceMatcher."""
-        
+        """Dump the opcodes returned by FastRedraw.diff."""
+
         def summarize(aList):
-            pat = re.compile(r'.*:.*:(.*)')
-            return ', '.join([pat.match(z).group(1) for z in aList])
-            
+            return ', '.join([self.key_list[z][1] for z in aList])
+
         for tag, i1, i2, j1, j2 in op_codes:
             if tag == 'equal':
                 print('%7s at %s:%s (both) ==> %r' % (tag, i1, i2, summarize(b[j1:j2])))
@@ -39,40 +112,79 @@ class FastRedraw:
     #@+node:ekr.20181202060924.5: ** LeoGui.dump_opcodes
     def dump_opcodes(self, opcodes):
         """Dump the opcodes returned by app.peep_hole and app.make_redraw_list."""
-        for z in opcodes:
-            kind = z[0]
-            if kind == 'replace':
-                kind, i1, gnxs1, gnxs2 = z
-                print(kind, i1)
-                print('  a: [%s]' % ',\n    '.join(gnxs1))
-                print('  b: [%s]' % ',\n    '.join(gnxs2))
-            elif kind in ('delete', 'insert'):
-                kind, i1, gnxs = z
-                print(kind, i1)
-                print('  [%s]' % ',\n    '.join(gnxs))
-            else:
-                print(z)
+        for kind, i1, i2, j1, j2 in opcodes:
+            print('%7s a[%s:%s] b[%s:%s]' % (kind, i1, i2, j1, j2))
     #@+node:ekr.20181202060924.2: ** LeoGui.flatten_outline
     def flatten_outline (self, c):
-        """Return a flat list of strings "level:gnx" for all *visible* positions."""
+        """Return a flat list of keys for all *visible* positions."""
         trace = False and not g.unitTesting
         t1 = time.process_time()
         aList = []
-        for p in c.rootPosition().self_and_siblings():
-            self.extend_flattened_outline(aList, p)
+        key_dict = self.key_dict
+        t = leoNodes.Traverser()
+        for v, childIndex, level in t.walk_outline(c):
+            key = key_dict.get((level, v.gnx))
+            if key is None:
+                key = self.key(level, v.gnx)
+            aList.append(key)
+            # Only clones need a position to compute their expansion state.
+            if len(v.parents) > 1:
+                expanded = t.position(copy=False).isExpanded()
+            else:
+                expanded = v.isExpanded()
+            if not expanded:
+                t.prune()
         if trace:
             t2 = time.process_time()
             print('app.flatten_outline: %s entries %6.4f sec.' % (
                 len(aList), (t2-t1)))
         return aList
-            
-    def extend_flattened_outline(self, aList, p):
-        """Add p and all p's visible descendants to aList."""
-        aList.append('%s:%s:%s\n' % (p.level(), p.gnx, p.h))
-            # Padding the fields causes problems later.
-        if p.isExpanded():
-            for child in p.children():
-                self.extend_flattened_outline(aList, child)
+    #@+node:ekr.20191111075629.3: ** FastRedraw.flatten_rows
+    def flatten_rows(self, c):
+        """
+        Return (keys, positions) for the rows of Leo's Qt outline: all visible
+        positions, and the children of collapsed visible positions.
+
+        Like qtree.drawTopTree, this shows only the hoisted tree, or the
+        children of a hoisted @chapter node.
+        """
+        keys, positions = [], []
+        key_dict = self.key_dict
+        t = leoNodes.Traverser()
+        if c.hoistStack:
+            p = c.hoistStack[-1].p
+            if len(c.hoistStack) == 1 and p.h.startswith('@chapter') and p.hasChildren():
+                walker = t.walk_subtree(p)
+            else:
+                walker = t.walk_tree(p)
+        else:
+            walker = t.walk_outline(c)
+        for v, childIndex, level in walker:
+            key = key_dict.get((level, v.gnx))
+            if key is None:
+                key = self.key(level, v.gnx)
+            keys.append(key)
+            p = t.position()
+            positions.append(p)
+            if v.children and not p.isExpanded():
+                t.prune()
+                stack = p.stack + [(v, childIndex)]
+                for n, child in enumerate(v.children):
+                    key = key_dict.get((level + 1, child.gnx))
+                    if key is None:
+                        key = self.key(level + 1, child.gnx)
+                    keys.append(key)
+                    positions.append(leoNodes.Position(child, n, stack))
+        return keys, positions
+    #@+node:ekr.20191111075629.4: ** FastRedraw.key
+    def key(self, level, gnx):
+        """Return the interned key for (level, gnx)."""
+        data = (level, gnx)
+        key = self.key_dict.get(data)
+        if key is None:
+            key = self.key_dict[data] = len(self.key_list)
+            self.key_list.append(data)
+        return key
     #@+node:ekr.20181202060924.3: ** LeoGui.make_redraw_list
     def make_redraw_list(self, a, b):
         """
@@ -82,39 +194,42 @@ class FastRedraw:
         trace = False and not g.unitTesting
         if a == b:
             return []
-
-        def gnxs(aList):
-            """Return the gnx list. Do not try to remove this!"""
-            return [z.strip() for z in aList]
-            
-        #@+others # Define local helpers
-        #@-others
-
-        d = difflib.SequenceMatcher(None, a, b)
-        op_codes = list(d.get_opcodes())
-        # dump_diff_op_codes(a, b, op_codes)
-        #
-        # Generate the instruction list, and verify the result.
-        opcodes, result = [], []
-        for tag, i1, i2, j1, j2 in op_codes:
-            if tag == 'insert':
-                opcodes.append(['insert', i1, gnxs(b[j1:j2])])
-            elif tag == 'delete':
-                opcodes.append(['delete', i1, gnxs(a[i1:i2])])
-            elif tag == 'replace':
-                opcodes.append(['replace', i1, gnxs(a[i1:i2]), gnxs(b[j1:j2])])
-            result.extend(b[j1:j2])
-        assert b == result, (a, b)
+        opcodes = [z for z in self.diff(a, b) if z[0] != 'equal']
         #
         # Run the peephole.
-        opcodes = self.peep_hole(opcodes)
+        opcodes = self.peep_hole(a, b, opcodes)
         if trace:
             print('app.make_redraw_list: opcodes after peephole...')
             self.dump_opcodes(opcodes)
         return opcodes
+    #@+node:ekr.20191111075629.14: ** FastRedraw.row_map
+    def row_map(self, a, b, opcodes):
+        """
+        Return a list mapping each index of b to an index of a with the same
+        key, or to -1. opcodes must be the result of self.diff(a, b).
+
+        Rows that a delete and an insert move elsewhere keep their old index.
+        """
+        pool = {} # Keys are keys, values are reversed lists of indices of a.
+        for tag, i1, i2, j1, j2 in opcodes:
+            if tag in ('delete', 'replace'):
+                for i in range(i2 - 1, i1 - 1, -1):
+                    pool.setdefault(a[i], []).append(i)
+        result = []
+        for tag, i1, i2, j1, j2 in opcodes:
+            if tag == 'equal':
+                result.extend(range(i1, i2))
+            elif tag != 'delete':
+                for j in range(j1, j2):
+                    aList = pool.get(b[j])
+                    result.append(aList.pop() if aList else -1)
+        return result
     #@+node:ekr.20181202060924.6: ** LeoGui.peep_hole
-    def peep_hole(self, opcodes):
-        """Scan the list of opcodes, merging adjacent op-codes."""
+    def peep_hole(self, a, b, opcodes):
+        """
+        Scan the list of opcodes, merging adjacent delete and insert opcodes
+        for the same rows into move opcodes.
+        """
         i, result = 0, []
         while i < len(opcodes):
             op0 = opcodes[i]
@@ -123,17 +238,16 @@ class FastRedraw:
                 break
             op1 = opcodes[i+1]
             kind0, kind1 = op0[0], op1[0]
-            # Merge adjacent insert/delete opcodes with the same gnx.
-            if (
-                kind0 == 'insert' and kind1 == 'delete' or
-                kind0 == 'delete' and kind1 == 'insert'
-            ):
-                kind0, index0, gnxs0 = op0
-                kind1, index1, gnxs1 = op1
-                if gnxs0[0] == gnxs1[0]:
-                    result.append(['move', index0, index1, gnxs0, gnxs1])
-                    i += 2 # Don't scan either op again!
-                    break
+            if kind0 == 'delete' and kind1 == 'insert':
+                delete, insert = op0, op1
+            elif kind0 == 'insert' and kind1 == 'delete':
+                delete, insert = op1, op0
+            else:
+                delete = insert = None
+            if delete and a[delete[1]:delete[2]] == b[insert[3]:insert[4]]:
+                result.append(('move', delete[1], delete[2], insert[3], insert[4]))
+                i += 2 # Don't scan either op again!
+                continue
             # The default is to retain the opcode.
             result.append(op0)
             i += 1
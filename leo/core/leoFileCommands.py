@@ -13,6 +13,8 @@ except Exception:
 import leo.core.leoGlobals as g
 import leo.core.leoNodes as leoNodes
 import binascii
+import codecs
+import collections
 from collections import defaultdict
 import difflib
 import time
@@ -51,14 +53,42 @@ class FastRead:
     def __init__(self, c, gnx2vnode):
         self.c = c
         self.gnx2vnode = gnx2vnode
+        # For readWithIterParse...
+        self.created = set()
+            # The gnxs of all vnodes created by this read.
+        self.g_element = None
+            # The <globals> element.
+        self.pending = {}
+            # Keys are gnxs, values are (body, attributes) for each <t> element
+            # that precedes all <v> elements with the same gnx.
+            # This dict is empty for .leo files written by Leo.
+        self.pending_db = None
+            # A temporary sqlite database holding the <t> elements that
+            # do not fit in self.pending.
+        self.pending_size = 0
+            # The number of characters of body text in self.pending.
+        self.seen = {}
+            # Keys are gnxs, values are vnodes for all <v> elements read so far.
+        self.v_stack = []
+            # The vnodes of all open <v> elements, or None for skipped elements.
         
     #@+others
     #@+node:ekr.20180604110143.1: *3* fast.readFile/FromClipboard & helper
     def readFile(self, path):
-        """Read the file, change splitter ratiors, and return its hidden vnode."""
-        with open(path, 'rb') as f:
-            s = f.read()
-        v, g_element = self.readWithElementTree(path, s)
+        """
+        Read the file, change splitter ratiors, and return its hidden vnode.
+
+        Read files of at least @int leo-file-stream-size megabytes
+        incrementally, with fast.readWithIterParse.
+        """
+        if self.useIterParse(path):
+            v, g_element = self.readWithIterParse(path)
+        else:
+            with open(path, 'rb') as f:
+                s = f.read()
+            v, g_element = self.readWithElementTree(path, s) or (None, None)
+        if not v:
+            return None
         self.scanGlobals(g_element)
             # Fix #1047: only this method changes splitter sizes.
         #
@@ -83,6 +113,16 @@ class FastRead:
             new_vnode.h = 'newHeadline'
             v.children = [new_vnode]
         return v
+
+    def useIterParse(self, path):
+        """True if readFile should read the file at path incrementally."""
+        size = self.c.config.getInt('leo-file-stream-size')
+        if size is None:
+            size = 20
+        try:
+            return g.os_path_getsize(path) >= size * 1024 * 1024
+        except OSError:
+            return False
     #@+node:ekr.20180602062323.7: *4* fast.readWithElementTree & helpers
     translate_table = b''.join([g.toEncodedString(chr(z)) for z in range(20) if chr(z) not in '\t\r\n'])
         # See https://en.wikipedia.org/wiki/Valid_characters_in_XML.
@@ -280,7 +320,7 @@ class FastRead:
     #@+node:ekr.20180602062323.9: *5* fast.scanVnodes & helper
     def scanVnodes(self, gnx2body, gnx2vnode, gnx2ua, v_elements):
         
-        c, fc = self.c, self.c.fileCommands
+        c = self.c
         #@+<< define v_element_visitor >>
         #@+node:ekr.20180605102822.1: *6* << define v_element_visitor >>
         def v_element_visitor(parent_e, parent_v):
@@ -312,39 +352,9 @@ class FastRead:
                     v._bodyString = body
                     v._headString = 'PLACE HOLDER'
                     #@-<< Make a new vnode, linked to the parent >>
-                    #@+<< handle all other v attributes >>
-                    #@+node:ekr.20180605075113.1: *7* << handle all other v attributes >>
-                    # Like fc.handleVnodeSaxAttrutes.
-                    #
-                    # The native attributes of <v> elements are a, t, vtag, tnodeList,
-                    # marks, expanded, and descendentTnode/VnodeUnknownAttributes.
-                    d = e.attrib
-                    s = d.get('tnodeList', '')
-                    tnodeList = s and s.split(',')
-                    if tnodeList:
-                        # This tnodeList will be resolved later.
-                        v.tempTnodeList = tnodeList
-                    s = d.get('descendentTnodeUnknownAttributes')
-                    if s:
-                        aDict = fc.getDescendentUnknownAttributes(s, v=v)
-                        if aDict:
-                            fc.descendentTnodeUaDictList.append(aDict)
-                    s = d.get('descendentVnodeUnknownAttributes')
-                    if s:
-                        aDict = fc.getDescendentUnknownAttributes(s, v=v)
-                        if aDict:
-                            fc.descendentVnodeUaDictList.append((v, aDict),)
-                    #
-                    # Handle vnode uA's
-                    uaDict = gnx2ua[gnx]
+                    self.handleVnodeAttributes(v, e.attrib, gnx2ua[gnx])
                         # gnx2ua is a defaultdict(dict)
                         # It might already exists because of tnode uA's.
-                    for key, val in d.items():
-                        if key not in self.nativeVnodeAttributes:
-                            uaDict[key] = self.resolveUa(key, val)
-                    if uaDict:
-                        v.unknownAttributes = uaDict
-                    #@-<< handle all other v attributes >>
                     # Handle all inner elements.
                     v_element_visitor(e, v)
         #@-<< define v_element_visitor >>
@@ -358,6 +368,654 @@ class FastRead:
         # Traverse the tree of v elements.
         v_element_visitor(v_elements, hidden_v)
         return hidden_v
+    #@+node:ekr.20180605075113.1: *5* fast.handleVnodeAttributes
+    def handleVnodeAttributes(self, v, d, uaDict):
+        """
+        Handle all attributes of the <v> element for the new vnode v.
+        
+        d: the element's attributes.
+        uaDict: the uA's of the corresponding <t> element, if any.
+        """
+        fc = self.c.fileCommands
+        # Like fc.handleVnodeSaxAttrutes.
+        #
+        # The native attributes of <v> elements are a, t, vtag, tnodeList,
+        # marks, expanded, and descendentTnode/VnodeUnknownAttributes.
+        s = d.get('tnodeList', '')
+        tnodeList = s and s.split(',')
+        if tnodeList:
+            # This tnodeList will be resolved later.
+            v.tempTnodeList = tnodeList
+        s = d.get('descendentTnodeUnknownAttributes')
+        if s:
+            aDict = fc.getDescendentUnknownAttributes(s, v=v)
+            if aDict:
+                fc.descendentTnodeUaDictList.append(aDict)
+        s = d.get('descendentVnodeUnknownAttributes')
+        if s:
+            aDict = fc.getDescendentUnknownAttributes(s, v=v)
+            if aDict:
+                fc.descendentVnodeUaDictList.append((v, aDict),)
+        #
+        # Handle vnode uA's
+        for key, val in d.items():
+            if key not in self.nativeVnodeAttributes:
+                uaDict[key] = self.resolveUa(key, val)
+        if uaDict:
+            v.unknownAttributes = uaDict
+    #@+node:ekr.20191110095830.1: *4* fast.readWithIterParse & helpers
+    chunk_size = 1024 * 1024
+    pending_limit = 16 * 1024 * 1024
+        # The most characters of body text that fast.pending holds.
+
+    def readWithIterParse(self, path):
+        """
+        Read the .leo file at path incrementally, without building an
+        ElementTree for the entire file.
+        
+        Create vnodes as <v> elements start, set bodies as <t> elements end,
+        and free all <v> and <t> elements as soon as they end.
+        
+        Return (hidden_v, g_element) or (None, None).
+        """
+        c = self.c
+        # Create the hidden root vnode.
+        gnx = 'hidden-root-vnode-gnx'
+        hidden_v = leoNodes.VNode(context=c, gnx=gnx)
+        hidden_v._headString = '<hidden root vnode>'
+        self.gnx2vnode [gnx] = hidden_v
+        self.g_element = None
+        e_stack = []
+            # All open elements.
+        parser = ElementTree.XMLPullParser(events=('start', 'end'))
+        decoder = codecs.getincrementaldecoder('utf-8')('replace')
+            # Like g.toUnicode, but safe for multi-byte characters split between chunks.
+        try:
+            with open(path, 'rb') as f:
+                while True:
+                    chunk = f.read(self.chunk_size)
+                    s = decoder.decode(chunk.translate(None, self.translate_table), not chunk)
+                        # Fix #1036 and #1046.
+                    if s:
+                        parser.feed(s)
+                    if not chunk:
+                        parser.close()
+                    for event, e in parser.read_events():
+                        if event == 'start':
+                            e_stack.append(e)
+                            self.startElement(e, hidden_v)
+                        else:
+                            e_stack.pop()
+                            self.endElement(e, e_stack)
+                    if not chunk:
+                        break
+        except Exception as e:
+            g.es_print('\nbad .leo file: %s' % g.shortFileName(path), color='red')
+            g.es_print(g.toUnicode(e))
+            print('')
+            # #970: Just report failure here.
+            return None, None
+        finally:
+            if self.pending_db:
+                self.pending_db.close()
+            self.created, self.pending, self.seen, self.v_stack = set(), {}, {}, []
+            self.pending_db, self.pending_size = None, 0
+        self.handleBits()
+        return hidden_v, self.g_element
+    #@+node:ekr.20191110095830.2: *5* fast.startElement
+    def startElement(self, e, hidden_v):
+        """Handle the start of element e."""
+        c, v_stack = self.c, self.v_stack
+        if e.tag == 'vnodes':
+            v_stack.append(hidden_v)
+            return
+        if e.tag != 'v' or not v_stack:
+            return
+        parent_v = v_stack[-1]
+        if parent_v is None:
+            # The children of clones are not read.
+            v_stack.append(None)
+            return
+        gnx = e.attrib['t']
+        v = self.gnx2vnode.get(gnx)
+        body, uaDict = self.popPending(gnx)
+        if v:
+            # A clone
+            parent_v.children.append(v)
+            v.parents.append(parent_v)
+            if gnx not in self.seen:
+                # The body overrides any previous body text.
+                v._bodyString = g.toUnicode(body)
+                self.seen[gnx] = v
+            v_stack.append(None)
+        else:
+            # Make a new vnode, linked to the parent.
+            v = leoNodes.VNode(context=c, gnx=gnx)
+            self.gnx2vnode [gnx] = v
+            self.created.add(gnx)
+            self.seen[gnx] = v
+            parent_v.children.append(v)
+            v.parents.append(parent_v)
+            v._bodyString = g.toUnicode(body)
+            v._headString = 'PLACE HOLDER'
+            self.handleVnodeAttributes(v, e.attrib, uaDict)
+            v_stack.append(v)
+    #@+node:ekr.20191110095830.3: *5* fast.endElement
+    def endElement(self, e, e_stack):
+        """Handle the end of element e, freeing <v> and <t> elements."""
+        tag, v_stack = e.tag, self.v_stack
+        if tag == 'vh':
+            v = v_stack and v_stack[-1]
+            if v:
+                v._headString = g.toUnicode(e.text or '')
+        elif tag == 'v':
+            if v_stack:
+                v_stack.pop()
+        elif tag == 't':
+            gnx = e.attrib['tx']
+            body = e.text or ''
+            v = self.seen.get(gnx)
+            if v is None:
+                self.addPending(gnx, body, e.attrib)
+            else:
+                uaDict = {}
+                for key, val in e.attrib.items():
+                    if key != 'tx':
+                        uaDict [key] = self.resolveUa(key, val)
+                v._bodyString = g.toUnicode(body)
+                if uaDict and gnx in self.created:
+                    # The uA's in <v> elements override the uA's in <t> elements.
+                    uaDict.update(getattr(v, 'unknownAttributes', {}))
+                    v.unknownAttributes = uaDict
+        elif tag == 'vnodes':
+            v_stack.pop()
+        elif tag == 'globals':
+            self.g_element = e
+        if tag in ('t', 'v') and e_stack:
+            # Free the element.
+            e.clear()
+            parent_e = e_stack[-1]
+            if len(parent_e) and parent_e[-1] is e:
+                del parent_e[-1]
+    #@+node:ekr.20191111133126.1: *5* fast.addPending & popPending
+    def addPending(self, gnx, body, attrib):
+        """
+        Remember the body and attributes of a <t> element that precedes its
+        <v> element. Keep at most pending_limit characters of body text in
+        memory, and the rest in a temporary sqlite table.
+        """
+        attrib = {key: val for key, val in attrib.items() if key != 'tx'}
+        old = self.pending.pop(gnx, None)
+        if old:
+            self.pending_size -= len(old[0])
+        if self.pending_size + len(body) <= self.pending_limit:
+            self.pending[gnx] = body, attrib
+            self.pending_size += len(body)
+            return
+        if not self.pending_db:
+            self.pending_db = sqlite3.connect('')
+                # A private database on disk, deleted when closed.
+            self.pending_db.execute('create table pending(gnx primary key, body, attrib)')
+        self.pending_db.execute('replace into pending values(?, ?, ?)',
+            (gnx, body, pickle.dumps(attrib)))
+
+    def popPending(self, gnx):
+        """Return (body, uaDict) for the pending <t> element for gnx, or ('', {})."""
+        data = self.pending.pop(gnx, None)
+        if data:
+            self.pending_size -= len(data[0])
+        elif self.pending_db:
+            row = self.pending_db.execute(
+                'select body, attrib from pending where gnx=?', (gnx,)).fetchone()
+            if row:
+                self.pending_db.execute('delete from pending where gnx=?', (gnx,))
+                data = row[0], pickle.loads(row[1])
+        if not data:
+            return '', {}
+        body, attrib = data
+        return body, {key: self.resolveUa(key, val) for key, val in attrib.items()}
+    #@-others
+#@+node:ekr.20191111121700.3: ** class SqliteBodyLoader
+class SqliteBodyLoader:
+    """
+    Read the bodies and uA's of SqliteVNodes from a .db outline when they
+    are first used, and forget the least recently used unchanged bodies.
+
+    fc.sqliteBodyLoader is an instance of this class when
+    @bool lazy-load-db-bodies is True.
+    """
+
+    def __init__(self, c, conn, max_bodies=1000):
+        self.c = c
+        self.changed = set()
+            # SqliteVNodes whose changed bodies evict kept in memory.
+        self.conn = conn
+            # The connection from which SqliteVNodes read.
+        self.lru = collections.OrderedDict()
+            # Keys are loaded SqliteVNodes, least recently used first.
+            # Values are their bodies, as last read or saved.
+        self.max_bodies = max(1, max_bodies)
+        self.n_loaded = 0
+            # The number of bodies read from the database.
+    #@+others
+    #@+node:ekr.20191111121700.4: *3* loader.load_body & touch
+    def load_body(self, v):
+        """Read v's body from the database, and return it."""
+        row = self.conn.execute(
+            'select body from vnodes where gnx=?', (v.fileIndex,)).fetchone()
+        s = row[0] if row and row[0] is not None else ''
+        leoNodes.VNode._bodyString.__set__(v, s)
+        self.n_loaded += 1
+        self.lru[v] = s
+        if len(self.lru) > self.max_bodies:
+            self.evict()
+        return s
+
+    def touch(self, v):
+        """Make v the most recently used node."""
+        try:
+            self.lru.move_to_end(v)
+        except KeyError:
+            pass
+    #@+node:ekr.20191111121700.5: *3* loader.load_ua
+    def load_ua(self, v):
+        """Read v's uA's from the database."""
+        row = self.conn.execute(
+            'select ua from vnodes where gnx=?', (v.fileIndex,)).fetchone()
+        self.set_ua(v, row[0] if row else None)
+
+    def set_ua(self, v, ua):
+        """Set v's uA's from the pickled value ua."""
+        pickled = ua
+        try:
+            ua = pickle.loads(g.toEncodedString(ua))
+        except (ValueError, TypeError, EOFError, pickle.UnpicklingError):
+            ua = None
+        ua_slot = leoNodes.VNode.unknownAttributes
+        if isinstance(ua, dict):
+            ua_slot.__set__(v, ua)
+        else:
+            ua_slot.__delete__(v)
+        self.c.fileCommands.sqliteSaver.ua_loaded(v, pickled if ua else None)
+    #@+node:ekr.20191111121700.6: *3* loader.load_all
+    def load_all(self):
+        """
+        Read all bodies and uA's that have not yet been read. Afterwards,
+        nothing is read from the database until mark_clean.
+        """
+        c = self.c
+        if not self.conn:
+            return
+        gnxDict = c.fileCommands.gnxDict
+        body_slot = leoNodes.VNode._bodyString
+        ua_slot = leoNodes.VNode.unknownAttributes
+        for gnx, b, ua in self.conn.execute('select gnx, body, ua from vnodes'):
+            v = gnxDict.get(gnx)
+            if not isinstance(v, SqliteVNode):
+                continue
+            if body_slot.__get__(v) is None:
+                s = b if b is not None else ''
+                body_slot.__set__(v, s)
+                self.n_loaded += 1
+                self.lru[v] = s
+            if ua_slot.__get__(v) is SqliteVNode.ua_not_loaded:
+                self.set_ua(v, ua)
+        self.conn = None
+    #@+node:ekr.20191111125413.1: *3* loader.pin
+    def pin(self, v):
+        """
+        Read v's body and uA's if they have not been read, and never forget
+        them. Called before deleting v's row: undo may restore v.
+        """
+        body_slot = leoNodes.VNode._bodyString
+        ua_slot = leoNodes.VNode.unknownAttributes
+        try:
+            ua_loaded = ua_slot.__get__(v) is not SqliteVNode.ua_not_loaded
+        except AttributeError:
+            ua_loaded = True
+        if self.conn and (body_slot.__get__(v) is None or not ua_loaded):
+            row = self.conn.execute(
+                'select body, ua from vnodes where gnx=?', (v.fileIndex,)).fetchone()
+            b, ua = row if row else (None, None)
+            if body_slot.__get__(v) is None:
+                body_slot.__set__(v, b if b is not None else '')
+                self.n_loaded += 1
+            if not ua_loaded:
+                self.set_ua(v, ua)
+        self.lru.pop(v, None)
+        self.changed.discard(v)
+    #@+node:ekr.20191111121700.7: *3* loader.evict & mark_clean
+    def evict(self):
+        """
+        Forget the least recently used bodies, keeping at most max_bodies.
+        Changed bodies stay in memory until mark_clean.
+        """
+        body_slot = leoNodes.VNode._bodyString
+        while len(self.lru) > self.max_bodies:
+            v, s = self.lru.popitem(last=False)
+            if body_slot.__get__(v) is s:
+                body_slot.__set__(v, None)
+            else:
+                self.changed.add(v)
+
+    def mark_clean(self, conn, vnodes=()):
+        """
+        Called after writing nodes to conn: all bodies in memory, and those
+        of the given vnodes, are now unchanged. Read from conn from now on.
+        """
+        body_slot = leoNodes.VNode._bodyString
+        self.conn = conn
+        for v in self.changed:
+            self.lru[v] = None
+        for v in vnodes:
+            self.lru[v] = None
+        self.changed = set()
+        for v in self.lru:
+            self.lru[v] = body_slot.__get__(v)
+        self.evict()
+    #@-others
+#@+node:ekr.20191111121700.8: ** class SqliteVNode
+class SqliteVNode(leoNodes.VNode):
+    """
+    A VNode of a .db outline whose body and uA's are read from the database
+    when first used. SqliteBodyLoader may later forget its unchanged body.
+
+    None in the _bodyString slot means "not read".
+    """
+
+    __slots__ = ()
+
+    ua_not_loaded = object()
+        # The value of the unknownAttributes slot until the uA's are read.
+
+    def __init__(self, context, gnx=None):
+        super().__init__(context, gnx)
+        leoNodes.VNode._bodyString.__set__(self, None)
+        leoNodes.VNode.unknownAttributes.__set__(self, self.ua_not_loaded)
+    #@+others
+    #@+node:ekr.20191111121700.9: *3* SqliteVNode._bodyString property
+    def __get_body(self):
+        s = leoNodes.VNode._bodyString.__get__(self)
+        loader = self.context.fileCommands.sqliteBodyLoader
+        if s is None:
+            return loader.load_body(self)
+        loader.touch(self)
+        return s
+
+    def __set_body(self, s):
+        leoNodes.VNode._bodyString.__set__(self, s)
+
+    _bodyString = property(
+        __get_body, __set_body,
+        doc="The body text, read from the database when first used.")
+    #@+node:ekr.20191111121700.10: *3* SqliteVNode.unknownAttributes property
+    def __get_ua(self):
+        ua_slot = leoNodes.VNode.unknownAttributes
+        d = ua_slot.__get__(self)
+            # Raises AttributeError if v has no uA's.
+        if d is self.ua_not_loaded:
+            self.context.fileCommands.sqliteBodyLoader.load_ua(self)
+            d = ua_slot.__get__(self)
+        return d
+
+    def __set_ua(self, d):
+        leoNodes.VNode.unknownAttributes.__set__(self, d)
+
+    def __delete_ua(self):
+        ua_slot = leoNodes.VNode.unknownAttributes
+        try:
+            ua_slot.__delete__(self)
+        except AttributeError:
+            pass
+
+    unknownAttributes = property(
+        __get_ua, __set_ua, __delete_ua,
+        doc="The uA's, read from the database when first used.")
+    #@-others
+#@+node:ekr.20191111125413.2: ** class SqliteSaver
+class SqliteSaver:
+    """
+    Write only the changed rows of a .db outline, in a single transaction.
+
+    fc.sqliteSaver remembers each row of the vnodes table as it was last
+    read from or written to c.sqlite_connection. fc.exportToSqlite calls
+    saver.save instead of rewriting the table when @bool incremental-db-save
+    is True and c.sqlite_connection is the connection to fileName.
+    """
+
+    empty_ua = pickle.dumps({}, protocol=1)
+        # The ua column of vnodes without uA's.
+    transientBits = (
+        leoNodes.VNode.visitedBit | leoNodes.VNode.dirtyBit | leoNodes.VNode.writeBit)
+        # Changes to these statusBits alone do not cause a write.
+
+    def __init__(self, c):
+        self.c = c
+        self.conn = None
+            # The connection described by self.rows.
+        self.fileName = None
+            # The finalized file name of self.conn.
+        self.hashes = {}
+            # Keys are file names; values are ((mtime, size), md5) tuples.
+        self.md5s = {}
+            # Keys are 'md5_<gnx>'; values are the md5 hashes in extra_infos.
+        self.n_deleted = 0
+        self.n_written = 0
+            # The number of rows deleted and written by the last save.
+        self.rows = None
+            # None: the next save rewrites all tables. Otherwise keys are
+            # gnxs and values are the tuples returned by saver.snapshot.
+    #@+others
+    #@+node:ekr.20191111125413.3: *3* saver.can_save & reset
+    def can_save(self, fileName):
+        """True if saver.save can write c's outline to fileName."""
+        c = self.c
+        return bool(
+            self.rows is not None
+            and fileName
+            and c.sqlite_connection is not None
+            and c.sqlite_connection is self.conn
+            and g.os_path_finalize(fileName) == self.fileName
+            and c.config.getBool('incremental-db-save', default=True))
+
+    def reset(self, conn, fileName, vnodes=None):
+        """
+        Remember that the vnodes table of conn contains exactly the given
+        vnodes, by default all nodes of c's outline.
+        """
+        c = self.c
+        if vnodes is None:
+            vnodes = c.all_unique_nodes()
+        self.conn = conn
+        self.fileName = g.os_path_finalize(fileName) if fileName else None
+        self.rows = {v.fileIndex: self.snapshot(v) for v in vnodes}
+        try:
+            self.md5s = dict(conn.execute(
+                "select name, value from extra_infos where name like 'md5!_%' escape '!'"))
+        except sqlite3.Error:
+            self.md5s = {}
+    #@+node:ekr.20191111125413.4: *3* saver.snapshot & helpers
+    def snapshot(self, v):
+        """
+        Return a tuple describing v's row without reading the body or uA's
+        of a SqliteVNode. The body of a SqliteVNode is None: the loader
+        knows whether it has changed.
+        """
+        b = None if isinstance(v, SqliteVNode) else leoNodes.VNode._bodyString.__get__(v)
+        return (v, v._headString, b, v.children[:], v.parents[:],
+            v.iconVal, v.statusBits, self.dump_ua(v))
+
+    def body_changed(self, v, old):
+        """True if v's body differs from the body in old, v's snapshot."""
+        b = leoNodes.VNode._bodyString.__get__(v)
+        if isinstance(v, SqliteVNode):
+            loader = self.c.fileCommands.sqliteBodyLoader
+            return b is not None and (loader is None or b is not loader.lru.get(v))
+        return b != old[2]
+
+    def dump_ua(self, v):
+        """
+        Return v's pickled uA's, None if v has no uA's, or
+        SqliteVNode.ua_not_loaded if they have not been read.
+        """
+        try:
+            d = leoNodes.VNode.unknownAttributes.__get__(v)
+        except AttributeError:
+            return None
+        if d is SqliteVNode.ua_not_loaded:
+            return d
+        if not d:
+            return None
+        try:
+            return pickle.dumps(d, protocol=1)
+        except pickle.PicklingError:
+            g.trace('unpickleable value', repr(d))
+            return ''
+
+    def ua_loaded(self, v, s):
+        """Called when the loader reads v's uA's. s is None or their pickled value."""
+        old = self.rows and self.rows.get(v.fileIndex)
+        if old and old[0] is v and old[7] is SqliteVNode.ua_not_loaded:
+            self.rows[v.fileIndex] = old[:7] + (g.toEncodedString(s) if s else None,)
+    #@+node:ekr.20191111125413.5: *3* saver.changed_nodes
+    def changed_nodes(self):
+        """
+        Return (changed, deleted): a list of the vnodes whose rows must be
+        written and a dict whose keys are the gnxs of unreachable rows and
+        whose values are their vnodes.
+
+        This compares all vnodes against their snapshots, but reads no bodies
+        or uA's and pickles only existing uA's.
+        """
+        rows, transient = self.rows, self.transientBits
+        changed, seen = [], set()
+        for v in self.c.all_unique_nodes():
+            gnx = v.fileIndex
+            seen.add(gnx)
+            old = rows.get(gnx)
+            if (
+                old is None or old[0] is not v
+                or old[1] != v._headString
+                or self.body_changed(v, old)
+                or old[3] != v.children
+                or old[4] != v.parents
+                or old[5] != v.iconVal
+                or (old[6] ^ v.statusBits) & ~transient
+            ):
+                changed.append(v)
+            else:
+                ua = self.dump_ua(v)
+                if ua is not SqliteVNode.ua_not_loaded and ua != old[7]:
+                    changed.append(v)
+        deleted = {gnx: old[0] for gnx, old in rows.items() if gnx not in seen}
+        return changed, deleted
+    #@+node:ekr.20191111125413.6: *3* saver.file_hashes & md5
+    def file_hashes(self):
+        """
+        Return a dict whose keys are 'md5_<gnx>' for each @<file> node and
+        whose values are the md5 hashes of their external files.
+
+        This reads only the bodies of @<file> nodes and their ancestors,
+        looking for @ignore.
+        """
+        c = self.c
+        d = {}
+        p = c.rootPosition()
+        while p:
+            if p.v._headString.startswith('@') and (p.isAtAutoNode() or p.isAtFileNode()):
+                if not any(z.isAtIgnoreNode() for z in p.self_and_parents(copy=False)):
+                    d['md5_' + p.gnx] = self.md5(c.getNodeFileName(p))
+                p.moveToNodeAfterTree()
+            else:
+                p.moveToThreadNext()
+        return d
+
+    def md5(self, fn):
+        """
+        Return the md5 hash of file fn, ignoring line endings. Read only
+        files whose size or modification time has changed.
+        """
+        try:
+            st = os.stat(fn)
+            key = (st.st_mtime, st.st_size)
+            data = self.hashes.get(fn)
+            if data and data[0] == key:
+                return data[1]
+            with open(fn, 'rb') as f:
+                s = f.read()
+        except Exception:
+            self.hashes.pop(fn, None)
+            return ''
+        s = s.replace(b'\r\n', b'\n')
+        h = hashlib.md5(s).hexdigest()
+        self.hashes[fn] = key, h
+        return h
+    #@+node:ekr.20191111125413.7: *3* saver.row
+    def row(self, v):
+        """Return v's row of the vnodes table, reading v's body and uA's if necessary."""
+        b = v._bodyString
+            # Reads the body of a SqliteVNode.
+        getattr(v, 'unknownAttributes', None)
+            # Reads the uA's of a SqliteVNode.
+        ua = self.dump_ua(v)
+        return (
+            v.fileIndex,
+            v._headString,
+            b,
+            ' '.join(x.fileIndex for x in v.children),
+            ' '.join(x.fileIndex for x in v.parents),
+            v.iconVal,
+            v.statusBits,
+            self.empty_ua if ua is None else ua,
+        )
+    #@+node:ekr.20191111125413.8: *3* saver.save
+    def save(self):
+        """
+        Write the rows of changed vnodes, delete the rows of unreachable
+        vnodes and update the md5 hashes of changed external files, all in
+        one transaction. Return True on success.
+
+        An interrupted save leaves the database as it was.
+        """
+        c, conn = self.c, self.conn
+        fc = c.fileCommands
+        loader = fc.sqliteBodyLoader
+        changed, deleted = self.changed_nodes()
+        if loader:
+            for v in deleted.values():
+                if isinstance(v, SqliteVNode):
+                    loader.pin(v)
+        rows = [self.row(v) for v in changed]
+            # Read all bodies before starting the transaction.
+        md5s = self.file_hashes()
+        try:
+            fc.beginDbTransaction(conn)
+            conn.executemany('''replace into vnodes
+                (gnx, head, body, children, parents,
+                    iconVal, statusBits, ua)
+                values(?,?,?,?,?,?,?,?);''', rows)
+            conn.executemany('delete from vnodes where gnx=?',
+                [(gnx,) for gnx in deleted])
+            conn.executemany('delete from extra_infos where name=?',
+                [(key,) for key in self.md5s if key not in md5s])
+            conn.executemany('replace into extra_infos(name, value) values(?,?)',
+                [(key, h) for key, h in md5s.items() if self.md5s.get(key) != h])
+            fc.exportDbVersion(conn)
+            fc.exportGeomToSqlite(conn)
+            conn.commit()
+        except sqlite3.Error as e:
+            conn.rollback()
+            g.internalError(e)
+            return False
+        for v in changed:
+            self.rows[v.fileIndex] = self.snapshot(v)
+        for gnx in deleted:
+            del self.rows[gnx]
+        self.md5s = md5s
+        self.n_written, self.n_deleted = len(rows), len(deleted)
+        if loader:
+            loader.mark_clean(conn, [v for v in changed if isinstance(v, SqliteVNode)])
+        return True
     #@-others
 #@+node:ekr.20160514120347.1: ** class FileCommands
 class FileCommands:
@@ -403,6 +1061,10 @@ class FileCommands:
         self.descendentVnodeUaDictList = []
         self.ratio = 0.5
         self.currentVnode = None
+        self.sqliteBodyLoader = None
+            # A SqliteBodyLoader when @bool lazy-load-db-bodies is True.
+        self.sqliteSaver = SqliteSaver(c)
+            # Writes only the changed rows of .db outlines.
         # For writing...
         self.read_only = False
         self.rootPosition = None
@@ -420,6 +1082,11 @@ class FileCommands:
             # 2011/12/10: This dict is never re-inited.
         self.vnodesDict = {}
             # keys are gnx strings; values are ignored
+        # For incremental writes...
+        self.tnodeCache = {}
+            # Keys are vnodes, values are (body, <t> element) tuples.
+        self.vnodeCache = {}
+            # Keys are vnodes, values are tuples computed by fc.vnodeCacheEntry.
     #@+node:ekr.20031218072017.3020: *3* fc.Reading
     #@+node:ekr.20060919104836: *4*  fc.Reading Top-level
     #@+node:ekr.20031218072017.1559: *5* fc.Paste
@@ -572,7 +1239,9 @@ class FileCommands:
                         # Does not work.
                         # Redraw before reading the @file nodes so the screen isn't blank.
                         # This is important for big files like LeoPy.leo.
+                    phase = g.app.startupTracer.begin('fc.readExternalFiles')
                     recoveryNode = fc.readExternalFiles(fileName)
+                    g.app.startupTracer.end(phase)
         finally:
             p = recoveryNode or c.p or c.lastTopLevel()
                 # lastTopLevel is a better fallback, imo.
@@ -950,16 +1619,31 @@ class FileCommands:
         Recreates tree from the data contained in table vnodes.
         
         This method follows behavior of readSaxFile.
+
+        When @bool lazy-load-db-bodies is True, this reads only the structure
+        and headlines. SqliteVNodes read their bodies and uA's when first used.
         """
 
         c, fc = self.c, self
-        sql = '''select gnx, head, 
-             body,
-             children,
-             parents,
-             iconVal,
-             statusBits,
-             ua from vnodes'''
+        lazy = c.config.getBool('lazy-load-db-bodies', default=False)
+        if lazy:
+            fc.sqliteBodyLoader = SqliteBodyLoader(c, conn,
+                c.config.getInt('db-body-cache-size') or 1000)
+            sql = '''select gnx, head,
+                 null,
+                 children,
+                 parents,
+                 iconVal,
+                 statusBits,
+                 null from vnodes'''
+        else:
+            sql = '''select gnx, head, 
+                 body,
+                 children,
+                 parents,
+                 iconVal,
+                 statusBits,
+                 ua from vnodes'''
         vnodes = []
         try:
             for row in conn.execute(sql):
@@ -971,18 +1655,21 @@ class FileCommands:
                     iconVal,
                     statusBits,
                     ua) = row
-                try:
-                    ua = pickle.loads(g.toEncodedString(ua))
-                except ValueError:
-                    ua = None
-                v = leoNodes.VNode(context=c, gnx=gnx)
+                if lazy:
+                    v = SqliteVNode(context=c, gnx=gnx)
+                else:
+                    try:
+                        ua = pickle.loads(g.toEncodedString(ua))
+                    except ValueError:
+                        ua = None
+                    v = leoNodes.VNode(context=c, gnx=gnx)
+                    v._bodyString = b
+                    v.u = ua
                 v._headString = h
-                v._bodyString = b
                 v.children = children.split()
                 v.parents = parents.split()
                 v.iconVal = iconVal
                 v.statusBits = statusBits
-                v.u = ua
                 vnodes.append(v)
         except sqlite3.Error as er:
             if er.args[0].find('no such table') < 0:
@@ -1008,6 +1695,7 @@ class FileCommands:
         c.frame.resizePanesToRatio(r1, r2)
         p = fc.decodePosition(encp)
         c.setCurrentPosition(p)
+        fc.sqliteSaver.reset(conn, c.mFileName, vnodes)
         return rootChildren[0]
     #@+node:vitalije.20170815162307.1: *6* fc.initNewDb
     def initNewDb(self, conn):
@@ -1048,7 +1736,8 @@ class FileCommands:
             g.app.commander_cacher.save(c, fileName, changeName=True)
             ok = c.checkFileTimeStamp(fileName)
             if ok:
-                if c.sqlite_connection:
+                if c.sqlite_connection and not self.sqliteSaver.can_save(fileName):
+                    self.loadLazyBodies()
                     c.sqlite_connection.close()
                     c.sqlite_connection = None
                 ok = self.write_Leo_file(fileName, False) # outlineOnlyFlag
@@ -1059,6 +1748,7 @@ class FileCommands:
                 if c.config.save_clears_undo_buffer:
                     g.es("clearing undo")
                     c.undoer.clearUndoState()
+                c.undoer.writeHistory(fileName)
             c.redraw_after_icons_changed()
         g.doHook("save2", c=c, p=p, fileName=fileName)
         return ok
@@ -1125,6 +1815,7 @@ class FileCommands:
         if not g.doHook("save1", c=c, p=p, fileName=fileName):
             c.endEditing() # Set the current headline text.
             if c.sqlite_connection:
+                self.loadLazyBodies()
                 c.sqlite_connection.close()
                 c.sqlite_connection = None
             self.setDefaultDirectoryForNewFiles(fileName)
@@ -1135,6 +1826,7 @@ class FileCommands:
                 if self.write_Leo_file(fileName, outlineOnlyFlag=False):
                     c.setChanged(False) # Clears all dirty bits.
                     self.putSavedMessage(fileName)
+                    c.undoer.writeHistory(fileName)
             finally:
                 c.ignoreChangedPaths = False # #1367.
             c.redraw_after_icons_changed()
@@ -1146,6 +1838,7 @@ class FileCommands:
         if not g.doHook("save1", c=c, p=p, fileName=fileName):
             c.endEditing() # Set the current headline text.
             if c.sqlite_connection:
+                self.loadLazyBodies()
                 c.sqlite_connection.close()
                 c.sqlite_connection = None
             self.setDefaultDirectoryForNewFiles(fileName)
@@ -1307,11 +2000,23 @@ class FileCommands:
     def putTnode(self, v):
         # Call put just once.
         gnx = v.fileIndex
-        # pylint: disable=consider-using-ternary
-        ua = hasattr(v, 'unknownAttributes') and self.putUnknownAttributes(v) or ''
         b = v.b
+        # Never cache uA's: plugins may change v.u in place.
+        cache = not hasattr(v, 'unknownAttributes')
+        if cache:
+            # Reuse the <t> element if v.b is the same string object.
+            data = self.tnodeCache.get(v)
+            if data and data[0] is b:
+                self.put(data[1])
+                return
+            ua = ''
+        else:
+            ua = self.putUnknownAttributes(v) or ''
         body = xml.sax.saxutils.escape(b) if b else ''
-        self.put('<t tx="%s"%s>%s</t>\n' % (gnx, ua, body))
+        s = '<t tx="%s"%s>%s</t>\n' % (gnx, ua, body)
+        if cache:
+            self.tnodeCache[v] = b, s
+        self.put(s)
     #@+node:ekr.20031218072017.1575: *5* fc.putTnodes
     def putTnodes(self):
         """Puts all tnodes as required for copy or save commands"""
@@ -1324,15 +2029,16 @@ class FileCommands:
         c = self.c
         if self.usingClipboard: # write the current tree.
             theIter = self.currentPosition.self_and_subtree(copy=False)
+            theIter = (p.v for p in theIter)
         else: # write everything
-            theIter = c.all_unique_positions(copy=False)
+            theIter = c.all_unique_nodes()
         # Populate tnodes
         tnodes = {}
-        for p in theIter:
+        for v in theIter:
             # Make *sure* the file index has the proper form.
             # pylint: disable=unbalanced-tuple-unpacking
-            index = p.v.fileIndex
-            tnodes[index] = p.v
+            index = v.fileIndex
+            tnodes[index] = v
         # Put all tnodes in index order.
         for index in sorted(tnodes):
             v = tnodes.get(index)
@@ -1345,27 +2051,16 @@ class FileCommands:
                 g.trace('can not happen: no VNode for', repr(index))
                 # This prevents the file from being written.
                 raise BadLeoFile('no VNode for %s' % repr(index))
+        if not self.usingClipboard:
+            # Forget the <t> elements of deleted nodes.
+            cache = self.tnodeCache
+            self.tnodeCache = {v: cache[v] for v in tnodes.values() if v in cache}
     #@+node:ekr.20031218072017.1863: *5* fc.putVnode & helper
     def putVnode(self, p, isIgnore=False):
         """Write a <v> element corresponding to a VNode."""
         fc = self
         v = p.v
-        #
-        # Precompute constants.
-        isAuto = p.isAtAutoNode() and p.atAutoNodeName().strip()
-        isEdit = p.isAtEditNode() and p.atEditNodeName().strip() and not p.hasChildren()
-            # Write the entire @edit tree if it has children.
-        isFile = p.isAtFileNode()
-        isShadow = p.isAtShadowFileNode()
-        isThin = p.isAtThinFileNode()
-        #
-        # Set forcewrite.
-        if isIgnore or p.isAtIgnoreNode():
-            forceWrite = True
-        elif isAuto or isEdit or isFile or isShadow or isThin:
-            forceWrite = False
-        else:
-            forceWrite = True
+        forceWrite = fc.compute_force_write(v, isIgnore)
         #
         # Set the write bit if necessary.
         gnx = v.fileIndex
@@ -1395,6 +2090,21 @@ class FileCommands:
                 fc.put('</v>\n')
             else:
                 fc.put('%s</v>\n' % v_head) # Call put only once.
+    #@+node:ekr.20191110111256.1: *6* fc.compute_force_write
+    def compute_force_write(self, v, isIgnore):
+        """
+        Return True if the .leo file must contain v's body and children,
+        that is, if v is not the root of an external file.
+        """
+        if isIgnore or v.isAtIgnoreNode():
+            return True
+        isAuto = v.isAtAutoNode() and v.atAutoNodeName().strip()
+        isEdit = v.isAtEditNode() and v.atEditNodeName().strip() and not v.children
+            # Write the entire @edit tree if it has children.
+        isFile = v.isAtFileNode()
+        isShadow = v.isAtShadowFileNode()
+        isThin = v.isAtThinFileNode()
+        return not (isAuto or isEdit or isFile or isShadow or isThin)
     #@+node:ekr.20031218072017.1865: *6* fc.compute_attribute_bits
     def compute_attribute_bits(self, forceWrite, p):
         """Return the initial values of v's attributes."""
@@ -1423,11 +2133,74 @@ class FileCommands:
             self.putVnode(self.currentPosition)
                 # Write only current tree.
         else:
-            for p in c.rootPosition().self_and_siblings():
-                self.putVnode(p, isIgnore=p.isAtIgnoreNode())
+            self.putOutlineVnodes()
             # Fix #1018: scan *all* nodes.
             self.setCachedBits()
         self.put("</vnodes>\n")
+    #@+node:ekr.20191110111256.2: *6* fc.putOutlineVnodes & helper
+    def putOutlineVnodes(self):
+        """
+        Put the <v> elements of all top-level nodes, exactly as calling
+        fc.putVnode for each top-level position would do.
+
+        fc.vnodeCache contains the start of each node's <v> element. An entry
+        is valid only while v.h and v.b are the same string objects, so any
+        change to a node's content invalidates the node's entry.
+        """
+        c, put = self.c, self.put
+        cache, new_cache = self.vnodeCache, {}
+        vnodesDict = self.vnodesDict
+        ends = []
+            # The levels of all open <v> elements.
+        isIgnore = False
+        t = leoNodes.Traverser()
+        for v, childIndex, level in t.walk_outline(c):
+            while ends and ends[-1] >= level:
+                ends.pop()
+                put('</v>\n')
+            if level == 0:
+                isIgnore = v.isAtIgnoreNode()
+            gnx = v.fileIndex
+            data = cache.get(v)
+            if (
+                not data or data[0] is not v._headString or data[1] is not v._bodyString
+                or data[2] is not gnx or data[3] != bool(v.children) or data[4] != isIgnore
+            ):
+                data = self.vnodeCacheEntry(v, isIgnore)
+            new_cache[v] = data
+            forceWrite = data[5]
+            if forceWrite:
+                v.setWriteBit()
+            attrs = self.compute_attribute_bits(forceWrite, t.position()) if (
+                v.children and not forceWrite) else ''
+            if gnx in vnodesDict:
+                put('<v t="%s"%s></v>\n' % (gnx, attrs))
+                t.prune()
+                continue
+            vnodesDict[gnx] = True
+            v_head = '<v t="%s"%s>%s' % (gnx, attrs, data[6]) if attrs else data[7]
+            if forceWrite and v.children:
+                put(v_head + '\n')
+                ends.append(level)
+            else:
+                put(v_head + '</v>\n')
+                t.prune()
+        while ends:
+            ends.pop()
+            put('</v>\n')
+        # Forget the entries of deleted nodes.
+        self.vnodeCache = new_cache
+    #@+node:ekr.20191110111256.3: *7* fc.vnodeCacheEntry
+    def vnodeCacheEntry(self, v, isIgnore):
+        """
+        Return the fc.vnodeCache entry for v:
+        (h, b, gnx, hasChildren, isIgnore, forceWrite, <vh> element, start of <v> element)
+        """
+        h, b, gnx = v._headString, v._bodyString, v.fileIndex
+        forceWrite = self.compute_force_write(v, isIgnore)
+        vh = '<vh>%s</vh>' % (xml.sax.saxutils.escape(v.headString() or ''))
+        v_head = '<v t="%s">%s' % (gnx, vh)
+        return h, b, gnx, bool(v.children), isIgnore, forceWrite, vh, v_head
     #@+node:ekr.20190328160622.1: *6* fc.setCachedBits
     def setCachedBits(self):
         """
@@ -1439,8 +2212,12 @@ class FileCommands:
         if not c.mFileName:
             return # New.
         current = [str(z) for z in self.currentPosition.archivedPosition()]
-        expanded = [v.gnx for v in c.all_unique_nodes() if v.isExpanded()]
-        marked = [v.gnx for v in c.all_unique_nodes() if v.isMarked()]
+        expanded, marked = [], []
+        for v in c.all_unique_nodes():
+            if v.isExpanded():
+                expanded.append(v.gnx)
+            if v.isMarked():
+                marked.append(v.gnx)
         c.db ['expanded'] = ','.join(expanded)
         c.db ['marked'] = ','.join(marked)
         c.db ['current_position'] = ','.join(current)
@@ -1560,23 +2337,31 @@ class FileCommands:
         fileName, theActualFile = self.createActualFile(fileName, toOPML, toZip)
         if not theActualFile: return False
         self.mFileName = fileName
-        self.outputFile = StringIO() # Always write to a string.
         try:
-            if toOPML:
-                if hasattr(c, 'opmlController'):
+            if toOPML or toZip:
+                self.outputFile = StringIO()
+                if not toOPML:
+                    self.putLeoFile()
+                elif hasattr(c, 'opmlController'):
                     c.opmlController.putToOPML(owner=self)
                 else:
                     # This is not likely ever to be called.
                     g.trace('leoOPML plugin not active.')
-            else:
-                self.putLeoFile()
-            s = self.outputFile.getvalue()
-            g.app.write_Leo_file_string = s # 2010/01/19: always set this.
+                s = self.outputFile.getvalue()
+                g.app.write_Leo_file_string = s
             if toZip:
                 self.writeZipFile(s)
             else:
-                s = bytes(s, self.leo_file_encoding, 'replace')
-                theActualFile.write(s)
+                if toOPML:
+                    s = bytes(s, self.leo_file_encoding, 'replace')
+                    theActualFile.write(s)
+                else:
+                    # Stream the outline through a single buffered writer,
+                    # without creating a string containing the entire file.
+                    self.outputFile = io.TextIOWrapper(theActualFile,
+                        encoding=self.leo_file_encoding, errors='replace', newline='')
+                    self.putLeoFile()
+                    self.outputFile.flush()
                 theActualFile.close()
                 c.setFileTimeStamp(fileName)
                 # raise AttributeError # To test handleWriteLeoFileException.
@@ -1675,9 +2460,15 @@ class FileCommands:
         theFile.close()
     #@+node:vitalije.20170630172118.1: *5* fc.exportToSqlite
     def exportToSqlite(self, fileName):
-        """Dump all vnodes to sqlite database. Returns True on success."""
+        """
+        Dump all vnodes to sqlite database. Returns True on success.
+
+        fc.sqliteSaver writes only the changed vnodes when possible.
+        """
         # fc = self
         c = self.c; fc = self
+        if fc.sqliteSaver.can_save(fileName):
+            return fc.sqliteSaver.save()
         if c.sqlite_connection is None:
             c.sqlite_connection = sqlite3.connect(fileName, 
                                         isolation_level='DEFERRED')
@@ -1701,6 +2492,9 @@ class FileCommands:
             )
         ok = False
         try:
+            # Read all bodies before dropping the vnodes table.
+            fc.loadLazyBodies()
+            fc.beginDbTransaction(conn)
             fc.prepareDbTables(conn)
             fc.exportDbVersion(conn)
             fc.exportVnodesToSqlite(conn, (dbrow(v) for v in c.all_unique_nodes()))
@@ -1709,8 +2503,29 @@ class FileCommands:
             conn.commit()
             ok = True
         except sqlite3.Error as e:
+            conn.rollback()
             g.internalError(e)
+        if ok:
+            fc.sqliteSaver.reset(conn, fileName)
+            if fc.sqliteBodyLoader:
+                fc.sqliteBodyLoader.mark_clean(conn)
         return ok
+    #@+node:ekr.20191111125413.9: *6* fc.beginDbTransaction
+    def beginDbTransaction(self, conn):
+        """
+        Use write-ahead logging, and start a transaction that holds the write
+        lock until conn.commit or conn.rollback.
+        """
+        conn.execute('pragma journal_mode=wal')
+        conn.execute('begin immediate')
+    #@+node:ekr.20191111121700.11: *6* fc.loadLazyBodies
+    def loadLazyBodies(self):
+        """
+        Read all bodies and uA's of SqliteVNodes that have not yet been read.
+        Call this before closing or rewriting c.sqlite_connection.
+        """
+        if self.sqliteBodyLoader:
+            self.sqliteBodyLoader.load_all()
     #@+node:vitalije.20170705075107.1: *6* fc.decodePosition
     def decodePosition(self, s):
         """Creates position from its string representation encoded by fc.encodePosition."""
@@ -1774,29 +2589,10 @@ class FileCommands:
         conn.execute("replace into extra_infos(name, value) values('dbversion', ?)", ('1.0',))
     #@+node:vitalije.20170701162204.1: *6* fc.exportHashesToSqlite
     def exportHashesToSqlite(self, conn):
-        c = self.c
-        def md5(x):
-            try:
-                s = open(x, 'rb').read()
-            except Exception:
-                return ''
-            s = s.replace(b'\r\n', b'\n')
-            return hashlib.md5(s).hexdigest()
-        files = set()
-
-        p = c.rootPosition()
-        while p:
-            if p.isAtIgnoreNode():
-                p.moveToNodeAfterTree()
-            elif p.isAtAutoNode() or p.isAtFileNode():
-                fn = c.getNodeFileName(p)
-                files.add((fn, 'md5_'+p.gnx))
-                p.moveToNodeAfterTree()
-            else:
-                p.moveToThreadNext()
+        """Write the md5 hashes of all external files. Hash only changed files."""
         conn.executemany(
             'replace into extra_infos(name, value) values(?,?)',
-            map(lambda x:(x[1], md5(x[0])), files))
+            self.sqliteSaver.file_hashes().items())
 
     #@+node:ekr.20031218072017.2012: *4* fc.writeAtFileNodes
     @cmd('write-at-file-nodes')
@@ -2,6 +2,9 @@
 #@+node:ekr.20060123151617: * @file leoFind.py
 """Leo's gui-independent find classes."""
 import leo.core.leoGlobals as g
+import leo.core.leoNodes as leoNodes
+import array
+import hashlib
 import keyword
 import re
 import time
@@ -131,6 +134,10 @@ class LeoFind:
         self.frame = None
         self.k = c.k
         self.re_obj = None
+        self.search_candidates = None
+            # The candidates for the present find-all command, or None.
+        self.search_index = None
+            # The SearchIndex for c, created by find.getSearchIndex.
         # Options ivars: set by FindTabManager.init.
         self.batch = None
         self.ignore_case = None
@@ -217,6 +224,7 @@ class LeoFind:
         c = self.c
         self.ignore_dups = c.config.getBool('find-ignore-duplicates', default=False)
         self.minibuffer_mode = c.config.getBool('minibuffer-find-mode', default=False)
+        self.use_search_index = c.config.getBool('find-use-search-index', default=True)
     #@+node:ekr.20060123065756.1: *3* LeoFind.Buttons (immediate execution)
     #@+node:ekr.20031218072017.3057: *4* find.changeAllButton
     def changeAllButton(self, event=None):
@@ -538,12 +546,12 @@ class LeoFind:
         self.changeAll()
         # Bugs #947, #880 and #722:
         # Set ancestor @<file> nodes by brute force.
-        for p in c.all_positions():
+        for v, childIndex, level in leoNodes.Traverser().walk_outline(c):
             if (
-                p.anyAtFileNodeName() and not p.v.isDirty()
-                and any([p2.v.isDirty() for p2 in p.subtree()])
+                v.anyAtFileNodeName() and not v.isDirty()
+                and any(v2.isDirty() for v2, i, n in leoNodes.Traverser().walk(v.children))
             ):
-                p.v.setDirty()
+                v.setDirty()
         c.redraw()
     #@+node:ekr.20150629072547.1: *4* find.preloadFindPattern
     def preloadFindPattern(self, w):
@@ -1709,6 +1717,7 @@ class LeoFind:
         if self.pattern_match or self.findAllUniqueFlag:
             ok = self.precompilePattern()
             if not ok: return 0
+        self.search_candidates = self.getSearchCandidates()
         if self.suboutline_only:
             p = c.p
             after = p.nodeAfterTree()
@@ -1728,6 +1737,7 @@ class LeoFind:
             # c.contractAllHeadlines()
         finally:
             c.sparse_find = old_sparse_find
+            self.search_candidates = None
         if count:
             c.redraw()
         g.es("found", count, "matches for", self.find_text)
@@ -1739,13 +1749,11 @@ class LeoFind:
         count, found = 0, None
         # 535: positions are not hashable, but vnodes are.
         clones, skip = [], set()
-        while p and p != after:
-            progress = p.copy()
-            if p.v in skip:
-                p.moveToThreadNext()
-            else:
-                count = self.doCloneFindAllHelper(clones, count, flatten, p, skip)
-            assert p != progress
+        # after is p.nodeAfterTree() or None.
+        t = leoNodes.Traverser()
+        for v, childIndex, level in (t.walk_tree(p) if after else t.walk_from(p)):
+            if v not in skip:
+                count = self.doCloneFindAllHelper(clones, count, flatten, t, skip)
         if clones:
             undoData = u.beforeInsertNode(c.p)
             found = self.createCloneFindAllNodes(clones, flatten)
@@ -1783,26 +1791,27 @@ class LeoFind:
         found.v.children.sort(key=lambda v: v.h.lower())
         return found
     #@+node:ekr.20160422071747.1: *6* find.doCloneFindAllHelper
-    def doCloneFindAllHelper(self, clones, count, flatten, p, skip):
-        """Handle the cff or cfa at node p."""
-        if p.is_at_ignore() or re.search(r'(^@|\n@)nosearch\b', p.b):
-            p.moveToNodeAfterTree()
+    def doCloneFindAllHelper(self, clones, count, flatten, t, skip):
+        """Handle the cff or cfa at the last node yielded by traverser t."""
+        v = t.v
+        if g.match_word(v.h, 0, '@ignore') or (
+            '@nosearch' in v.b and re.search(r'(^@|\n@)nosearch\b', v.b)
+        ):
+            t.prune()
             return count
-        found = self.findNextBatchMatch(p)
+        found = self.mayMatch(v) and self.findNextBatchMatch(v)
         if found:
+            p = t.position(copy=False)
             if not p in clones:
                 clones.append(p.copy())
             count += 1
         if flatten:
-            skip.add(p.v)
-            p.moveToThreadNext()
+            skip.add(v)
         elif found:
             # Don't look at the node or it's descendants.
-            for p2 in p.self_and_subtree(copy=False):
-                skip.add(p2.v)
-            p.moveToNodeAfterTree()
-        else:
-            p.moveToThreadNext()
+            for v2 in t.position(copy=False).nodes():
+                skip.add(v2)
+            t.prune()
         return count
     #@+node:ekr.20160422073500.1: *5* find.doFindAll & helpers
     def doFindAll(self, after, data, p, undoType):
@@ -1871,7 +1880,7 @@ class LeoFind:
         return found
     #@+node:ekr.20160224141710.1: *6* find.findNextBatchMatch
     def findNextBatchMatch(self, p):
-        """Find the next batch match at p."""
+        """Find the next batch match at p, a position or a vnode."""
         table = []
         if self.search_headline:
             table.append(p.h)
@@ -1882,6 +1891,26 @@ class LeoFind:
             pos, newpos = self.searchHelper(s, 0, len(s), self.find_text)
             if pos != -1: return True
         return False
+    #@+node:ekr.20191110161040.9: *5* find.getSearchCandidates & mayMatch
+    def getSearchCandidates(self):
+        """
+        Return the search index's candidates for self.find_text,
+        or None if the index can not prune the search.
+        """
+        s = self.find_text
+        if not self.use_search_index or not s:
+            return None
+        if self.pattern_match or self.findAllUniqueFlag:
+            if re.search(r'[\\.^$*+?{}\[\]|()]', s):
+                return None # Not a literal pattern.
+        else:
+            s = self.replaceBackSlashes(s)
+        return self.getSearchIndex().candidates(s)
+
+    def mayMatch(self, v):
+        """Return False if the search index proves that v can not match."""
+        ids = self.search_candidates
+        return ids is None or self.search_index.candidate(v, ids)
     #@+node:ekr.20031218072017.3074: *4* find.findNext & helper
     def findNext(self, initFlag=True):
         """Find the next instance of the pattern."""
@@ -1964,6 +1993,9 @@ class LeoFind:
                 # Switch to the next/prev node, if possible.
                 attempts += 1
                 p = self.p = self.nextNodeAfterFail(p)
+                while p and not self.mayMatch(p.v):
+                    # Only find-all commands set self.search_candidates.
+                    p = self.p = self.nextNodeAfterFail(p)
                 if p: # Found another node: select the proper pane.
                     self.in_headline = self.firstSearchPane()
                     self.initNextText()
@@ -2368,6 +2400,18 @@ class LeoFind:
         if not found: # Fixes: #457
             self.radioButtonsChanged = True
             self.reset_state_ivars()
+    #@+node:ekr.20191110161040.10: *3* LeoFind.Search index
+    def getSearchIndex(self):
+        """Return the search index for c, loading it from c.db if possible."""
+        if not self.search_index:
+            self.search_index = SearchIndex(self.c)
+            self.search_index.load()
+        return self.search_index
+
+    def saveSearchIndex(self):
+        """Save the search index to c.db."""
+        if self.search_index:
+            self.search_index.save()
     #@+node:ekr.20031218072017.3082: *3* LeoFind.Initing & finalizing
     #@+node:ekr.20031218072017.3083: *4* find.checkArgs
     def checkArgs(self):
@@ -2654,6 +2698,200 @@ class LeoFind:
             s = s[: -1]
         self.change_text = s
     #@-others
+#@+node:ekr.20191110161040.1: ** class SearchIndex
+class SearchIndex:
+    """
+    An inverted word index of the headlines and bodies of one outline.
+
+    The find-all and clone-find-all commands use the index to skip nodes
+    that can not possibly match before doing the exact match.
+
+    Like fc.vnodeCache, the index validates its entries by string
+    identity. Leo's readers, the undoer and many plugins set
+    v._headString and v._bodyString directly, so the setters can not
+    tell the index about all changes. Stale or unknown nodes are
+    reindexed as the find commands reach them.
+    """
+    db_key = 'find-search-index'
+    version = 1
+    word_pattern = re.compile(r'\w+')
+    #@+others
+    #@+node:ekr.20191110161040.2: *3* index.__init__
+    def __init__(self, c):
+        self.c = c
+        self.changed = False
+            # True: the index differs from the copy in c.db.
+        self.dead = 0
+            # The number of postings for reindexed or deleted nodes.
+        self.ids = {}
+            # Keys are vnodes, values are indices into self.nodes.
+        self.live = 0
+            # The number of postings for indexed nodes.
+        self.nodes = []
+            # Entries are (v, h, b, n, digest) or None.
+            # h and b are the strings that were indexed.
+            # n is the number of distinct words in h and b.
+            # digest is not None only for entries that load
+            # has not yet compared with v's text.
+        self.postings = {}
+            # Keys are words, values are arrays of indices into self.nodes.
+    #@+node:ekr.20191110161040.3: *3* index.add & remove
+    def add(self, v):
+        """Index v's headline and body, replacing any previous entry."""
+        self.remove(v)
+        h, b = v._headString, v._bodyString
+        words = self.words(h, b)
+        i = len(self.nodes)
+        self.ids[v] = i
+        self.nodes.append((v, h, b, len(words), None))
+        for word in words:
+            a = self.postings.get(word)
+            if a is None:
+                self.postings[word] = array.array('i', [i])
+            else:
+                a.append(i)
+        self.live += len(words)
+        self.changed = True
+
+    def remove(self, v):
+        """Remove v's entry, leaving its postings as garbage."""
+        i = self.ids.pop(v, None)
+        if i is not None:
+            n = self.nodes[i][3]
+            self.nodes[i] = None
+            self.live -= n
+            self.dead += n
+            self.changed = True
+    #@+node:ekr.20191110161040.4: *3* index.candidate
+    def candidate(self, v, ids):
+        """
+        Return True if v may contain the text whose candidates are ids.
+
+        Reindex v and return True if v's entry is missing or stale.
+        """
+        i = self.ids.get(v)
+        if i is not None:
+            entry = self.nodes[i]
+            if entry[1] is v._headString and entry[2] is v._bodyString:
+                return i in ids
+            if entry[4] is not None and entry[4] == self.digest(v._headString, v._bodyString):
+                # A loaded entry is still valid.
+                self.nodes[i] = (v, v._headString, v._bodyString, entry[3], None)
+                return i in ids
+        self.add(v)
+        return True
+    #@+node:ekr.20191110161040.5: *3* index.candidates
+    def candidates(self, s):
+        """
+        Return the set of indices of all entries that may contain s,
+        or None if the index can not prune a search for s.
+
+        Words completely inside s must appear in the text. The first and
+        last word of s may be the tail or head of a longer word.
+        """
+        if self.dead > max(self.live, 100000):
+            self.compact()
+        s = s.casefold()
+        sets = []
+        for m in self.word_pattern.finditer(s):
+            word, i, j = m.group(0), m.start(), m.end()
+            if 0 < i and j < len(s):
+                words = [word]
+            elif len(word) < 3:
+                continue # Too many words would match.
+            elif 0 < i:
+                words = [z for z in self.postings if z.startswith(word)]
+            elif j < len(s):
+                words = [z for z in self.postings if z.endswith(word)]
+            else:
+                words = [z for z in self.postings if word in z]
+            ids = set()
+            for z in words:
+                ids.update(self.postings.get(z, []))
+            sets.append(ids)
+        if not sets:
+            return None
+        sets.sort(key=len)
+        return sets[0].intersection(*sets[1:])
+    #@+node:ekr.20191110161040.6: *3* index.compact
+    def compact(self):
+        """Remove all garbage from the index."""
+        old_nodes, self.nodes, self.ids = self.nodes, [], {}
+        new_index = {}
+        for i, entry in enumerate(old_nodes):
+            if entry and entry[0].parents:
+                new_index[i] = len(self.nodes)
+                self.ids[entry[0]] = len(self.nodes)
+                self.nodes.append(entry)
+        postings = {}
+        for word, a in self.postings.items():
+            a = array.array('i', [new_index[i] for i in a if i in new_index])
+            if a:
+                postings[word] = a
+        self.postings = postings
+        self.live = sum(entry[3] for entry in self.nodes)
+        self.dead = 0
+    #@+node:ekr.20191110161040.7: *3* index.digest & words
+    def digest(self, h, b):
+        """Return a short digest of a headline and body."""
+        s = h + '\n' + b
+        return hashlib.blake2b(s.encode('utf-8', 'surrogatepass'), digest_size=8).digest()
+
+    def words(self, h, b):
+        """Return the set of all distinct case-folded words in h and b."""
+        return set(self.word_pattern.findall((h + '\n' + b).casefold()))
+    #@+node:ekr.20191110161040.8: *3* index.load & save
+    def load(self):
+        """Init the index from c.db, ignoring entries for unknown nodes."""
+        c = self.c
+        if not c.mFileName:
+            return
+        try:
+            d = c.db.get(self.db_key)
+            if not d or d.get('version') != self.version:
+                return
+            gnxDict = c.fileCommands.gnxDict
+            counts = array.array('i')
+            counts.frombytes(d['counts'])
+            digests = d['digests']
+            for i, gnx in enumerate(d['gnxs']):
+                v = gnxDict.get(gnx)
+                if v is None or v in self.ids:
+                    self.nodes.append(None)
+                    self.dead += counts[i]
+                else:
+                    self.ids[v] = i
+                    self.nodes.append((v, None, None, counts[i], digests[8*i: 8*i+8]))
+                    self.live += counts[i]
+            for word, s in d['postings'].items():
+                a = array.array('i')
+                a.frombytes(s)
+                self.postings[word] = a
+        except Exception:
+            g.es_print('can not load the find index')
+            g.es_exception()
+            self.__init__(c)
+
+    def save(self):
+        """Write the index to c.db if it has changed."""
+        c = self.c
+        if not c.mFileName or not self.changed:
+            return
+        self.compact()
+        counts, digests, gnxs = array.array('i'), [], []
+        for v, h, b, n, digest in self.nodes:
+            counts.append(n)
+            digests.append(self.digest(h, b) if digest is None else digest)
+            gnxs.append(v.fileIndex)
+        c.db[self.db_key] = {
+            'counts': counts.tobytes(),
+            'digests': b''.join(digests),
+            'gnxs': gnxs,
+            'postings': {word: a.tobytes() for word, a in self.postings.items()},
+            'version': self.version,
+        }
+        self.changed = False
+    #@-others
 #@-others
 #@@language python
 #@@tabwidth -4
@@ -599,6 +599,8 @@ class LeoBody:
         c = self.c
         body, w = self, self.wrapper
         p = c.p
+        latency = c.k.latency
+        t1 = latency.start()
         insert = w.getInsertPoint()
         ch = '' if insert == 0 else w.get(insert - 1)
         ch = g.checkUnicode(ch)
@@ -609,14 +611,18 @@ class LeoBody:
         else:
             changed = oldText != newText
         if not changed: return
+        t2 = latency.start()
         c.undoer.setUndoTypingParams(p, undoType,
             oldText=oldText, newText=newText, oldSel=oldSel, newSel=newSel, oldYview=oldYview)
+        latency.stop('undo', t2)
         p.v.setBodyString(newText)
         p.v.insertSpot = w.getInsertPoint()
         #@+<< recolor the body >>
         #@+node:ekr.20051026083733.6: *5* << recolor the body >>
+        t3 = latency.start()
         c.frame.scanForTabWidth(p)
         body.recolor(p)
+        latency.stop('colorizer', t3)
         if g.app.unitTesting:
             g.app.unitTestDict['colorized'] = True
         #@-<< recolor the body >>
@@ -638,6 +644,7 @@ class LeoBody:
         if redraw_flag:
             c.redraw_after_icons_changed()
         #@-<< update icons if necessary >>
+        latency.stop('body-changed', t1)
     #@+node:ekr.20031218072017.4037: *4* LeoBody.setSelectionAreas
     def setSelectionAreas(self, before, sel, after):
         """
@@ -9,6 +9,7 @@
 #@+<< imports >>
 #@+node:ekr.20061031131434.1: ** << imports >> (leoKeys)
 import leo.core.leoGlobals as g
+import leo.core.leoLatency as leoLatency
 import leo.commands.gotoCommands as gotoCommands
 import leo.external.codewise as codewise
 # import glob
@@ -1692,6 +1693,7 @@ class KeyHandlerClass:
         self.fullCommandKey = None
         self.universalArgKey = None
         # Used by k.masterKeyHandler...
+        self.latency = leoLatency.LatencyMonitor()
         self.stroke = None
         self.mb_event = None
         self.mb_history = []
@@ -1930,6 +1932,7 @@ class KeyHandlerClass:
         self.minibuffer_foreground_color = getColor('minibuffer-foreground-color') or 'black'
         self.minibuffer_warning_color = getColor('minibuffer-warning-color') or 'lightgrey'
         self.minibuffer_error_color = getColor('minibuffer-error-color') or 'red'
+        self.latency.enabled = getBool('record-keystroke-latency')
         self.replace_meta_with_alt = getBool('replace-meta-with-alt')
         self.warn_about_redefined_shortcuts = getBool('warn-about-redefined-shortcuts')
         # Has to be disabled (default) for AltGr support on Windows
@@ -2646,6 +2649,35 @@ class KeyHandlerClass:
         # This command is also valid in headlines.
             # k.c.bodyWantsFocus()
         k.showStateAndMode()
+    #@+node:ekr.20191111091055.14: *4* k.show/write/clear-latency-report
+    @cmd('show-latency-report')
+    def showLatencyReport(self, event=None):
+        """Print the latency of each stage of recent keystrokes."""
+        k = self
+        if not k.latency.enabled:
+            g.es_print('@bool record-keystroke-latency is False')
+        g.es_print('keystroke latency:', '\n'.join(k.latency.report()))
+
+    @cmd('write-latency-report')
+    def writeLatencyReport(self, event=None):
+        """
+        Write keystroke latency histograms and recent keystrokes as json to
+        ~/.leo/latency-report.json.
+        """
+        k = self
+        fn = g.os_path_finalize_join(g.app.homeLeoDir, 'latency-report.json')
+        try:
+            with open(fn, 'w', encoding='utf-8') as f:
+                f.write(k.latency.to_json())
+            g.es_print('wrote', fn)
+        except Exception:
+            g.es_print('can not write', fn)
+            g.es_exception()
+
+    @cmd('clear-latency-report')
+    def clearLatencyReport(self, event=None):
+        """Clear all keystroke latency statistics."""
+        self.latency.clear()
     #@+node:ekr.20061031131434.124: *4* k.toggle-input-state
     @cmd('toggle-input-state')
     def toggleInputState(self, event=None):
@@ -2996,27 +3028,31 @@ class KeyHandlerClass:
     def masterKeyHandler(self, event):
         """The master key handler for almost all key bindings."""
         k = self
-        # Setup...
-        if 'keys' in g.app.debug:
-            g.trace(repr(k.state.kind), repr(event.char), repr(event.stroke))
-        k.checkKeyEvent(event)
-        k.setEventWidget(event)
-        k.traceVars(event)
-        # Order is very important here...
-        if k.isSpecialKey(event):
-            return
-        if k.doKeyboardQuit(event):
-            return
-        if k.doDemo(event):
-            return
-        if k.doMode(event):
-            return
-        if k.doVim(event):
-            return
-        if k.doUnboundPlainKey(event):
-            return
-        k.doBinding(event)
-            # Calls handleUnboundKeys if no binding.
+        k.latency.begin_key(event)
+        try:
+            # Setup...
+            if 'keys' in g.app.debug:
+                g.trace(repr(k.state.kind), repr(event.char), repr(event.stroke))
+            k.checkKeyEvent(event)
+            k.setEventWidget(event)
+            k.traceVars(event)
+            # Order is very important here...
+            if k.isSpecialKey(event):
+                return
+            if k.doKeyboardQuit(event):
+                return
+            if k.doDemo(event):
+                return
+            if k.doMode(event):
+                return
+            if k.doVim(event):
+                return
+            if k.doUnboundPlainKey(event):
+                return
+            k.doBinding(event)
+                # Calls handleUnboundKeys if no binding.
+        finally:
+            k.latency.end_key()
     #@+node:ekr.20180418040158.1: *5* k.checkKeyEvent
     def checkKeyEvent(self, event):
         """Perform sanity checks on the incoming event."""
@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+#@+leo-ver=5-thin
+#@+node:ekr.20191111091055.1: * @file leoLatency.py
+#@@first
+"""
+Gui-independent keystroke latency statistics.
+
+When @bool record-keystroke-latency is True, k.masterKeyHandler,
+ec.selfInsertCommand and LeoBody.onBodyChanged time each stage of each
+keystroke. The show-latency-report command summarizes the results, and
+the write-latency-report command writes them as json.
+"""
+import collections
+import json
+import math
+import time
+#@+others
+#@+node:ekr.20191111091055.2: ** class Histogram
+class Histogram:
+    """
+    A histogram of latencies, in seconds.
+
+    Buckets are logarithmic, with four buckets for each doubling of the
+    latency, so percentiles are accurate to within about 20 percent.
+    """
+
+    per_octave = 4
+
+    def __init__(self):
+        self.buckets = {} # Keys are bucket numbers, values are counts.
+        self.max = 0.0
+        self.n = 0
+        self.total = 0.0
+    #@+others
+    #@+node:ekr.20191111091055.3: *3* histogram.add
+    def add(self, t):
+        """Add a latency of t seconds."""
+        usec = t * 1e6
+        b = int(math.log2(usec) * self.per_octave) if usec > 1.0 else 0
+        self.buckets[b] = self.buckets.get(b, 0) + 1
+        self.n += 1
+        self.total += t
+        if t > self.max:
+            self.max = t
+    #@+node:ekr.20191111091055.4: *3* histogram.percentile
+    def percentile(self, q):
+        """
+        Return an upper bound, in seconds, for the q'th fraction of all
+        latencies, 0 <= q <= 1.
+        """
+        if not self.n:
+            return 0.0
+        limit, n = q * self.n, 0
+        for b in sorted(self.buckets):
+            n += self.buckets[b]
+            if n >= limit:
+                return min(self.upper(b), self.max)
+        return self.max
+    #@+node:ekr.20191111091055.5: *3* histogram.to_dict & upper
+    def to_dict(self):
+        """Return a json-compatible dict describing this histogram."""
+        return {
+            'count': self.n,
+            'total': self.total,
+            'mean': self.total / self.n if self.n else 0.0,
+            'p50': self.percentile(0.5),
+            'p90': self.percentile(0.9),
+            'p99': self.percentile(0.99),
+            'max': self.max,
+            # [upper bound in seconds, count] for each non-empty bucket.
+            'buckets': [[self.upper(b), self.buckets[b]] for b in sorted(self.buckets)],
+        }
+
+    def upper(self, b):
+        """Return the upper bound, in seconds, of bucket b."""
+        return 2.0 ** ((b + 1) / self.per_octave) / 1e6
+    #@-others
+#@+node:ekr.20191111091055.6: ** class LatencyMonitor
+class LatencyMonitor:
+    """
+    Per-stage latency histograms for keystrokes.
+
+    k.latency is an instance of this class. Stages nest: "key" includes
+    all other stages except "paint", and "body-changed" includes "undo"
+    and "colorizer". Stages are recorded only during keystrokes.
+    """
+
+    stages = (
+        ('key', 'k.masterKeyHandler'),
+        ('bodykey1', 'bodykey1 hooks'),
+        ('body-changed', 'LeoBody.onBodyChanged'),
+        ('undo', 'u.setUndoTypingParams'),
+        ('colorizer', 'LeoBody.recolor'),
+        ('bodykey2', 'bodykey2 hooks'),
+        ('paint', 'until the gui is idle'),
+    )
+
+    def __init__(self, max_recent=1000):
+        self.current = None
+            # A dict describing the present keystroke.
+        self.depth = 0
+            # The nesting level of k.masterKeyHandler.
+        self.enabled = False
+            # True: record keystrokes. Set by k.reloadSettings.
+        self.histograms = {}
+            # Keys are stage names, values are Histograms.
+        self.key_start = None
+            # The time.perf_counter() of the start of the present keystroke.
+        self.last_start = None
+            # The time.perf_counter() of the start of the last keystroke.
+        self.recent = collections.deque(maxlen=max_recent)
+            # Dicts describing recent keystrokes.
+    #@+others
+    #@+node:ekr.20191111091055.7: *3* latency.begin_key & end_key
+    def begin_key(self, event):
+        """Start timing a keystroke. Called by k.masterKeyHandler."""
+        if not self.enabled and not self.depth:
+            return
+        self.depth += 1
+        if self.depth == 1:
+            stroke = getattr(event, 'stroke', None)
+            self.current = {
+                'stroke': stroke.s if stroke else getattr(event, 'char', ''),
+                'time': time.time(),
+            }
+            self.key_start = time.perf_counter()
+
+    def end_key(self):
+        """Finish timing a keystroke. Called by k.masterKeyHandler."""
+        if not self.depth:
+            return
+        self.depth -= 1
+        if not self.depth:
+            self.add('key', time.perf_counter() - self.key_start)
+            self.recent.append(self.current)
+            self.last_start = self.key_start
+            self.current = self.key_start = None
+    #@+node:ekr.20191111091055.8: *3* latency.start & stop
+    def start(self):
+        """
+        Return the start time of a stage of the present keystroke, or None if
+        no keystroke is being timed. Pass the result to latency.stop.
+        """
+        return None if self.key_start is None else time.perf_counter()
+
+    def stop(self, stage, t):
+        """Record the stage started at time t, the result of latency.start."""
+        if t is not None:
+            self.add(stage, time.perf_counter() - t)
+    #@+node:ekr.20191111091055.9: *3* latency.add
+    def add(self, stage, t):
+        """Add a latency of t seconds to the given stage."""
+        h = self.histograms.get(stage)
+        if not h:
+            h = self.histograms[stage] = Histogram()
+        h.add(t)
+        d = self.current
+        if d is not None:
+            d[stage] = d.get(stage, 0.0) + t
+    #@+node:ekr.20191111091055.10: *3* latency.clear
+    def clear(self):
+        """Clear all statistics."""
+        self.histograms = {}
+        self.last_start = None
+        self.recent.clear()
+    #@+node:ekr.20191111091055.11: *3* latency.paint_callback
+    def paint_callback(self):
+        """
+        Return a function that records the "paint" stage of the last keystroke,
+        or None. Guis call the function when they become idle.
+        """
+        if not self.enabled or self.depth or not self.recent:
+            return None
+        d, t1 = self.recent[-1], self.last_start
+
+        def paint_callback():
+            t = time.perf_counter() - t1
+            self.histograms.setdefault('paint', Histogram()).add(t)
+            d['paint'] = t
+
+        return paint_callback
+    #@+node:ekr.20191111091055.12: *3* latency.report
+    def report(self):
+        """Return a list of lines summarizing all stages."""
+        h = self.histograms.get('key')
+        lines = [
+            f"{h.n if h else 0} keystrokes",
+            '%12s %7s %8s %8s %8s %8s %8s' % (
+                'stage', 'count', 'mean', 'p50', 'p90', 'p99', 'max'),
+        ]
+        for stage, description in self.stages:
+            h = self.histograms.get(stage)
+            if h:
+                d = h.to_dict()
+                lines.append('%12s %7s %8.3f %8.3f %8.3f %8.3f %8.3f' % (
+                    stage, d['count'],
+                    1000 * d['mean'], 1000 * d['p50'], 1000 * d['p90'],
+                    1000 * d['p99'], 1000 * d['max']))
+        lines.append('times in msec.')
+        return lines
+    #@+node:ekr.20191111091055.13: *3* latency.to_dict & to_json
+    def to_dict(self):
+        """Return a json-compatible dict describing all stages and recent keystrokes."""
+        return {
+            'stages': {
+                stage: self.histograms[stage].to_dict()
+                    for stage, description in self.stages
+                        if stage in self.histograms},
+            'descriptions': dict(self.stages),
+            'recent': list(self.recent),
+        }
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), indent=1, sort_keys=True)
+    #@-others
+#@-others
+#@@language python
+#@@tabwidth -4
+#@@pagewidth 70
+#@-leo
@@ -181,6 +181,11 @@ class NodeIndices:
 # Positions should *never* be saved by the ZOBD.
 
 class Position:
+
+    __slots__ = ('_childIndex', 'stack', 'v')
+        # Positions are created by the millions. Slots keep them small.
+        # Positions have no __dict__: plugins must use p.v.u instead.
+
     #@+others
     #@+node:ekr.20040228094013: *3*  p.ctor & other special methods...
     #@+node:ekr.20080416161551.190: *4*  p.__init__
@@ -195,7 +200,6 @@ class Position:
             self.stack = stack[:] # Creating a copy here is safest and best.
         else:
             self.stack = []
-        g.app.positions += 1
         # self.txtOffset = None # see self.textOffset()
     #@+node:ekr.20080920052058.3: *4* p.__eq__ & __ne__
     def __eq__(self, p2):
@@ -387,10 +391,12 @@ class Position:
     def following_siblings(self, copy=True):
         """Yield all siblings positions that follow p, not including p."""
         p = self
-        p = p.next()
-        while p:
-            yield p.copy() if copy else p
-            p.moveToNext()
+        if not p:
+            return
+        t = Traverser()
+        for v, childIndex, level in t.walk(t.siblings(p), p.stack, p._childIndex + 1):
+            t.prune()
+            yield t.position(copy)
 
     # Compatibility with old code...
     following_siblings_iter = following_siblings
@@ -420,14 +426,11 @@ class Position:
                 yield p.copy() if copy else p
                 return
         # Next, look for all .md files in the tree.
-        after = p1.nodeAfterTree()
-        p = p1
-        while p and p != after:
-            if predicate(p):
-                yield p.copy() if copy else p
-                p.moveToNodeAfterTree()
-            else:
-                p.moveToThreadNext()
+        t = Traverser()
+        for v, childIndex, level in t.walk_tree(p1):
+            if predicate(t.position(copy=False)):
+                yield t.position(copy)
+                t.prune()
 
     #@+node:ekr.20161120163203.1: *4* p.nearest_unique_roots (aka p.nearest)
     def nearest_unique_roots(self, copy=True, predicate=None):
@@ -457,27 +460,20 @@ class Position:
                 return
         # Next, look for all unique .md files in the tree.
         seen = set()
-        after = p1.nodeAfterTree()
-        p = p1
-        while p and p != after:
-            if predicate(p):
-                if p.v not in seen:
-                    seen.add(p.v)
-                    yield p.copy() if copy else p
-                p.moveToNodeAfterTree()
-            else:
-                p.moveToThreadNext()
+        t = Traverser()
+        for v, childIndex, level in t.walk_tree(p1):
+            if predicate(t.position(copy=False)):
+                if v not in seen:
+                    seen.add(v)
+                    yield t.position(copy)
+                t.prune()
 
     nearest = nearest_unique_roots
     #@+node:ekr.20091002083910.6104: *4* p.nodes
     def nodes(self):
         """Yield p.v and all vnodes in p's subtree."""
-        p = self
-        p = p.copy()
-        after = p.nodeAfterTree()
-        while p and p != after: # bug fix: 2013/10/12
-            yield p.v
-            p.moveToThreadNext()
+        for v, childIndex, level in Traverser().walk_tree(self):
+            yield v
     # Compatibility with old code.
 
     tnodes_iter = nodes
@@ -520,37 +516,29 @@ class Position:
     #@+node:ekr.20091001141621.6066: *4* p.self_and_subtree
     def self_and_subtree(self, copy=True):
         """Yield p and all positions in p's subtree."""
-        p = self
-        p = p.copy()
-        after = p.nodeAfterTree()
-        while p and p != after:
-            yield p.copy() if copy else p
-            p.moveToThreadNext()
+        t = Traverser()
+        for v, childIndex, level in t.walk_tree(self):
+            yield t.position(copy)
 
     # Compatibility with old code...
     self_and_subtree_iter = self_and_subtree
     #@+node:ekr.20091001141621.6056: *4* p.subtree
     def subtree(self, copy=True):
         """Yield all positions in p's subtree, but not p."""
-        p = self
-        p = p.copy()
-        after = p.nodeAfterTree()
-        p.moveToThreadNext()
-        while p and p != after:
-            yield p.copy() if copy else p
-            p.moveToThreadNext()
+        t = Traverser()
+        for v, childIndex, level in t.walk_subtree(self):
+            yield t.position(copy)
 
     # Compatibility with old code...
     subtree_iter = subtree
     #@+node:ekr.20091002083910.6105: *4* p.unique_nodes
     def unique_nodes(self):
         """Yield p.v and all unique vnodes in p's subtree."""
-        p = self
         seen = set()
-        for p in p.self_and_subtree(copy=False):
-            if p.v not in seen:
-                seen.add(p.v)
-                yield p.v
+        for v, childIndex, level in Traverser().walk_tree(self):
+            if v not in seen:
+                seen.add(v)
+                yield v
     # Compatibility with old code.
 
     unique_tnodes_iter = unique_nodes
@@ -558,13 +546,13 @@ class Position:
     #@+node:ekr.20091002083910.6103: *4* p.unique_subtree
     def unique_subtree(self, copy=True):
         """Yield p and all other unique positions in p's subtree."""
-        p = self
         seen = set()
-        for p in p.subtree():
-            if p.v not in seen:
-                seen.add(p.v)
+        t = Traverser()
+        for v, childIndex, level in t.walk_subtree(self):
+            if v not in seen:
+                seen.add(v)
                 # Fixed bug 1255208: p.unique_subtree returns vnodes, not positions.
-                yield p.copy() if copy else p
+                yield t.position(copy)
 
     # Compatibility with old code...
     subtree_with_unique_tnodes_iter = unique_subtree
@@ -1326,7 +1314,12 @@ class Position:
     #@+node:ekr.20040117171654: *4* p.copy
     def copy(self):
         """"Return an independent copy of a position."""
-        return Position(self.v, self._childIndex, self.stack)
+        # Bypass p.__init__: this is one of Leo's most-called methods.
+        p = Position.__new__(Position)
+        p._childIndex = self._childIndex
+        p.stack = self.stack[:]
+        p.v = self.v
+        return p
     #@+node:ekr.20040303175026.9: *4* p.copyTreeAfter, copyTreeTo
     # These used by unit tests, by the group_operations plugin,
     # and by the files-compare-leo-files command.
@@ -1891,6 +1884,132 @@ class PosList(list):
     #@-others
 
 Poslist = PosList # compatibility.
+#@+node:ekr.20191110080651.1: ** class Traverser
+class Traverser:
+    """
+    A copy-free traversal engine.
+
+    The t.walk methods yield (v, childIndex, level) tuples in outline order.
+    They walk the v.children arrays directly, using an explicit stack.
+    t.stack contains (v, childIndex) tuples for all ancestors of the last
+    yielded node, in the format of p.stack.
+
+    The traverser creates positions only on demand. Within the loop:
+
+    - t.position() returns the position of the last yielded node.
+    - t.prune() tells the traverser not to visit that node's descendants.
+
+    For example::
+
+        t = leoNodes.Traverser()
+        for v, childIndex, level in t.walk_outline(c):
+            if v.isAnyAtFileNode():
+                roots.append(t.position())
+                t.prune()
+
+    Each traverser supports only one walk at a time.
+    """
+
+    __slots__ = ('childIndex', 'frames', 'p', 'pruned', 'stack', 'v')
+
+    def __init__(self):
+        self.childIndex = 0
+        self.frames = []
+            # A list of [children, index, end] lists, one per level.
+        self.p = None
+            # The position returned by t.position(copy=False).
+        self.pruned = False
+            # True: don't visit the descendants of self.v.
+        self.stack = []
+        self.v = None
+    #@+others
+    #@+node:ekr.20191110080651.2: *3* t.position & t.prune
+    def position(self, copy=True):
+        """
+        Return the position of the last yielded node.
+
+        copy=False: return the same position each time, updated in place.
+        The caller must not change this position.
+        """
+        if copy:
+            return Position(self.v, self.childIndex, self.stack)
+        p = self.p
+        if p is None:
+            p = self.p = Position(None)
+        p.v, p._childIndex, p.stack = self.v, self.childIndex, self.stack
+        return p
+
+    def prune(self):
+        """Don't visit the descendants of the last yielded node."""
+        self.pruned = True
+    #@+node:ekr.20191110080651.3: *3* t.walk
+    def walk(self, children, stack=None, start=0, end=None):
+        """
+        Yield (v, childIndex, level) for children[start:end] and all their
+        descendants. stack is the p.stack of all positions in children.
+        """
+        self.stack = list(stack) if stack else []
+        self.frames = [[children, start, end]]
+        return self._walk()
+
+    def _walk(self):
+        """The traversal engine: yield tuples for self.frames."""
+        frames, stack = self.frames, self.stack
+        while frames:
+            frame = frames[-1]
+            children, i, end = frame
+            if i >= (len(children) if end is None else end):
+                frames.pop()
+                if frames:
+                    stack.pop()
+                continue
+            frame[1] = i + 1
+            v = children[i]
+            self.v, self.childIndex, self.pruned = v, i, False
+            yield v, i, len(stack)
+            if v.children and not self.pruned:
+                stack.append((v, i))
+                frames.append([v.children, 0, None])
+    #@+node:ekr.20191110080651.4: *3* t.walk_from
+    def walk_from(self, p):
+        """
+        Yield tuples for p and all following nodes in outline order,
+        that is, for all the nodes visited by p.moveToThreadNext.
+        """
+        if not p:
+            return iter([])
+        frames, parent_v = [], p.v.context.hiddenRootNode
+        for v, childIndex in p.stack:
+            frames.append([parent_v.children, childIndex + 1, None])
+            parent_v = v
+        frames.append([parent_v.children, p._childIndex, None])
+        self.stack = p.stack[:]
+        self.frames = frames
+        return self._walk()
+    #@+node:ekr.20191110080651.5: *3* t.walk_outline & walk_subtree & walk_tree
+    def walk_outline(self, c):
+        """Yield tuples for all nodes of c's outline."""
+        return self.walk(c.hiddenRootNode.children)
+
+    def walk_subtree(self, p):
+        """Yield tuples for all the descendants of p."""
+        if not p:
+            return iter([])
+        return self.walk(p.v.children, p.stack + [(p.v, p._childIndex)])
+
+    def walk_tree(self, p):
+        """Yield tuples for p and all its descendants."""
+        if not p:
+            return iter([])
+        i = p._childIndex
+        return self.walk(self.siblings(p), p.stack, i, i + 1)
+
+    def siblings(self, p):
+        """Return the children array containing p.v."""
+        if p.stack:
+            return p.stack[-1][0].children
+        return p.v.context.hiddenRootNode.children
+    #@-others
 #@+node:ekr.20031218072017.3341: ** class VNode
 #@@nobeautify
 
@@ -1913,6 +2032,18 @@ class VNode:
     writeBit = 0x400
     orphanBit = 0x800 # True: error in @<file> tree prevented it from being written.
     #@-<< VNode constants >>
+
+    __slots__ = (
+        '_headString', '_bodyString', 'children', 'parents',
+        'fileIndex', 'iconVal', 'statusBits', 'context',
+        'expandedPositions', 'insertSpot', 'scrollBarSpot',
+        'selectionLength', 'selectionStart',
+        # Optional ivars. They exist only after being set.
+        '_childIndices', '_p_changed', 'tempAttributes', 'unknownAttributes',
+        # The extension dict holds all other ivars, including ivars set by plugins.
+        # Python creates it only when one of those ivars is first set.
+        '__dict__',
+    )
     #@+others
     #@+node:ekr.20031218072017.3342: *3* v.Birth & death
     #@+node:ekr.20031218072017.3344: *4* v.__init
@@ -2218,6 +2349,31 @@ class VNode:
         v = self
         children = parent_v and parent_v.children
         return children and 0 <= n < len(children) and children[n] == v
+    #@+node:ekr.20191110091617.2: *4* v.childIndices (parent-path index)
+    def childIndices(self, parent_v):
+        """
+        Return the sorted list of all indices i such that parent_v.children[i] is v.
+
+        v._childIndices caches the result for each parent. The link methods
+        invalidate only the entry of the node they link or unlink. This
+        method repairs all other stale entries, including those of following
+        siblings, so code may still change v.children directly.
+        """
+        v = self
+        d = getattr(v, '_childIndices', None)
+        if d is None:
+            d = v._childIndices = {}
+        aList = d.get(parent_v)
+        children = parent_v.children
+        if aList is not None:
+            n = len(children)
+            if (
+                len(aList) == v.parents.count(parent_v) and
+                all(i < n and children[i] is v for i in aList)
+            ):
+                return aList[:]
+        aList = d[parent_v] = [i for i, z in enumerate(children) if z is v]
+        return aList[:]
     #@+node:ekr.20031218072017.3367: *4* v.Status Bits
     #@+node:ekr.20031218072017.3368: *5* v.isCloned
     def isCloned(self):
@@ -2455,6 +2611,7 @@ class VNode:
         # Set zodb changed flags.
         v._p_changed = 1
         parent_v._p_changed = 1
+        parent_v._indexInsertedChild(childIndex)
     #@+node:ekr.20090706110836.6135: *4* v._addLink & _addParentLinks
     def _addLink(self, childIndex, parent_v):
         """Adjust links after adding a link to v."""
@@ -2465,6 +2622,7 @@ class VNode:
         # Update parent_v.children & v.parents.
         parent_v.children.insert(childIndex, v)
         v.parents.append(parent_v)
+        parent_v._indexInsertedChild(childIndex)
         # Set zodb changed flags.
         v._p_changed = 1
         parent_v._p_changed = 1
@@ -2490,6 +2648,7 @@ class VNode:
         parent_v.childrenModified()
         assert parent_v.children[childIndex] == v
         del parent_v.children[childIndex]
+        parent_v._indexDeletedChild(childIndex, v)
         if parent_v in v.parents:
             try:
                 v.parents.remove(parent_v)
@@ -2529,7 +2688,24 @@ class VNode:
                 g.internalError(f"{v} not in parents of {v2}")
                 g.trace('v2.parents:')
                 g.printObj(v2.parents)
+            d = getattr(v2, '_childIndices', None)
+            if d:
+                d.pop(v, None)
         v.children = []
+    #@+node:ekr.20191110091617.1: *4* v._indexInsertedChild & _indexDeletedChild
+    def _indexInsertedChild(self, n):
+        """Invalidate the parent-path index entry of self.children[n]."""
+        parent_v = self
+        d = getattr(parent_v.children[n], '_childIndices', None)
+        if d:
+            d.pop(parent_v, None)
+
+    def _indexDeletedChild(self, n, v):
+        """Invalidate the parent-path index entry of v, deleted from self.children[n]."""
+        parent_v = self
+        d = getattr(v, '_childIndices', None)
+        if d:
+            d.pop(parent_v, None)
     #@+node:ekr.20031218072017.3425: *4* v._linkAsNthChild
     def _linkAsNthChild(self, parent_v, n):
         """Links self as the n'th child of VNode pv"""
@@ -1,6 +1,7 @@
 #@+leo-ver=5-thin
 #@+node:ekr.20031218072017.3439: * @file leoPlugins.py
 """Classes relating to Leo's plugin architecture."""
+import configparser
 import leo.core.leoGlobals as g
 import sys
 # Define modules that may be enabled by default
@@ -254,6 +255,9 @@ class LeoPluginsController:
     def __init__(self):
 
         self.handlers = {}
+        self.lazyPlugins = {}
+            # Keys are regularized module names, values are g.Bunches
+            # describing the stubs of plugins that load on first use.
         self.loadedModulesFilesDict = {}
             # Keys are regularized module names, values are the names of .leo files
             # containing @enabled-plugins nodes that caused the plugin to be loaded
@@ -262,6 +266,9 @@ class LeoPluginsController:
         self.loadingModuleNameStack = []
             # The stack of module names.
             # The top is the module being loaded.
+        self.manifest = None
+            # Keys are regularized module names, values are g.Bunches.
+            # Set by plugins.getManifest.
         self.signonModule = None # A hack for plugin_signon.
         # Settings.  Set these here in case finishCreate is never called.
         self.warn_on_failure = True
@@ -350,15 +357,24 @@ class LeoPluginsController:
     def getHandlersForOneTag(self, tag):
         aList = self.handlers.get(tag, [])
         return aList
-    #@+node:ekr.20100910075900.10204: *4* plugins.getLoadedPlugins
+    #@+node:ekr.20100910075900.10204: *4* plugins.getLoadedPlugins & getLazyPlugins
     def getLoadedPlugins(self):
         return list(self.loadedModules.keys())
+
+    def getLazyPlugins(self):
+        """Return the names of enabled plugins that have not yet been imported."""
+        return list(self.lazyPlugins.keys())
     #@+node:ekr.20100908125007.6020: *4* plugins.getPluginModule
     def getPluginModule(self, moduleName):
         return self.loadedModules.get(moduleName)
     #@+node:ekr.20100908125007.6021: *4* plugins.isLoaded
     def isLoaded(self, fn):
-        return self.regularizeName(fn) in self.loadedModules
+        """
+        Return True if the plugin has been loaded, or will be loaded on first
+        use. getPluginModule returns None for the latter.
+        """
+        moduleName = self.regularizeName(fn)
+        return moduleName in self.loadedModules or moduleName in self.lazyPlugins
     #@+node:ekr.20100908125007.6025: *4* plugins.printHandlers
     def printHandlers(self, c, moduleName=None):
         """Print the handlers for each plugin."""
@@ -396,6 +412,10 @@ class LeoPluginsController:
         data.append('enabled plugins...\n')
         for z in sorted(self.loadedModules):
             data.append(z)
+        if self.lazyPlugins:
+            data.append('\nplugins that load on first use...\n')
+            for z in sorted(self.lazyPlugins):
+                data.append(z)
         lines = ['%s\n' % (s) for s in data]
         g.es('', ''.join(lines), tabName=tabName)
     #@+node:ekr.20100908125007.6027: *4* plugins.printPluginsInfo
@@ -451,9 +471,11 @@ class LeoPluginsController:
             if 0:
                 s2 = f"@enabled-plugins found in {g.app.config.enabledPluginsFileName}"
                 g.blue(s2)
+        lazy = g.app.config.getBool('lazy-load-plugins', default=False)
         for plugin in s.splitlines():
             if plugin.strip() and not plugin.lstrip().startswith('#'):
-                self.loadOnePlugin(plugin.strip(), tag=tag)
+                if not (lazy and self.registerLazyPlugin(plugin.strip())):
+                    self.loadOnePlugin(plugin.strip(), tag=tag)
     #@+node:ekr.20100908125007.6024: *4* plugins.loadOnePlugin & helper functions
     def loadOnePlugin(self, moduleOrFileName, tag='open0', verbose=False):
         """
@@ -550,6 +572,8 @@ class LeoPluginsController:
                 # Return None, not False, to keep pylint happy.
                 # Allow Leo directives in @enabled-plugins nodes.
         moduleName = self.regularizeName(moduleOrFileName)
+        if moduleName in self.lazyPlugins:
+            return self.loadLazyPlugin(moduleName)
         if self.isLoaded(moduleName):
             module = self.loadedModules.get(moduleName)
             return module
@@ -557,12 +581,14 @@ class LeoPluginsController:
         moduleName = g.toUnicode(moduleName)
         #
         # Try to load the plugin.
+        phase = g.app.startupTracer.begin(moduleName, plugin=True)
         try:
             self.loadingModuleNameStack.append(moduleName)
             result = loadOnePluginHelper(moduleName)
         finally:
             self.loadingModuleNameStack.pop()
         if not result:
+            g.app.startupTracer.end(phase)
             if trace:
                 reportFailedImport()
             return None
@@ -573,6 +599,7 @@ class LeoPluginsController:
             result = finishImport(result)
         finally:
             self.loadingModuleNameStack.pop()
+            g.app.startupTracer.end(phase)
         if result:
             report(f"loaded: {moduleName}")
         self.signonModule = result # for self.plugin_signon.
@@ -590,7 +617,10 @@ class LeoPluginsController:
     #@+node:ekr.20100908125007.6030: *4* plugins.unloadOnePlugin
     def unloadOnePlugin(self, moduleOrFileName, verbose=False):
         moduleName = self.regularizeName(moduleOrFileName)
-        if self.isLoaded(moduleName):
+        bunch = self.lazyPlugins.pop(moduleName, None)
+        if bunch:
+            self.removeLazyStubs(bunch)
+        if moduleName in self.loadedModules:
             if verbose:
                 g.pr('unloading', moduleName)
             del self.loadedModules[moduleName]
@@ -598,6 +628,136 @@ class LeoPluginsController:
             bunches = self.handlers.get(tag)
             bunches = [bunch for bunch in bunches if bunch.moduleName != moduleName]
             self.handlers[tag] = bunches
+    #@+node:ekr.20191111110234.1: *3* plugins.Lazy loading
+    #@+at
+    # When @bool lazy-load-plugins is True, loadHandlers does not import
+    # enabled plugins that have entries in leo/plugins/plugins_manifest.ini
+    # or ~/.leo/plugins_manifest.ini. Instead, it registers a stub for each
+    # command and hook in the entry. The first stub to be called imports
+    # the plugin, removes all the plugin's stubs, calls the plugin's
+    # after-create-leo-frame handlers for all open commanders, and then
+    # does what the stub stands for.
+    #@@c
+    #@+node:ekr.20191111110234.2: *4* plugins.getManifest
+    def getManifest(self):
+        """
+        Return a dict whose keys are regularized module names and whose values
+        are g.Bunches with commands, hooks and settings ivars, the lists
+        of names in each section of the plugins manifests.
+        """
+        if self.manifest is not None:
+            return self.manifest
+        self.manifest = {}
+        paths = [
+            g.os_path_finalize_join(g.app.loadDir, '..', 'plugins', 'plugins_manifest.ini'),
+            g.os_path_finalize_join('~', '.leo', 'plugins_manifest.ini'),
+        ]
+        parser = configparser.ConfigParser(interpolation=None)
+        try:
+            parser.read(paths, encoding='utf-8')
+        except configparser.Error:
+            g.es_print('error reading plugins manifest')
+            g.es_exception()
+            return self.manifest
+        for section in parser.sections():
+            d = parser[section]
+            self.manifest[self.regularizeName(section)] = g.Bunch(
+                commands=d.get('commands', '').split(),
+                hooks=d.get('hooks', '').split(),
+                settings=d.get('settings', '').split(),
+            )
+        return self.manifest
+    #@+node:ekr.20191111110234.3: *4* plugins.registerLazyPlugin
+    def registerLazyPlugin(self, moduleOrFileName):
+        """
+        Register stubs for the commands and hooks of the plugin, as described
+        by its manifest entry. Return True if the plugin will load on first use.
+        """
+        if not g.app.enablePlugins or moduleOrFileName.startswith('@'):
+            return False
+        moduleName = self.regularizeName(moduleOrFileName)
+        if moduleName in self.lazyPlugins:
+            return True
+        entry = self.getManifest().get(moduleName)
+        if not entry or moduleName in self.loadedModules:
+            return False
+        bunch = g.Bunch(commands={}, hooks=[])
+        for commandName in entry.commands:
+            stub = self.makeCommandStub(moduleName, commandName)
+            bunch.commands[commandName] = stub
+            g.command(commandName)(stub)
+        self.loadingModuleNameStack.append(moduleName)
+        try:
+            for tag in entry.hooks:
+                stub = self.makeHookStub(moduleName)
+                bunch.hooks.append((tag, stub))
+                self.registerOneHandler(tag, stub)
+        finally:
+            self.loadingModuleNameStack.pop()
+        self.lazyPlugins[moduleName] = bunch
+        return True
+    #@+node:ekr.20191111110234.4: *4* plugins.makeCommandStub & makeHookStub
+    def makeCommandStub(self, moduleName, commandName):
+        """Return a command that loads the plugin and then executes commandName."""
+
+        def lazy_command_stub(event=None):
+            c = event and event.get('c')
+            self.loadLazyPlugin(moduleName)
+            func = c and c.commandsDict.get(commandName)
+            if func is None or func is lazy_command_stub:
+                func = g.global_commands_dict.get(commandName)
+            if func and func is not lazy_command_stub:
+                return func(event)
+            g.es_print(f"{moduleName} does not define {commandName}")
+            return None
+
+        lazy_command_stub.__doc__ = f"Load {moduleName}, then execute {commandName}."
+        return lazy_command_stub
+
+    def makeHookStub(self, moduleName):
+        """Return a hook handler that loads the plugin and then calls its handlers."""
+
+        def lazy_hook_stub(tag, keywords):
+            self.loadLazyPlugin(moduleName)
+            for bunch in self.handlers.get(tag, []):
+                if bunch.moduleName == moduleName:
+                    val = self.callTagHandler(bunch, tag, keywords)
+                    if val is not None:
+                        return val
+            return None
+
+        return lazy_hook_stub
+    #@+node:ekr.20191111110234.5: *4* plugins.loadLazyPlugin
+    def loadLazyPlugin(self, moduleName):
+        """
+        Remove the stubs of the plugin, import it and finish creating it for
+        all open commanders. Return the module or None.
+        """
+        bunch = self.lazyPlugins.pop(moduleName, None)
+        if not bunch:
+            return self.loadedModules.get(moduleName)
+        # Remove the stubs first, so the plugin can redefine them.
+        self.removeLazyStubs(bunch)
+        m = self.loadOnePlugin(moduleName)
+        if m:
+            # The plugin missed the hooks that create its per-commander data.
+            for c in g.app.commanders():
+                for tag in ('after-create-leo-frame', 'after-create-leo-frame2'):
+                    for handler in self.handlers.get(tag, []):
+                        if handler.moduleName == moduleName:
+                            self.callTagHandler(handler, tag, {'c': c, 'new_c': c})
+        return m
+    #@+node:ekr.20191111110234.6: *4* plugins.removeLazyStubs
+    def removeLazyStubs(self, bunch):
+        """Remove the command and hook stubs described by bunch."""
+        for commandName, stub in bunch.commands.items():
+            if g.global_commands_dict.get(commandName) is stub:
+                del g.global_commands_dict[commandName]
+            for c in g.app.commanders():
+                if c.commandsDict.get(commandName) is stub:
+                    del c.commandsDict[commandName]
+        for tag, stub in bunch.hooks:
+            self.unregisterOneHandler(tag, stub)
     #@+node:ekr.20100909065501.5951: *3* plugins.Registration
     #@+node:ekr.20100908125007.6028: *4* plugins.registerExclusiveHandler
     def registerExclusiveHandler(self, tags, fn):
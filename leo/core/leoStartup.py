@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+#@+leo-ver=5-thin
+#@+node:ekr.20191111113947.1: * @file leoStartup.py
+#@@first
+"""
+Gui-independent startup statistics.
+
+g.app.startupTracer is an instance of StartupTracer. LM.load enables it
+while Leo starts. It records the wall time, cpu time and the number of
+newly imported modules of each phase of startup and of each plugin.
+
+--trace=startup prints a summary. --startup-report=PATH writes the
+statistics as json. leo/test/leo-startup-benchmark.py compares such
+reports against a stored baseline.
+"""
+import json
+import sys
+import time
+#@+others
+#@+node:ekr.20191111113947.2: ** class StartupTracer
+class StartupTracer:
+    """
+    Wall time, cpu time and module imports of the phases of Leo's startup.
+
+    Phases nest: the times and imports of a phase include those of all
+    phases and plugins that start while it is active.
+    """
+
+    def __init__(self):
+        self.depth = 0
+            # The number of active phases.
+        self.enabled = False
+            # True: record phases. Set by tracer.start and tracer.finish.
+        self.phases = []
+            # Dicts describing phases, in the order in which they started.
+        self.plugin_dict = {}
+            # Keys are plugin names, values are the dicts in self.plugins.
+        self.plugins = []
+            # Dicts describing the import of plugins.
+        self.start_data = None
+            # (wall, cpu, number of modules) when recording started.
+        self.summary = {}
+            # A dict describing all of startup. Set by tracer.finish.
+    #@+others
+    #@+node:ekr.20191111113947.3: *3* tracer.start & finish
+    def start(self):
+        """Start recording. Called by LM.load."""
+        self.depth = 0
+        self.phases, self.plugins, self.summary = [], [], {}
+        self.plugin_dict = {}
+        self.enabled = True
+        self.start_data = self.now()
+
+    def finish(self, **keys):
+        """
+        Stop recording, and summarize all of startup. Keyword arguments
+        become part of the summary.
+        """
+        if not self.enabled:
+            return
+        self.enabled = False
+        wall, cpu, n = self.now()
+        wall0, cpu0, n0 = self.start_data
+        self.summary = {
+            'wall': wall - wall0,
+            'cpu': cpu - cpu0,
+            'imports': n - n0,
+            'modules': n,
+        }
+        self.summary.update(keys)
+    #@+node:ekr.20191111113947.4: *3* tracer.begin & end
+    def begin(self, name, plugin=False):
+        """
+        Start timing the named phase or plugin. Return None if the tracer is
+        not enabled. Pass the result to tracer.end.
+
+        Each phase gets its own dict. All attempts to import a plugin share
+        one dict.
+        """
+        if not self.enabled:
+            return None
+        wall, cpu, n = self.now()
+        aList = self.plugins if plugin else self.phases
+        d = self.plugin_dict.get(name) if plugin else None
+        if not d:
+            d = {
+                'name': name,
+                'depth': self.depth,
+                'start': wall - self.start_data[0],
+                'count': 0,
+                'wall': 0.0,
+                'cpu': 0.0,
+                'imports': 0,
+            }
+            aList.append(d)
+            if plugin:
+                self.plugin_dict[name] = d
+        self.depth += 1
+        return d, wall, cpu, n
+
+    def end(self, data):
+        """Finish timing a phase or plugin. data is the result of tracer.begin."""
+        if data is None:
+            return
+        d, wall0, cpu0, n0 = data
+        wall, cpu, n = self.now()
+        d['count'] += 1
+        d['wall'] += wall - wall0
+        d['cpu'] += cpu - cpu0
+        d['imports'] += n - n0
+        self.depth = max(0, self.depth - 1)
+    #@+node:ekr.20191111113947.5: *3* tracer.now
+    def now(self):
+        """Return (wall time, cpu time, number of imported modules)."""
+        return time.perf_counter(), time.process_time(), len(sys.modules)
+    #@+node:ekr.20191111113947.6: *3* tracer.report
+    def report(self):
+        """Return a list of lines summarizing all phases and plugins."""
+        lines = ['%-40s %8s %8s %7s' % ('phase', 'wall', 'cpu', 'imports')]
+
+        def add(d, name):
+            lines.append('%-40s %8.1f %8.1f %7s' % (
+                name, 1000 * d['wall'], 1000 * d['cpu'], d['imports']))
+
+        for d in self.phases:
+            add(d, '  ' * d['depth'] + d['name'])
+        if self.plugins:
+            lines.append('plugins...')
+            for d in sorted(self.plugins, key=lambda d: -d['wall']):
+                add(d, '  ' + d['name'])
+        s = self.summary
+        if s:
+            add(s, 'total')
+            lines.append(f"{s['modules']} modules")
+            for key in ('loaded_plugins', 'lazy_plugins'):
+                if key in s:
+                    lines.append(f"{len(s[key])} {key.replace('_', ' ')}")
+        lines.append('times in msec.')
+        return lines
+    #@+node:ekr.20191111113947.7: *3* tracer.to_dict & to_json
+    def to_dict(self):
+        """Return a json-compatible dict describing all phases and plugins."""
+        return {
+            'phases': self.phases,
+            'plugins': self.plugins,
+            'summary': self.summary,
+        }
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), indent=1, sort_keys=True)
+    #@-others
+#@-others
+#@@language python
+#@@tabwidth -4
+#@@pagewidth 70
+#@-leo
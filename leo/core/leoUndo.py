@@ -44,6 +44,12 @@
 # I first saw this model of unlimited undo in the documentation for Apple's Yellow Box classes.
 #@-<< How Leo implements unlimited undo >>
 import leo.core.leoGlobals as g
+import leo.core.leoNodes as leoNodes
+import hashlib
+import json
+import sqlite3
+import time
+import zlib
 # pylint: disable=unpacking-non-sequence
 #@+others
 #@+node:ekr.20031218072017.3605: ** class Undoer
@@ -61,6 +67,13 @@ class Undoer:
         self.debug_print = False # True: enable print statements in debug code.
         self.granularity = None # Set in reloadSettings.
         self.max_undo_stack_size = c.config.getInt('max-undo-stack-size') or 0
+        self.max_undo_memory = 0 # Set in reloadSettings.
+        self.n_evicted = 0 # The number of beads evicted by u.cutMemory.
+        self.history = None # The UndoHistory of the outline, created when first needed.
+        self.history_clears = 0 # The number of calls to u.clearUndoState.
+        self.history_dir = None # None: use ~/.leo/db/undo_history.
+        self.max_history_days = 0 # Set in reloadSettings.
+        self.max_history_size = 0 # Set in reloadSettings.
         # Statistics comparing old and new ways (only if self.debug_Undoer is on).
         self.new_mem = 0
         self.old_mem = 0
@@ -128,6 +141,10 @@ class Undoer:
             self.granularity = self.granularity.lower()
         if self.granularity not in ('node', 'line', 'word', 'char'):
             self.granularity = 'line'
+        # The setting is in megabytes.
+        self.max_undo_memory = 1024 * 1024 * (c.config.getInt('max-undo-memory') or 0)
+        self.max_history_days = c.config.getInt('undo-history-days') or 0
+        self.max_history_size = c.config.getInt('undo-history-size') or 0
 
     def redoHelper(self):
         pass
@@ -146,6 +163,130 @@ class Undoer:
         u.p = None # The position/node being operated upon for undo and redo.
         for ivar in u.optionalIvars:
             setattr(u, ivar, None)
+    #@+node:ekr.20191110210824.1: *4* u.cutMemory & helpers
+    def cutMemory(self):
+        """
+        Keep the memory used by the undo stack within u.max_undo_memory,
+        first by packing all beads fully, then by deleting the oldest beads.
+        """
+        u = self; n = u.max_undo_memory
+        if sum(bunch.get('undoMemory', 0) for bunch in u.beads) <= n:
+            return
+        # Do nothing if we are in the middle of creating a group.
+        for bunch in u.beads:
+            if bunch.get('kind') == 'beforeGroup':
+                return
+        # Pack the texts that the outline no longer shares with the beads.
+        for bunch in u.beads:
+            u.packBead(bunch, full=True)
+        total = sum(bunch.undoMemory for bunch in u.beads)
+        # Never delete the present bead.
+        i = 0
+        while total > n and i < u.bead:
+            total -= u.beads[i].undoMemory
+            i += 1
+        if i > 0:
+            u.beads = u.beads[i:]
+            u.bead -= i
+            u.n_evicted += i
+    #@+node:ekr.20191110210824.2: *5* u.beadMemory
+    tree_entry_size = 600
+        # The estimated size in bytes of the bunches for one saved VNode.
+
+    def beadMemory(self, bunch):
+        """
+        Return the estimated number of bytes used by a bead,
+        not counting texts that the outline still contains.
+        """
+        u = self
+        seen, total = set(), 0
+        for old, old_key, new, new_key, v in u.textSlots(bunch):
+            live = getattr(v, '_bodyString', None)
+            for s in (getattr(old, old_key, None), new and getattr(new, new_key, None)):
+                if s is None or s is live or id(s) in seen:
+                    continue
+                seen.add(id(s))
+                total += s.size() if isinstance(s, PackedText) else len(s)
+        for z in [bunch] + (bunch.get('items') or []):
+            for key in ('oldTree', 'newTree'):
+                total += u.tree_entry_size * len(z.get(key) or [])
+            for key in ('oldMiddleLines', 'newMiddleLines'):
+                total += sum(len(line) for line in z.get(key) or [])
+        return total
+    #@+node:ekr.20191110210824.3: *5* u.packBead
+    pack_threshold = 1024
+        # Texts shorter than this are never packed.
+
+    def packBead(self, bunch, full=False):
+        """
+        Replace long texts in the bead by PackedText objects and set
+        bunch.undoMemory.
+
+        Old texts become deltas against the corresponding new texts.
+        full: also compress the new texts that the outline no longer contains.
+        """
+        u = self
+        for old, old_key, new, new_key, v in u.textSlots(bunch):
+            old_s = getattr(old, old_key, None)
+            new_s = new and getattr(new, new_key, None)
+            if (full and isinstance(new_s, str) and len(new_s) >= u.pack_threshold
+                and new_s is not getattr(v, '_bodyString', None)
+            ):
+                packed = PackedText(new_s)
+                setattr(new, new_key, packed)
+                if old_s is new_s:
+                    setattr(old, old_key, packed)
+                elif isinstance(old_s, PackedText) and old_s.base is new_s:
+                    old_s.base = packed
+                new_s = packed
+            if not isinstance(old_s, str) or len(old_s) < u.pack_threshold:
+                continue
+            if isinstance(new_s, str) and old_s == new_s:
+                # Share the new text.
+                setattr(old, old_key, new_s)
+            elif isinstance(new_s, str):
+                setattr(old, old_key, PackedText(old_s, base=new_s))
+            else:
+                setattr(old, old_key, PackedText(old_s))
+        bunch.undoMemory = u.beadMemory(bunch)
+    #@+node:ekr.20191110214537.1: *5* u.packPreviousBead
+    def packPreviousBead(self):
+        """
+        Fully pack the bead before the present bead.
+
+        Its new texts are usually the old texts of the present bead,
+        so the outline no longer contains them.
+        """
+        u = self
+        if 0 < u.bead < len(u.beads):
+            u.packBead(u.beads[u.bead - 1], full=True)
+    #@+node:ekr.20191110210824.4: *5* u.textSlots
+    def textSlots(self, bunch):
+        """
+        Yield (old, old_key, new, new_key, v) for all texts in the bead
+        that u.packBead may pack. new is None if there is no new text.
+        """
+        u = self
+        for z in bunch.get('items') or []:
+            yield from u.textSlots(z)
+        kind = bunch.get('kind')
+        p = bunch.get('p')
+        v = p and p.v
+        if kind == 'node':
+            yield bunch, 'oldBody', bunch, 'newBody', v
+        elif kind == 'tree':
+            yield bunch, 'oldText', bunch, 'newText', v
+            d = {z[0]: z[2] for z in bunch.get('newTree') or []}
+            for v2, vInfo, tInfo in bunch.get('oldTree') or []:
+                yield tInfo, 'bodyString', d.get(v2), 'bodyString', v2
+        elif kind == 'insert' and bunch.get('pasteAsClone'):
+            d = {z.v: z for z in bunch.get('afterTree') or []}
+            for z in bunch.get('beforeTree') or []:
+                yield z, 'body', d.get(z.v), 'body', z.v
+    #@+node:ekr.20191110210824.5: *5* u.unpack
+    def unpack(self, s):
+        """Return the text represented by s, which may be a PackedText."""
+        return s.text() if isinstance(s, PackedText) else s
     #@+node:ekr.20060127052111.1: *4* u.cutStack
     def cutStack(self):
         u = self; n = u.max_undo_stack_size
@@ -161,6 +302,8 @@ class Undoer:
                 # g.trace('Cutting undo stack to %d entries' % (n))
             u.beads = u.beads[-n:]
             u.bead = n - 1
+        if u.max_undo_memory > 0 and not g.app.unitTesting:
+            u.cutMemory()
     #@+node:ekr.20080623083646.10: *4* u.dumpBead
     def dumpBead(self, n):
         u = self
@@ -201,13 +344,16 @@ class Undoer:
         u = self
         # New in 4.4b2:  Add this to the group if it is being accumulated.
         bunch2 = u.bead >= 0 and u.bead < len(u.beads) and u.beads[u.bead]
+        u.packBead(bunch)
         if bunch2 and hasattr(bunch2, 'kind') and bunch2.kind == 'beforeGroup':
             # Just append the new bunch the group's items.
             bunch2.items.append(bunch)
+            bunch2.undoMemory = bunch2.get('undoMemory', 0) + bunch.undoMemory
         else:
             # Push the bunch.
             u.bead += 1
             u.beads[u.bead:] = [bunch]
+            u.packPreviousBead()
             # Recalculate the menu labels.
             u.setUndoTypes()
     #@+node:ekr.20050126081529: *4* u.recognizeStartOfTypingWord
@@ -257,7 +403,7 @@ class Undoer:
             g.pr('-' * 20)
         # bunch is not a dict, so bunch.keys() is required.
         for key in list(bunch.keys()):
-            val = bunch.get(key)
+            val = u.unpack(bunch.get(key))
             setattr(u, key, val)
             if key not in u.optionalIvars:
                 u.optionalIvars.append(key)
@@ -347,7 +493,7 @@ class Undoer:
     def restoreTnodeUndoInfo(self, bunch):
         v = bunch.v
         v.h = bunch.headString
-        v.b = bunch.bodyString
+        v.b = self.unpack(bunch.bodyString)
         v.statusBits = bunch.statusBits
         uA = bunch.get('unknownAttributes')
         if uA is not None:
@@ -769,6 +915,7 @@ class Undoer:
         # Push the bunch.
         u.bead += 1
         u.beads[u.bead:] = [bunch]
+        u.packPreviousBead()
     #@+node:ekr.20050315133212.2: *5* u.beforeChangeNodeContents
     def beforeChangeNodeContents(self, p, oldBody=None, oldHead=None, oldYScroll=None):
         """Return data that gets passed to afterChangeNode"""
@@ -879,6 +1026,9 @@ class Undoer:
         u.setUndoType("Can't Undo")
         u.beads = [] # List of undo nodes.
         u.bead = -1 # Index of the present bead: -1:len(beads)
+        u.history_clears += 1
+        if u.history:
+            u.history.broken = True
     #@+node:ekr.20031218072017.3611: *4* u.enableMenuItems
     def enableMenuItems(self):
         u = self; frame = u.c.frame
@@ -1158,6 +1308,65 @@ class Undoer:
         if u.per_node_undo:
             u.putIvarsToVnode(p)
         return bunch # Never used.
+    #@+node:ekr.20191111060450.9: *3* u.History
+    #@+node:ekr.20191111060450.10: *4* u.getHistory
+    def getHistory(self, fn):
+        """Return the UndoHistory for file fn, or None."""
+        u = self
+        if u.history and u.history.fn == fn:
+            return u.history
+        path = u.historyPath(fn)
+        if not path:
+            return None
+        try:
+            history = UndoHistory(u, fn, path)
+        except Exception:
+            g.es_print('can not open undo history', path)
+            g.es_exception()
+            return None
+        # c.finishCreate clears the undo state once before reading the outline.
+        # Otherwise, the beads in memory don't start with the outline as read.
+        history.broken = bool(u.history) or u.history_clears > 1
+        if u.history:
+            u.history.close()
+        u.history = history
+        return history
+    #@+node:ekr.20191111060450.11: *4* u.historyPath
+    def historyPath(self, fn):
+        """Return the path to the undo history for file fn, or None."""
+        u = self
+        if not fn or u.max_history_size <= 0:
+            return None
+        if g.app.unitTesting and not u.history_dir:
+            return None
+        directory = u.history_dir or g.os_path_join(g.app.homeLeoDir, 'db', 'undo_history')
+        path = g.os_path_normcase(g.os_path_abspath(fn))
+        md5 = hashlib.md5(path.encode('utf-8')).hexdigest()
+        return g.os_path_join(directory, f"{g.shortFileName(fn)}_{md5[:12]}.sqlite")
+    #@+node:ekr.20191111060450.12: *4* u.loadHistory & writeHistory
+    def loadHistory(self):
+        """Load the saved undo history of the outline, if possible."""
+        u = self; c = u.c
+        history = u.getHistory(c.mFileName)
+        if history:
+            try:
+                history.load()
+            except Exception:
+                g.es_print('can not load undo history', history.path)
+                g.es_exception()
+
+    def writeHistory(self, fn):
+        """Save the undo history of the outline just saved to file fn."""
+        u = self
+        history = u.getHistory(fn)
+        if history:
+            try:
+                history.write()
+            except Exception:
+                g.es_print('can not save undo history', history.path)
+                g.es_exception()
+                if history.conn.in_transaction:
+                    history.conn.execute('rollback')
     #@+node:ekr.20031218072017.2030: *3* u.redo
     @cmd('redo')
     def redo(self, event=None):
@@ -1168,6 +1377,8 @@ class Undoer:
             return
         # End editing *before* getting state.
         c.endEditing()
+        if not u.beads:
+            u.loadHistory()
         if not u.canRedo():
             return
         if not u.getBead(u.bead + 1):
@@ -1322,10 +1533,10 @@ class Undoer:
             for bunch in u.afterTree:
                 v = bunch.v
                 if u.newP.v == v:
-                    c.setBodyString(u.newP, bunch.body)
+                    c.setBodyString(u.newP, u.unpack(bunch.body))
                     c.setHeadString(u.newP, bunch.head)
                 else:
-                    v.setBodyString(bunch.body)
+                    v.setBodyString(u.unpack(bunch.body))
                     v.setHeadString(bunch.head)
         c.selectPosition(u.newP)
     #@+node:ekr.20050526125801: *4* u.redoMark
@@ -1437,6 +1648,26 @@ class Undoer:
         if u.yview:
             c.bodyWantsFocus()
             w.setYScrollPosition(u.yview)
+    #@+node:ekr.20191110210824.10: *3* u.showUndoMemory
+    @cmd('show-undo-memory')
+    def showUndoMemory(self, event=None):
+        """Report the memory used by the undo stack."""
+        u = self
+        total = packed = unpacked = 0
+        seen = set()
+        for bunch in u.beads:
+            total += u.beadMemory(bunch)
+            for old, old_key, new, new_key, v in u.textSlots(bunch):
+                for s in (getattr(old, old_key, None), new and getattr(new, new_key, None)):
+                    if isinstance(s, PackedText) and id(s) not in seen:
+                        seen.add(id(s))
+                        packed += s.size()
+                        unpacked += s.n
+        limit = f"{u.max_undo_memory // 1024} KB" if u.max_undo_memory else 'unlimited'
+        g.es_print(f"undo stack: {len(u.beads)} beads, {total // 1024} KB, limit: {limit}")
+        g.es_print(f"packed texts: {unpacked // 1024} KB in {packed // 1024} KB")
+        if u.n_evicted:
+            g.es_print(f"deleted {u.n_evicted} beads to save memory")
     #@+node:ekr.20031218072017.2039: *3* u.undo
     @cmd('undo')
     def undo(self, event=None):
@@ -1450,6 +1681,8 @@ class Undoer:
         c.endEditing()
         if u.per_node_undo: # 2011/05/19
             u.setIvarsFromVnode(c.p)
+        if u.bead < 0:
+            u.loadHistory()
         if not u.canUndo():
             return
         if not u.getBead(u.bead):
@@ -1616,10 +1849,10 @@ class Undoer:
             for bunch in u.beforeTree:
                 v = bunch.v
                 if u.p.v == v:
-                    c.setBodyString(u.p, bunch.body)
+                    c.setBodyString(u.p, u.unpack(bunch.body))
                     c.setHeadString(u.p, bunch.head)
                 else:
-                    v.setBodyString(bunch.body)
+                    v.setBodyString(u.unpack(bunch.body))
                     v.setHeadString(bunch.head)
     #@+node:ekr.20050526124906: *4* u.undoMark
     def undoMark(self):
@@ -1792,6 +2025,313 @@ class Undoer:
             c.bodyWantsFocus()
             w.setYScrollPosition(u.yview)
     #@-others
+#@+node:ekr.20191110210824.6: ** class PackedText
+class PackedText:
+    """
+    A compact representation of a text saved in an undo bead.
+
+    If base is given, only the part of the text that differs from the base
+    is saved, so base must not change. base may itself be a PackedText.
+    """
+    
+    def __init__(self, s, base=None):
+        self.base = base
+        self.n = len(s)
+        prefix = suffix = 0
+        if base is not None:
+            prefix = self.common_prefix(s, base)
+            suffix = self.common_prefix(s[prefix:][::-1], base[prefix:][::-1])
+        self.prefix, self.suffix = prefix, suffix
+        middle = s[prefix:len(s)-suffix]
+        self.data = zlib.compress(middle.encode('utf-8', 'surrogatepass'), 1)
+
+    def __repr__(self):
+        return f"<PackedText: {self.n} chars in {self.size()} bytes>"
+    #@+others
+    #@+node:ekr.20191110210824.7: *3* PackedText.common_prefix
+    @staticmethod
+    def common_prefix(s1, s2):
+        """Return the length of the longest common prefix of s1 and s2."""
+        lo, hi = 0, min(len(s1), len(s2))
+        # Invariant: s1[:lo] == s2[:lo].
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if s1[lo:mid] == s2[lo:mid]:
+                lo = mid
+            else:
+                hi = mid - 1
+        return lo
+    #@+node:ekr.20191110210824.8: *3* PackedText.size
+    def size(self):
+        """Return the estimated number of bytes used by this object."""
+        return len(self.data) + 100
+    #@+node:ekr.20191110210824.9: *3* PackedText.text
+    def text(self):
+        """Return the original text."""
+        middle = zlib.decompress(self.data).decode('utf-8', 'surrogatepass')
+        if self.base is None:
+            return middle
+        base = self.base
+        if isinstance(base, PackedText):
+            base = base.text()
+        return base[:self.prefix] + middle + base[len(base)-self.suffix:]
+    #@-others
+#@+node:ekr.20191111060450.1: ** class UndoHistory
+class UndoHistory:
+    """
+    The persistent undo history of one outline, u.history.
+
+    The history is an sqlite database containing one row for each bead.
+    Row n holds bead n, counting from the first bead ever saved. Saving
+    the outline appends the beads pushed since the last save, deleting
+    only the rows of beads that were discarded by undoing and then doing
+    something new.
+
+    The history is loaded only when the user undoes or redoes past the
+    beads in memory. It is used only if the outline is in the state it
+    was in when the history was last saved.
+    """
+
+    persistent_kinds = (
+        'afterGroup', 'dehoist', 'demote', 'hoist', 'mark', 'move',
+        'node', 'promote', 'sort', 'tree', 'typing',
+    )
+        # Beads of these kinds refer only to nodes that exist in the
+        # outline, or to nodes whose data the bead itself contains.
+    version = 1
+
+    def __init__(self, u, fn, path):
+        """Ctor for UndoHistory class."""
+        self.u = u
+        self.c = u.c
+        self.fn = fn
+        self.path = path
+        self.broken = False
+            # True: the beads in memory do not continue the saved beads.
+        self.hashes = {}
+            # Keys are row numbers, values are md5 hashes of the rows' data.
+        self.loaded = False
+        g.makeAllNonExistentDirectories(g.os_path_dirname(path), force=True, verbose=False)
+        self.conn = sqlite3.connect(path, isolation_level=None)
+        for sql in (
+            'create table if not exists beads(n integer primary key, time real, data blob)',
+            'create table if not exists states(n integer primary key, fingerprint text)',
+            'create table if not exists meta(key text primary key, value text)',
+        ):
+            self.conn.execute(sql)
+        d = dict(self.conn.execute('select key, value from meta').fetchall())
+        if d.get('version') != str(self.version):
+            self.clear()
+            d = {}
+        self.base = int(d.get('bead', -1)) + 1
+            # The row number of u.beads[0].
+    #@+others
+    #@+node:ekr.20191111060450.2: *3* history.clear & close
+    def clear(self):
+        """Delete the entire history."""
+        conn = self.conn
+        conn.execute('delete from beads')
+        conn.execute('delete from states')
+        conn.execute('delete from meta')
+        conn.execute('insert into meta values (?, ?)', ('version', str(self.version)))
+        self.base = 0
+        self.hashes = {}
+
+    def close(self):
+        self.conn.close()
+    #@+node:ekr.20191111060450.3: *3* history.decode & encode
+    def decode(self, val):
+        """Return the value described by val, a value created by history.encode."""
+        if isinstance(val, list):
+            return [self.decode(z) for z in val]
+        if not isinstance(val, dict):
+            return val
+        kind, data = list(val.items())[0]
+        if kind == 'b':
+            return g.Bunch(**{key: self.decode(z) for key, z in data.items()})
+        if kind == 'd':
+            return {key: self.decode(z) for key, z in data.items()}
+        if kind == 'm':
+            return getattr(self.u, data)
+        if kind == 'p':
+            stack = [(self.vnode(gnx), i) for gnx, i in data[:-1]]
+            gnx, i = data[-1]
+            return leoNodes.Position(self.vnode(gnx), i, stack)
+        if kind == 'v':
+            return self.vnode(data)
+        raise ValueError(f"bad kind: {kind!r}")
+
+    def encode(self, val):
+        """
+        Return a json-compatible description of val.
+        Raise TypeError if val can not be described.
+        """
+        if val is None or isinstance(val, (bool, int, float, str)):
+            return val
+        if isinstance(val, PackedText):
+            return val.text()
+        if isinstance(val, (list, tuple)):
+            return [self.encode(z) for z in val]
+        if isinstance(val, g.Bunch):
+            return {'b': {
+                key: self.encode(val.get(key)) for key in val.keys()
+                    if key not in ('historyHash', 'undoMemory')}}
+        if isinstance(val, dict) and all(isinstance(z, str) for z in val):
+            return {'d': {key: self.encode(z) for key, z in val.items()}}
+        if isinstance(val, leoNodes.Position):
+            path = [[v.gnx, i] for v, i in val.stack]
+            return {'p': path + [[val.v.gnx, val._childIndex]]}
+        if isinstance(val, leoNodes.VNode):
+            return {'v': val.gnx}
+        if getattr(val, '__self__', None) is self.u:
+            return {'m': val.__name__}
+        raise TypeError(f"can not save {val!r}")
+    #@+node:ekr.20191111060450.4: *3* history.decode_bead & encode_bead
+    def decode_bead(self, data):
+        """Return the bead described by data, or None."""
+        try:
+            s = zlib.decompress(data).decode('utf-8')
+            return self.decode(json.loads(s))
+        except Exception:
+            return None
+
+    def encode_bead(self, bunch):
+        """Return the compressed description of a bead, or None."""
+        for z in [bunch] + (bunch.get('items') or []):
+            if z.get('kind') not in self.persistent_kinds:
+                return None
+        try:
+            s = json.dumps(self.encode(bunch), separators=(',', ':'))
+        except (TypeError, ValueError):
+            return None
+        return zlib.compress(s.encode('utf-8'))
+    #@+node:ekr.20191111060450.5: *3* history.fingerprint
+    def fingerprint(self):
+        """Return an md5 hash of the entire outline."""
+        c = self.c
+        h = hashlib.md5()
+        for v in [c.hiddenRootNode] + list(c.all_unique_nodes()):
+            h.update(f"{v.gnx}\0{v.h}\0{len(v.b)}\0".encode('utf-8', 'surrogatepass'))
+            h.update(v.b.encode('utf-8', 'surrogatepass'))
+            h.update(' '.join(z.gnx for z in v.children).encode('utf-8'))
+        return h.hexdigest()
+    #@+node:ekr.20191111060450.6: *3* history.load
+    def load(self):
+        """
+        Add the saved beads to the beads in memory if the outline is in the
+        state it was in when the history was last saved.
+
+        Called only when there is nothing more to undo or redo in memory.
+        """
+        u = self.u
+        if self.loaded or self.broken:
+            return
+        self.loaded = True
+        row = self.conn.execute(
+            'select fingerprint from states where n=?', (self.base - 1,)).fetchone()
+        if not row or row[0] != self.fingerprint():
+            return
+        rows = dict(self.conn.execute('select n, data from beads').fetchall())
+        # Load the beads to undo, stopping at the first gap or bad row.
+        undo_beads, n = [], self.base - 1
+        while n in rows:
+            bunch = self.decode_bead(rows[n])
+            if not bunch:
+                break
+            bunch.historyHash = self.hashes[n] = hashlib.md5(rows[n]).hexdigest()
+            undo_beads.insert(0, bunch)
+            n -= 1
+        # Load the beads to redo only if there are no beads in memory.
+        redo_beads, n = [], self.base
+        while n in rows and not u.beads:
+            bunch = self.decode_bead(rows[n])
+            if not bunch:
+                break
+            bunch.historyHash = self.hashes[n] = hashlib.md5(rows[n]).hexdigest()
+            redo_beads.append(bunch)
+            n += 1
+        if undo_beads or redo_beads:
+            for bunch in undo_beads + redo_beads:
+                u.packBead(bunch, full=True)
+            u.beads = undo_beads + u.beads + redo_beads
+            u.bead += len(undo_beads)
+            self.base -= len(undo_beads)
+            u.setUndoTypes()
+    #@+node:ekr.20191111060450.7: *3* history.vnode
+    def vnode(self, gnx):
+        """Return the VNode with the given gnx, creating it if necessary."""
+        c = self.c
+        if gnx == c.hiddenRootNode.gnx:
+            return c.hiddenRootNode
+        v = c.fileCommands.gnxDict.get(gnx)
+        if not v:
+            # The node has been deleted. The bead contains its data.
+            v = leoNodes.VNode(context=c, gnx=gnx)
+        return v
+    #@+node:ekr.20191111060450.8: *3* history.write
+    def write(self):
+        """
+        Save all beads that can be saved, appending beads pushed since the
+        last save. Called after saving the outline.
+        """
+        u = self.u
+        conn = self.conn
+        conn.execute('begin')
+        if self.broken:
+            self.clear()
+            self.broken = False
+            self.loaded = True
+        # Describe all beads, reusing the hashes of unchanged beads.
+        # Only the present bead can change after being pushed.
+        entries = []
+        for i, bunch in enumerate(u.beads):
+            h = bunch.get('historyHash') if i != u.bead else None
+            data = None
+            if h is None:
+                data = self.encode_bead(bunch)
+                h = hashlib.md5(data).hexdigest() if data else ''
+                if i != u.bead:
+                    bunch.historyHash = h
+            entries.append((h, data))
+        # Save beads lo through hi-1, the beads around the present bead
+        # that can be saved.
+        lo = u.bead + 1
+        while lo > 0 and entries[lo - 1][0]:
+            lo -= 1
+        hi = u.bead + 1
+        while hi < len(entries) and entries[hi][0]:
+            hi += 1
+        base = self.base
+        if lo > 0:
+            # The older beads can never be reached.
+            conn.execute('delete from beads where n<?', (base + lo,))
+        # Append the beads that differ from the saved beads.
+        for i in range(lo, hi):
+            n = base + i
+            if self.hashes.get(n) != entries[i][0]:
+                conn.execute('delete from beads where n>=?', (n,))
+                conn.execute('delete from states where n>=?', (n,))
+                for j in range(i, hi):
+                    h, data = entries[j]
+                    conn.execute('insert into beads values (?, ?, ?)', (
+                        base + j, time.time(), data or self.encode_bead(u.beads[j])))
+                    self.hashes[base + j] = h
+                break
+        conn.execute('delete from beads where n>=?', (base + hi,))
+        self.hashes = {n: h for n, h in self.hashes.items() if n < base + hi}
+        # Remember the state of the outline after the present bead.
+        n = base + u.bead
+        conn.execute('insert or replace into states values (?, ?)', (n, self.fingerprint()))
+        conn.execute('insert or replace into meta values (?, ?)', ('bead', str(n)))
+        # Enforce the retention limits.
+        if u.max_history_size > 0:
+            conn.execute('delete from beads where n<?', (base + hi - u.max_history_size,))
+        if u.max_history_days > 0:
+            conn.execute('delete from beads where time<?',
+                (time.time() - 24 * 3600 * u.max_history_days,))
+        conn.execute('delete from states where n<(select min(n)-1 from beads)')
+        conn.execute('commit')
+    #@-others
 #@-others
 #@@language python
 #@@tabwidth -4
@@ -5,6 +5,7 @@ Shows how to patch python colorizer.
 '''
 import leo.core.leoGlobals as g
 assert g
+import leo.core.leoColorizer as leoColorizer
 import re
 #@+others
 #@+node:ekr.20180119164528.6: ** init
@@ -30,6 +31,7 @@ def patch_colorizer(c):
     aList = d.get('G', [])
     aList.insert(0, python_rule_global)
     d['G'] = aList
+    leoColorizer.CompiledRuleset.invalidate(colorizer.compiled_rulesets, d)
     # g.printObj(rulesDict.get('G'))
     # Force a full recolor.
     c.frame.body.wrapper.setAllText(c.p.b)
@@ -91,6 +91,10 @@ class LeoQtEventFilter(QtCore.QObject):
             key_event = self.createKeyEvent(event, c, self.w, ch, binding)
             k.masterKeyHandler(key_event)
             c.outerUpdate()
+            # Time the paint and other pending events.
+            callback = k.latency.paint_callback()
+            if callback:
+                QtCore.QTimer.singleShot(0, callback)
         except Exception:
             g.es_exception()
         return True
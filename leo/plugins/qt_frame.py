@@ -869,7 +869,10 @@ class DynamicWindow(QtWidgets.QMainWindow):
     #@+node:ekr.20110605121601.18164: *5* dw.createTreeWidget
     def createTreeWidget(self, parent, name):
         c = self.leo_c
-        w = LeoQTreeWidget(c, parent)
+        if c.config.getBool('qt-tree-use-model'):
+            w = LeoQTreeView(c, parent)
+        else:
+            w = LeoQTreeWidget(c, parent)
         self.setSizePolicy(w)
         # 12/01/07: add new config setting.
         multiple_selection = c.config.getBool('qt-tree-multiple-selection', default=True)
@@ -2335,7 +2338,10 @@ class LeoQtFrame(leoFrame.LeoFrame):
     def createSplitterComponents(self):
         
         c = self.c
-        self.tree = qt_tree.LeoQtTree(c, self)
+        if isinstance(self.top.treeWidget, LeoQTreeView):
+            self.tree = qt_tree.LeoQtTreeModel(c, self)
+        else:
+            self.tree = qt_tree.LeoQtTree(c, self)
         self.log = LeoQtLog(self, None)
         self.body = LeoQtBody(self, None)
         if g.app.dock:
@@ -3987,8 +3993,7 @@ class LeoQTreeWidget(QtWidgets.QTreeWidget):
         p = None
         item = self.itemAt(ev.pos())
         if item:
-            itemHash = tree.itemHash(item)
-            p = tree.item2positionDict.get(itemHash)
+            p = tree.item2position(item)
         if not p:
             # #59: Drop at last node.
             p = c.rootPosition()
@@ -4404,6 +4409,69 @@ class LeoQTreeWidget(QtWidgets.QTreeWidget):
         """Return the commander's filename."""
         return self.c.fileName() or '<unsaved file>'
     #@-others
+#@+node:ekr.20191111064203.12: ** class LeoQTreeView (QTreeView)
+class LeoQTreeView(QtWidgets.QTreeView):
+    """
+    The tree widget for qt_tree.LeoQtTreeModel.
+
+    Items are QModelIndexes. This class supplies the QTreeWidget methods
+    used by LeoQtTree, and shares LeoQTreeWidget's drag and drop code.
+    """
+
+    def __init__(self, c, parent):
+        super().__init__(parent)
+        self.setAcceptDrops(True)
+        enable_drag = c.config.getBool('enable-tree-dragging')
+        self.setDragEnabled(bool(enable_drag))
+        self.setUniformRowHeights(True)
+            # Lets Qt lay out rows without asking for their data.
+        self.c = c
+        self.was_alt_drag = False
+        self.was_control_drag = False
+
+    def __repr__(self):
+        return 'LeoQTreeView: %s' % id(self)
+
+    __str__ = __repr__
+    #@+others
+    #@+node:ekr.20191111071916.1: *3* LeoQTreeView: QTreeWidget methods
+    def collapseItem(self, index):
+        self.collapse(index)
+
+    def currentItem(self):
+        index = self.currentIndex()
+        return index if index.isValid() else None
+
+    def editItem(self, index):
+        self.edit(index)
+
+    def expandItem(self, index):
+        self.expand(index)
+
+    def itemAt(self, pos):
+        index = self.indexAt(pos)
+        return index if index.isValid() else None
+
+    def itemWidget(self, index, column):
+        return self.indexWidget(index)
+
+    def scrollToItem(self, index, hint):
+        self.scrollTo(index, hint)
+
+    def selectedItems(self):
+        return [z for z in self.selectedIndexes() if z.column() == 0]
+
+    def setCurrentItem(self, index):
+        self.setCurrentIndex(index)
+
+    def setItemWidget(self, index, column, w):
+        self.setIndexWidget(index, w)
+    #@-others
+
+# Share LeoQTreeWidget's event handlers and their helpers.
+for name, val in list(LeoQTreeWidget.__dict__.items()):
+    if callable(val) and not name.startswith('__') and name not in LeoQTreeView.__dict__:
+        setattr(LeoQTreeView, name, val)
 #@+node:ekr.20110605121601.18385: ** class LeoQtSpellTab
 class LeoQtSpellTab:
     #@+others
@@ -6,6 +6,7 @@
 #@+<< imports >>
 #@+node:ekr.20140907131341.18709: ** << imports >> (qt_tree.py)
 import leo.core.leoGlobals as g
+import leo.core.leoFastRedraw as leoFastRedraw
 import leo.core.leoFrame as leoFrame
 import leo.core.leoNodes as leoNodes
 import leo.core.leoPlugins as leoPlugins # Uses leoPlugins.TryNext.
@@ -41,6 +42,12 @@ class LeoQtTree(leoFrame.LeoTree):
         self.position2itemDict = {}
         self.vnode2itemsDict = {} # values are lists of items.
         self.editWidgetsDict = {} # keys are native edit widgets, values are wrappers.
+        # Incremental redraws...
+        self.drawn_items = [] # The items drawn by the last full redraw, in outline order.
+        self.fast_redrawer = leoFastRedraw.FastRedraw()
+        self.row_data = {} # Keys are ids of items, values are results of itemState.
+        self.row_layout = {} # The result of layoutRows for the last redraw.
+        self.rows = None # (keys, items) for the last redraw.
         self.reloadSettings()
         # Components.
         self.canvas = self # An official ivar used by Leo's core.
@@ -107,6 +114,7 @@ class LeoQtTree(leoFrame.LeoTree):
         c = self.c
         self.auto_edit = c.config.getBool('single-click-auto-edits-headline', False)
         self.enable_drag_messages = c.config.getBool("enable-drag-messages")
+        self.incremental_redraw = c.config.getBool('qt-tree-incremental-redraw', default=True)
         self.select_all_text_when_editing_headlines = \
             c.config.getBool('select_all_text_when_editing_headlines')
         self.stayInTree = c.config.getBool('stayInTreeAfterSelect')
@@ -143,6 +151,7 @@ class LeoQtTree(leoFrame.LeoTree):
         """Clear all widgets in the tree."""
         w = self.treeWidget
         w.clear()
+        self.rows = None
     #@+node:ekr.20180810052056.1: *4* qtree.drawVisible & helpers (not used)
     def drawVisible(self, p):
         """
@@ -462,21 +471,19 @@ class LeoQtTree(leoFrame.LeoTree):
     #@+node:ekr.20110605121601.17875: *5* qtree.drawNode
     def drawNode(self, p, parent_item):
         """Draw the node p."""
-        c = self.c
-        v = p.v
         # Allocate the item.
         item = self.createTreeItem(p, parent_item)
+        self.drawn_items.append(item)
         #
         # Update the data structures.
-        itemHash = self.itemHash(item)
-        self.position2itemDict[p.key()] = item
-        self.item2positionDict[itemHash] = p.copy() # was item
-        self.item2vnodeDict[itemHash] = v # was item
-        d = self.vnode2itemsDict
-        aList = d.get(v, [])
-        if item not in aList:
-            aList.append(item)
-        d[v] = aList
+        self.setItemPosition(p.copy(), item)
+        self.drawItemContents(p, item)
+        return item
+    #@+node:ekr.20191111075629.5: *5* qtree.drawItemContents
+    def drawItemContents(self, p, item):
+        """Set the headline and icon of p's item."""
+        c = self.c
+        v = p.v
         # Set the headline and maybe the icon.
         self.setItemText(item, p.h)
         if self.use_declutter:
@@ -489,7 +496,6 @@ class LeoQtTree(leoFrame.LeoTree):
                 # **Slow**, but allows per-vnode icons.
             if icon:
                 item.setIcon(0, icon)
-        return item
     #@+node:ekr.20110605121601.17876: *5* qtree.drawTopTree
     def drawTopTree(self, p):
         """Draw the tree rooted at p."""
@@ -497,7 +503,13 @@ class LeoQtTree(leoFrame.LeoTree):
         if trace:
             t1 = time.process_time()
         c = self.c
+        if self.incremental_redraw and self.rows and self.redrawIncrementally():
+            if trace:
+                t2 = time.process_time()
+                g.trace('incremental: %5.2f sec.' % (t2-t1), g.callers(5))
+            return
         self.clear()
+        self.drawn_items = []
         # Draw all top-level nodes and their visible descendants.
         if c.hoistStack:
             bunch = c.hoistStack[-1]
@@ -514,6 +526,10 @@ class LeoQtTree(leoFrame.LeoTree):
             while p:
                 self.drawTree(p)
                 p.moveToNext()
+        if self.incremental_redraw:
+            keys, positions = self.fast_redrawer.flatten_rows(c)
+            self.rememberRows(keys, positions, self.drawn_items)
+        self.drawn_items = []
         if trace:
             t2 = time.process_time()
             g.trace('%5.2f sec.' % (t2-t1), g.callers(5))
@@ -532,6 +548,99 @@ class LeoQtTree(leoFrame.LeoTree):
         self.position2itemDict = {}
         self.vnode2itemsDict = {}
         self.editWidgetsDict = {}
+    #@+node:ekr.20191111075629.6: *5* qtree.redrawIncrementally & helpers
+    def redrawIncrementally(self):
+        """
+        Update the items of the last redraw, using the opcodes that change
+        its rows into the present rows. Create items only for new rows, and
+        move the items of moved rows.
+
+        Return False if a full redraw would be about as fast.
+        """
+        c, fr = self.c, self.fast_redrawer
+        keys, positions = fr.flatten_rows(c)
+        old_keys, old_items = self.rows
+        row_map = fr.row_map(old_keys, keys, fr.diff(old_keys, keys))
+        if row_map.count(-1) > max(100, len(keys) // 2):
+            return False
+        # Reuse the items of unchanged and moved rows.
+        items = [
+            old_items[i] if i > -1 else self.createTreeItem(p, None, detached=True)
+                for i, p in zip(row_map, positions)]
+        # Give new children only to items whose children have changed.
+        layout, old_layout = self.layoutRows(items, positions), self.row_layout
+        changed = [
+            z for z in set(layout) | set(old_layout)
+                if z not in layout or z not in old_layout or
+                    [id(z2) for z2 in layout[z][1]] != [id(z2) for z2 in old_layout[z][1]]]
+        for z in changed:
+            parent, children = layout.get(z) or old_layout[z]
+            parent.takeChildren()
+        for z in changed:
+            if z in layout:
+                parent, children = layout[z]
+                parent.addChildren(children)
+        # Update the contents, expansion and dicts of all rows.
+        old_data, row_data = self.row_data, {}
+        for item, p in zip(items, positions):
+            state = row_data[id(item)] = self.itemState(p)
+            if old_data.get(id(item)) != state:
+                self.drawItemContents(p, item)
+            if p.v.children:
+                expanded = p.isExpanded()
+                if item.isExpanded() != expanded:
+                    if expanded:
+                        self.expandItem(item)
+                    else:
+                        self.contractItem(item)
+            self.setItemPosition(p, item)
+        self.rows, self.row_data, self.row_layout = (keys, items), row_data, layout
+        return True
+    #@+node:ekr.20191111075629.7: *6* qtree.itemState
+    def itemState(self, p):
+        """
+        Return the data that determines the headline and icon of p's item.
+
+        Like qtree.updateIcon, this assumes that the icon list changes only
+        when ec.setIconList replaces it.
+        """
+        v = p.v
+        d = getattr(v, 'unknownAttributes', None)
+        return v.h, v.computeIcon(), d and d.get('icons')
+    #@+node:ekr.20191111075629.8: *6* qtree.layoutRows
+    def layoutRows(self, items, positions):
+        """
+        Return a dict describing the tree structure of the given rows.
+
+        Keys are the ids of parent items, or 0 for the tree's invisible root.
+        Values are [parent_item, list of child items].
+        """
+        root = self.treeWidget.invisibleRootItem()
+        layout = {0: [root, []]}
+        top = len(positions[0].stack) if positions else 0
+        parents = [] # The items of the ancestors of the present row.
+        for item, p in zip(items, positions):
+            del parents[len(p.stack) - top:]
+            if parents:
+                parent = parents[-1]
+                entry = layout.get(id(parent))
+                if entry is None:
+                    entry = layout[id(parent)] = [parent, []]
+            else:
+                entry = layout[0]
+            entry[1].append(item)
+            parents.append(item)
+        return layout
+    #@+node:ekr.20191111075629.9: *6* qtree.rememberRows
+    def rememberRows(self, keys, positions, items):
+        """Remember the rows drawn by a full redraw."""
+        if len(keys) != len(items):
+            # Should not happen.
+            self.rows = None
+            return
+        self.rows = keys, items
+        self.row_data = {id(item): self.itemState(p) for item, p in zip(items, positions)}
+        self.row_layout = self.layoutRows(items, positions)
     #@+node:tbrown.20150808075906.1: *5* qtree.update_appearance (no longer used)
     def update_appearance(self, tag, keywords):
         """clear_visual_icons - update appearance, but can't call
@@ -640,7 +749,7 @@ class LeoQtTree(leoFrame.LeoTree):
         expand = c.shouldBeExpanded(p)
         if 'drawing' in g.app.debug:
             g.trace('expand' if expand else 'contract')
-        item = self.position2itemDict.get(p.key())
+        item = self.position2item(p)
         if p:
             try:
                 # These generate events, which would trigger a full redraw.
@@ -774,7 +883,7 @@ class LeoQtTree(leoFrame.LeoTree):
                     g.warning("truncating headline to", limit, "characters")
             #@-<< truncate s if it has multiple lines >>
             p.initHeadString(s)
-            item.setText(0, s) # Required to avoid full redraw.
+            self.setItemText(item, s) # Required to avoid full redraw.
             undoData = u.beforeChangeNodeContents(p, oldHead=oldHead)
             if not c.changed: c.setChanged(True)
             # New in Leo 4.4.5: we must recolor the body because
@@ -1102,6 +1211,19 @@ class LeoQtTree(leoFrame.LeoTree):
     def isValidItem(self, item):
         itemHash = self.itemHash(item)
         return itemHash in self.item2vnodeDict # was item.
+
+    def setItemPosition(self, p, item):
+        """Associate item with position p, which the caller must not change."""
+        v = p.v
+        itemHash = self.itemHash(item)
+        self.position2itemDict[p.key()] = item
+        self.item2positionDict[itemHash] = p # was item
+        self.item2vnodeDict[itemHash] = v # was item
+        d = self.vnode2itemsDict
+        aList = d.get(v, [])
+        if item not in aList:
+            aList.append(item)
+        d[v] = aList
     #@+node:ekr.20110605121601.18415: *4* qtree.childIndexOfItem
     def childIndexOfItem(self, item):
         parent = item and item.parent()
@@ -1178,11 +1300,14 @@ class LeoQtTree(leoFrame.LeoTree):
         self.sizeTreeEditor(self.c, e)
         return e, wrapper
     #@+node:ekr.20110605121601.18421: *4* qtree.createTreeItem (changed)
-    def createTreeItem(self, p, parent_item):
+    def createTreeItem(self, p, parent_item, detached=False):
 
         w = self.treeWidget
-        itemOrTree = parent_item or w
-        item = QtWidgets.QTreeWidgetItem(itemOrTree)
+        if detached:
+            item = QtWidgets.QTreeWidgetItem()
+        else:
+            itemOrTree = parent_item or w
+            item = QtWidgets.QTreeWidgetItem(itemOrTree)
         item.setFlags(item.flags() | QtCore.Qt.ItemIsEditable | item.DontShowIndicatorWhenChildless)
         try:
             g.visit_tree_item(self.c, p, item)
@@ -1467,6 +1592,361 @@ class LeoQtTree(leoFrame.LeoTree):
         if item:
             item.setSelected(False)
     #@-others
+#@+node:ekr.20191111064203.1: ** class DeclutterItem
+class DeclutterItem:
+    """
+    The parts of QTreeWidgetItem used by LeoQtTree.declutter_node.
+
+    LeoTreeModel.data returns the text, colors and font that the declutter
+    patterns set.
+    """
+
+    def __init__(self, s, font):
+        self.font_ = QtGui.QFont(font)
+        self.roles = {}
+        self.s = s
+
+    def font(self, column):
+        return QtGui.QFont(self.font_)
+
+    def setBackground(self, column, brush):
+        self.roles[QtCore.Qt.BackgroundRole] = brush
+
+    def setFont(self, column, font):
+        self.font_ = font
+        self.roles[QtCore.Qt.FontRole] = font
+
+    def setForeground(self, column, brush):
+        self.roles[QtCore.Qt.ForegroundRole] = brush
+
+    def setText(self, column, s):
+        self.s = s
+
+    def text(self, column):
+        return self.s
+#@+node:ekr.20191111064203.2: ** class LeoTreeModel (QAbstractItemModel)
+class LeoTreeModel(QtCore.QAbstractItemModel):
+    """
+    A model that computes the rows of Leo's outline from the VNode graph.
+
+    The internal pointer of each index is a path: a tuple of child indices
+    whose first element is the index of a top-level row in self.roots. Qt
+    asks only for the rows it shows, so only on-screen rows cost anything.
+    """
+    #@+others
+    #@+node:ekr.20191111064203.3: *3* model.__init__ & reset
+    def __init__(self, tree):
+        super().__init__()
+        self.c = tree.c
+        self.tree = tree
+        self.decluttered = {} # Keys are paths, values are DeclutterItems.
+        self.icons = {} # Keys are paths, values are QIcons.
+        self.paths = {} # Keys and values are paths.
+            # Qt does not own internal pointers, so this dict keeps them alive.
+        self.roots = [] # The positions of the top-level rows.
+
+    def reset(self, roots):
+        """Show the given top-level positions, forgetting all indices."""
+        self.beginResetModel()
+        self.decluttered, self.icons, self.paths = {}, {}, {}
+        self.roots = roots
+        self.endResetModel()
+    #@+node:ekr.20191111064203.4: *3* model.Paths
+    def path2index(self, path):
+        """Return the index for a path, or None."""
+        if not path:
+            return None
+        path = self.paths.setdefault(path, path)
+        return self.createIndex(path[-1], 0, path)
+
+    def path2position(self, path):
+        """Return the position for a path, or None."""
+        if not path or path[0] >= len(self.roots):
+            return None
+        p = self.roots[path[0]].copy()
+        for n in path[1:]:
+            p.moveToNthChild(n)
+            if not p.v:
+                return None
+        return p
+
+    def path2vnode(self, path):
+        """Return the vnode for a path, or None."""
+        if not path or path[0] >= len(self.roots):
+            return None
+        v = self.roots[path[0]].v
+        for n in path[1:]:
+            if n >= len(v.children):
+                return None
+            v = v.children[n]
+        return v
+
+    def position2path(self, p):
+        """Return the path for position p, or None if p is not in the model."""
+        if not p or not self.roots:
+            return None
+        root = self.roots[0]
+        level = root.level()
+        indices = [z[1] for z in p.stack] + [p._childIndex]
+        if len(indices) <= level:
+            return None
+        path = (indices[level] - root._childIndex,) + tuple(indices[level+1:])
+        if path[0] < 0 or self.path2position(path) != p:
+            return None
+        return path
+    #@+node:ekr.20191111064203.5: *3* model.Qt overrides
+    # See http://doc.qt.io/qt-5/qabstractitemmodel.html#subclassing
+
+    def columnCount(self, parent):
+        return 1
+
+    def data(self, index, role):
+        path = index.internalPointer() if index.isValid() else None
+        p = self.path2position(path)
+        if not p:
+            return None
+        Qt = QtCore.Qt
+        if role == Qt.EditRole:
+            return p.h
+        if self.tree.declutter:
+            item = self.declutter(path, p)
+            if role == Qt.DisplayRole:
+                return item.text(0)
+            if role in item.roles:
+                return item.roles[role]
+        if role == Qt.DisplayRole:
+            return p.h
+        if role == Qt.DecorationRole:
+            icon = self.icons.get(path)
+            if icon is None:
+                icon = self.icons[path] = self.tree.getIcon(p)
+            return icon
+        return None
+
+    def flags(self, index):
+        Qt = QtCore.Qt
+        if not index.isValid():
+            return Qt.ItemIsDropEnabled
+        return (
+            Qt.ItemIsDragEnabled | Qt.ItemIsDropEnabled | Qt.ItemIsEditable |
+            Qt.ItemIsEnabled | Qt.ItemIsSelectable)
+
+    def index(self, row, column, parent):
+        path = parent.internalPointer() + (row,) if parent.isValid() else (row,)
+        if column != 0 or row < 0 or self.path2vnode(path) is None:
+            return QtCore.QModelIndex()
+        return self.path2index(path)
+
+    def parent(self, index=None):
+        if index is None:
+            return super().parent() # QObject.parent.
+        path = index.internalPointer() if index.isValid() else None
+        if not path or len(path) < 2:
+            return QtCore.QModelIndex()
+        return self.path2index(path[:-1])
+
+    def rowCount(self, parent):
+        if not parent.isValid():
+            return len(self.roots)
+        v = self.path2vnode(parent.internalPointer())
+        return len(v.children) if v else 0
+
+    def setData(self, index, value, role):
+        """Headlines change only in LeoQtTree.onHeadChanged, which handles undo."""
+        return False
+
+    def supportedDropActions(self):
+        return QtCore.Qt.CopyAction | QtCore.Qt.MoveAction
+    #@+node:ekr.20191111064203.6: *3* model.declutter
+    def declutter(self, path, p):
+        """Return the DeclutterItem for the given path and position."""
+        item = self.decluttered.get(path)
+        if not item:
+            item = DeclutterItem(p.h, self.tree.treeWidget.font())
+            self.tree.declutter_node(self.c, p, item)
+            self.decluttered[path] = item
+        return item
+    #@-others
+#@+node:ekr.20191111064203.7: ** class LeoQtTreeModel (LeoQtTree)
+class LeoQtTreeModel(LeoQtTree):
+    """
+    A LeoQtTree whose widget is a LeoQTreeView showing a LeoTreeModel.
+
+    Items are the QModelIndexes of the model. LeoQTreeView supplies the
+    QTreeWidget methods that LeoQtTree uses, so this class overrides only the
+    methods that create items or use QTreeWidgetItem methods.
+
+    Redrawing resets the model and expands the rows of expanded nodes. Rows
+    are computed only when Qt shows them.
+
+    Plugins that add visitors to g.visit_tree_item or that use
+    QTreeWidgetItems do not work with this class.
+    """
+    #@+others
+    #@+node:ekr.20191111064203.8: *3* qmodel.Birth
+    def __init__(self, c, frame):
+        """Ctor for the LeoQtTreeModel class."""
+        super().__init__(c, frame)
+        self.model = LeoTreeModel(self)
+        self.treeWidget.setModel(self.model)
+        self.treeWidget.setHeaderHidden(True)
+
+    def initAfterLoad(self):
+        """Do late-state inits."""
+        c = self.c
+        tw = self.treeWidget
+        if not LeoQtTree.callbacksInjected:
+            LeoQtTree.callbacksInjected = True
+            self.injectCallbacks() # A base class method.
+        tw.doubleClicked.connect(self.onIndexDoubleClicked)
+        tw.clicked.connect(self.onIndexClicked)
+        tw.selectionModel().selectionChanged.connect(self.onSelectionChanged)
+        tw.collapsed.connect(self.onItemCollapsed)
+        tw.expanded.connect(self.onItemExpanded)
+        tw.customContextMenuRequested.connect(self.onContextMenu)
+        g.app.gui.setFilter(c, tw, self, tag='tree')
+
+    def reloadSettings(self):
+        """LeoQtTreeModel."""
+        super().reloadSettings()
+        # The model declutters only displayed text, so LeoQtTree's code
+        # that restores the real text of items must not run.
+        self.declutter = self.use_declutter
+        self.use_declutter = False
+    #@+node:ekr.20191111064203.9: *3* qmodel.Drawing
+    def clear(self):
+        """Clear all rows of the tree."""
+        self.model.reset([])
+
+    def drawIcon(self, p):
+        """Redraw the icon at p."""
+        self.updateIcon(p, force=True)
+
+    def drawTopTree(self, p):
+        """Show all top-level nodes and expand all expanded rows."""
+        trace = 'drawing' in g.app.debug and not g.unitTesting
+        if trace:
+            t1 = time.process_time()
+        c = self.c
+        if c.hoistStack:
+            p = c.hoistStack[-1].p
+            if len(c.hoistStack) == 1 and p.h.startswith('@chapter') and p.hasChildren():
+                roots = list(p.children())
+            else:
+                roots = [p.copy()]
+        else:
+            roots = list(c.rootPosition().self_and_siblings())
+        self.model.reset(roots)
+        self.expandRows()
+        if trace:
+            t2 = time.process_time()
+            g.trace('%5.2f sec.' % (t2-t1), g.callers(5))
+
+    def expandRows(self):
+        """
+        Expand the rows of all expanded nodes.
+
+        Only expanded nodes and their children are visited.
+        """
+        model, w = self.model, self.treeWidget
+        todo = [(model.path2index((n,)), p) for n, p in enumerate(model.roots)]
+        while todo:
+            index, p = todo.pop()
+            if p.hasChildren() and p.isExpanded():
+                w.expand(index)
+                for n, v in enumerate(p.v.children):
+                    if v.children:
+                        child = p.copy().moveToNthChild(n)
+                        todo.append((model.index(n, 0, index), child))
+
+    def initData(self):
+        self.editWidgetsDict = {}
+
+    def redraw_after_icons_changed(self):
+
+        if self.busy:
+            return
+        self.redrawCount += 1 # To keep a unit test happy.
+        # Recompute icons as rows are shown.
+        self.model.decluttered, self.model.icons = {}, {}
+        self.treeWidget.viewport().update()
+    #@+node:ekr.20191111064203.10: *3* qmodel.Event handlers
+    def onIndexClicked(self, index):
+        self.onItemClicked(index, 0)
+
+    def onIndexDoubleClicked(self, index):
+        self.onItemDoubleClicked(index, 0)
+
+    def onSelectionChanged(self, selected, deselected):
+        self.onTreeSelect()
+    #@+node:ekr.20191111064203.11: *3* qmodel.Items
+    def itemHash(self, item):
+        return item.internalPointer() if item else None
+
+    def item2position(self, item):
+        if item is None or not item.isValid():
+            return None
+        return self.model.path2position(item.internalPointer())
+
+    def item2vnode(self, item):
+        if item is None or not item.isValid():
+            return None
+        return self.model.path2vnode(item.internalPointer())
+
+    def position2item(self, p):
+        return self.model.path2index(self.model.position2path(p))
+
+    def vnode2items(self, v):
+        """Return the indices of v's rows that Qt has seen since the last redraw."""
+        model = self.model
+        return [
+            model.path2index(path) for path in list(model.paths)
+                if model.path2vnode(path) is v]
+
+    def isValidItem(self, item):
+        return (
+            item is not None and item.isValid() and
+            item.internalPointer() in self.model.paths and
+            self.item2vnode(item) is not None)
+
+    def childIndexOfItem(self, item):
+        return item.row()
+
+    def childItems(self, parent_item):
+        """
+        Return the list of child items of the parent item,
+        or the top-level items if parent_item is None.
+        """
+        model = self.model
+        parent = parent_item or QtCore.QModelIndex()
+        return [model.index(n, 0, parent) for n in range(model.rowCount(parent))]
+
+    def getItemText(self, item):
+        """Return the text of the item."""
+        return self.model.data(item, QtCore.Qt.DisplayRole) if item else '<no item>'
+
+    def getParentItem(self, item):
+        parent = item and item.parent()
+        return parent if parent and parent.isValid() else None
+
+    def setItemIconHelper(self, item, icon):
+        if item:
+            self.model.icons[item.internalPointer()] = icon
+            self.model.dataChanged.emit(item, item)
+
+    def setItemText(self, item, s):
+        """Show the new headline: the model gets the text from p.h."""
+        if item:
+            self.model.decluttered.pop(item.internalPointer(), None)
+            self.model.dataChanged.emit(item, item)
+
+    def unselectItem(self, p):
+
+        item = self.position2item(p)
+        if item:
+            self.treeWidget.selectionModel().select(
+                item, QtCore.QItemSelectionModel.Deselect)
+    #@-others
 #@-others
 #@@language python
 #@@tabwidth -4
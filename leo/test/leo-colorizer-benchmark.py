@@ -0,0 +1,174 @@
+#@+leo-ver=5-thin
+#@+node:ekr.20191110172506.1: * @file ../test/leo-colorizer-benchmark.py
+"""
+Time the jEdit colorizer on every mode in leo/modes, with and without
+compiled rulesets, and check that both produce identical tags.
+
+Usage: python leo/test/leo-colorizer-benchmark.py [mode...]
+
+The text for each mode is synthesized from the mode's keywords and the
+literals of its rules. Requires Qt.
+"""
+# pylint: disable=invalid-name
+import glob
+import importlib
+import os
+import random
+import sys
+import time
+
+# Switches...
+kill_leo_output = True  # True: kill all output produced by g.es.
+loadPlugins = False     # True: attempt to load plugins.
+n_lines = 300           # The number of lines of synthesized text per mode.
+readSettings = False    # True: read standard settings files.
+repeat = 3              # The number of times to colorize each text.
+silent = True           # True: don't print signon messages.
+verbose = False         # True: print the results for each mode.
+
+# Import stuff...
+leo_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if leo_dir not in sys.path:
+    sys.path.insert(0, leo_dir)
+import leo.core.leoBridge as leoBridge
+import leo.core.leoColorizer as leoColorizer
+#@+others
+#@+node:ekr.20191110172506.2: ** class Highlighter
+class Highlighter:
+    """
+    The parts of QSyntaxHighlighter used by jedit.recolor.
+
+    This allows the colorizer to run without a body widget.
+    """
+
+    def __init__(self):
+        self.n = 0
+        self.prev_state = -1
+        self.state = -1
+
+    def currentBlock(self):
+        return g.Bunch(blockNumber=lambda: self.n, isValid=lambda: True)
+
+    def currentBlockState(self):
+        return self.state
+
+    def previousBlockState(self):
+        return self.prev_state
+
+    def setCurrentBlockState(self, n):
+        self.state = n
+
+    def setFormat(self, *args):
+        pass
+#@+node:ekr.20191110172506.3: ** class TagRecorder (JEditColorizer)
+class TagRecorder(leoColorizer.JEditColorizer):
+    """A JEditColorizer that records tags instead of setting formats."""
+
+    def __init__(self, c):
+        self.tags = []
+        super().__init__(c, None, None)
+        self.highlighter = Highlighter()
+
+    def configure_hard_tab_width(self):
+        pass
+
+    def configure_tags(self):
+        pass
+
+    def setTag(self, tag, s, i, j):
+        self.tags.append((self.highlighter.n, tag, i, j))
+#@+node:ekr.20191110172506.4: ** colorize
+def colorize(x, lines):
+    """Colorize all lines, returning the tags and the line states."""
+    h = x.highlighter
+    x.old_v = None
+    x.tags, states = [], []
+    prev_state = -1
+    for n, line in enumerate(lines):
+        h.n, h.prev_state, h.state = n, prev_state, -1
+        x.recolor(line)
+        states.append(x.stateDict.get(h.state, h.state))
+        prev_state = h.state
+    return x.tags, states
+#@+node:ekr.20191110172506.5: ** sample_text
+def sample_text(mode_name):
+    """Synthesize text from a mode's keywords and the literals of its rules."""
+    mode = importlib.import_module('leo.modes.' + mode_name)
+    words = []
+    for d in (getattr(mode, 'keywordsDictDict', None) or {}).values():
+        words.extend(list(d)[:200])
+    recorder = leoColorizer.RuleRecorder()
+    for rulesDict in (getattr(mode, 'rulesDictDict', None) or {}).values():
+        if not isinstance(rulesDict, dict):
+            continue
+        for rules in rulesDict.values():
+            for rule in rules:
+                data = recorder.record(rule)
+                for key in ('begin', 'end', 'pattern', 'seq', 'word'):
+                    val = data and data[1].get(key)
+                    if val and isinstance(val, str):
+                        words.append(val)
+    words.extend([
+        '"str"', "'c'", '#', '$x', '%', '(', ')', '/*', '*/', '//', '0x1F',
+        '123', ':', ';', '<' + '<', '>>', '=', '@', '@others', '[', ']', '\\',
+        'bar_1', 'foo', 'http://leoeditor.com', '{', '}', '\t', '  ',
+    ])
+    rnd = random.Random(mode_name)
+    separators = ['', ' ', ' ', '  ', '\t']
+    return [
+        ''.join(rnd.choice(words) + rnd.choice(separators)
+            for i in range(rnd.randint(0, 12)))
+                for j in range(n_lines)]
+#@+node:ekr.20191110172506.6: ** main
+def main(modes):
+    global g
+    controller = leoBridge.controller(
+        gui='nullGui',
+        loadPlugins=loadPlugins,
+        readSettings=readSettings,
+        silent=silent,
+        verbose=False)
+    g = controller.globals()
+    if not leoColorizer.QtWidgets:
+        print('leo-colorizer-benchmark.py requires Qt')
+        return
+    if kill_leo_output:
+
+        def do_nothing(*args, **keys):
+            pass
+
+        g.es = do_nothing
+    c = g.app.newCommander(fileName=None)
+    n_chars, mismatches, totals = 0, [], [0.0, 0.0]
+    for mode_name in modes:
+        lines = sample_text(mode_name)
+        c.p.b = f"@language {mode_name}\n" + '\n'.join(lines)
+        x = TagRecorder(c)
+        results = []
+        for compile_rulesets in (False, True):
+            x.compile_rulesets = compile_rulesets
+            colorize(x, lines) # Load the mode and warm up.
+            t1 = time.process_time()
+            for i in range(repeat):
+                result = colorize(x, lines)
+            results.append((result, (time.process_time() - t1) / repeat))
+        (old_result, old_time), (new_result, new_time) = results
+        if old_result != new_result:
+            mismatches.append(mode_name)
+        n_chars += sum(len(z) + 1 for z in lines)
+        totals[0] += old_time
+        totals[1] += new_time
+        if verbose:
+            print(f"{mode_name:>20}: {old_time*1000:8.1f} {new_time*1000:8.1f} msec")
+    print(f"{len(modes)} modes, {n_chars} characters")
+    for kind, t in zip(('interpreted', 'compiled'), totals):
+        print(f"{kind:>20}: {t*1000:8.1f} msec {n_chars/max(t, 1e-9):12.0f} chars/sec")
+    print(f"mismatched tags: {', '.join(mismatches) or 'none'}")
+#@-others
+if __name__ == '__main__':
+    all_modes = sorted(
+        os.path.basename(z)[:-3]
+            for z in glob.glob(os.path.join(leo_dir, 'leo', 'modes', '*.py'))
+                if not z.endswith('__init__.py'))
+    main(sys.argv[1:] or all_modes)
+#@-leo
@@ -0,0 +1,75 @@
+#@+leo-ver=5-thin
+#@+node:ekr.20191110161040.13: * @file ../test/leo-find-benchmark.py
+"""
+Time the find-all and clone-find-all commands on a synthetic outline,
+with and without the find commands' search index.
+
+Usage: python leo/test/leo-find-benchmark.py [number-of-nodes...]
+
+The default sizes are 30000 and 300000 nodes.
+"""
+# pylint: disable=invalid-name
+import sys
+import time
+
+# Switches...
+body_lines = 10         # The number of lines in each synthetic body.
+fanout = 10             # The number of children of each interior node.
+
+# The find patterns: (find_text, regex, ignore_case)
+patterns = (
+    ('value_12345 ', False, False),
+    ('zzznotfound', False, False),
+    ('VALUE_1234', False, True),
+    ('e_1234', True, False),
+    ('valu.*9999', True, False),
+)
+
+# Import stuff...
+import leo_benchmark
+#@+others
+#@+node:ekr.20191110161040.15: ** main & helpers
+def main(sizes):
+    controller, g = leo_benchmark.open_bridge()
+    c = g.app.newCommander(fileName=None)
+    fc = c.findCommands
+    # The null gui has no find tab.
+    fc.ftm = g.Bunch(entry_focus=None, getFindText=lambda: fc.find_text)
+    for n in sizes:
+        leo_benchmark.make_outline(c, n, fanout, body)
+        c.selectPosition(c.rootPosition())
+        fc.search_index = None
+        print(f"\n{n} nodes...")
+        for kind in ('no index', 'first search', 'index'):
+            fc.use_search_index = kind != 'no index'
+            t1 = time.process_time()
+            for find_text, regex, ignore_case in patterns:
+                for clone_find_all in (False, True):
+                    find_all(c, find_text, regex, ignore_case, clone_find_all)
+            t2 = time.process_time()
+            print(f"{kind:>30}: {(t2-t1)*1000:8.1f} msec")
+
+def find_all(c, find_text, regex, ignore_case, clone_find_all):
+    """Do one find-all or clone-find-all command, then delete the found node."""
+    fc = c.findCommands
+    fc.find_text = find_text
+    fc.findAllUniqueFlag = False
+    fc.ignore_case = ignore_case
+    fc.node_only = fc.suboutline_only = False
+    fc.pattern_match = regex
+    fc.reverse = fc.whole_word = False
+    fc.search_body = fc.search_headline = True
+    fc.findAll(clone_find_all=clone_find_all)
+    last = c.lastTopLevel()
+    if last.h.startswith('Found'):
+        last.doDelete()
+#@+node:ekr.20191110161040.16: ** body
+def body(i):
+    """Return the body of node number i."""
+    return ''.join(
+        f"line {j} of node {i}: value_{i*j} = compute(x{j}, 'text')\n"
+            for j in range(body_lines))
+#@-others
+if __name__ == '__main__':
+    main([int(z) for z in sys.argv[1:]] or [30000, 300000])
+#@-leo
@@ -0,0 +1,123 @@
+#@+leo-ver=5-thin
+#@+node:ekr.20191111094808.1: * @file ../test/leo-keystroke-replay.py
+"""
+Replay keystrokes through Leo's null gui and report the latency of each
+stage of each keystroke.
+
+Usage: python leo/test/leo-keystroke-replay.py [--json FILE] [KEYS-FILE...]
+
+A keys file is either a json file written by the write-latency-report
+command, whose recent keystrokes are replayed, or a text file containing
+one key per line, in the notation of @shortcut settings: "a", "space",
+"Return", "BackSpace", "Tab", etc. By default, this types the first lines
+of leo/core/leoLatency.py.
+
+--json FILE writes the report as json, so the numbers can be tracked over
+time. The null gui's colorizer does nothing and there is no paint stage.
+"""
+# pylint: disable=invalid-name
+import argparse
+import json
+import os
+import sys
+import time
+
+# Switches...
+kill_leo_output = True  # True: kill all output produced by g.es.
+loadPlugins = False     # True: attempt to load plugins.
+n_lines = 100           # The number of lines typed by default.
+readSettings = True     # True: read standard settings files, including key bindings.
+repeat = 3              # The number of times to replay each key sequence.
+silent = True           # True: don't print signon messages.
+
+# Import stuff...
+leo_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if leo_dir not in sys.path:
+    sys.path.insert(0, leo_dir)
+import leo.core.leoBridge as leoBridge
+#@+others
+#@+node:ekr.20191111094808.2: ** default_keys
+def default_keys():
+    """
+    Return the keys that type the first lines of leoLatency.py, deleting
+    and retyping the last character of each line.
+    """
+    fn = os.path.join(leo_dir, 'leo', 'core', 'leoLatency.py')
+    with open(fn, encoding='utf-8') as f:
+        lines = f.read().splitlines()[:n_lines]
+    keys = []
+    for line in lines:
+        line = line.strip()
+        keys.extend('space' if ch == ' ' else ch for ch in line)
+        if line:
+            keys.extend(['BackSpace', keys[-1]])
+        keys.append('Return')
+    return keys
+#@+node:ekr.20191111094808.3: ** read_keys
+def read_keys(fn):
+    """Return the keys in the given keys file."""
+    with open(fn, encoding='utf-8') as f:
+        s = f.read()
+    if fn.endswith('.json'):
+        return [z['stroke'] for z in json.loads(s).get('recent', []) if z.get('stroke')]
+    return [z for z in s.splitlines() if z]
+#@+node:ekr.20191111094808.4: ** replay
+def replay(c, keys):
+    """Type all keys into an empty body, returning the elapsed time."""
+    p = c.rootPosition().insertAfter()
+    p.h = 'replay'
+    c.selectPosition(p)
+    c.bodyWantsFocus()
+    w = c.frame.body.wrapper
+    t1 = time.perf_counter()
+    for key in keys:
+        stroke = g.KeyStroke(key)
+        g.app.gui.event_generate(c, stroke.toInsertableChar(), stroke.s, w)
+    t2 = time.perf_counter()
+    p.doDelete()
+    return t2 - t1
+#@+node:ekr.20191111094808.5: ** main
+def main():
+    global g
+    parser = argparse.ArgumentParser(
+        description='Replay keystrokes and report their latency.')
+    parser.add_argument('--json', metavar='FILE', help='write the report as json')
+    parser.add_argument('files', metavar='KEYS-FILE', nargs='*')
+    args = parser.parse_args()
+    controller = leoBridge.controller(
+        gui='nullGui',
+        loadPlugins=loadPlugins,
+        readSettings=readSettings,
+        silent=silent,
+        verbose=False)
+    g = controller.globals()
+    if kill_leo_output:
+
+        def do_nothing(*args, **keys):
+            pass
+
+        g.es = do_nothing
+    c = g.app.newCommander(fileName=None)
+    c.k.latency.enabled = True
+    sequences = [(fn, read_keys(fn)) for fn in args.files]
+    if not sequences:
+        sequences = [('leoLatency.py', default_keys())]
+    results = {}
+    for fn, keys in sequences:
+        c.k.latency.clear()
+        elapsed = min(replay(c, keys) for i in range(repeat))
+        print(f"\n{fn}: {len(keys)} keys, {elapsed*1000:.1f} msec")
+        print('\n'.join(c.k.latency.report()))
+        d = c.k.latency.to_dict()
+        del d['recent']
+        d['keys'] = len(keys)
+        d['elapsed'] = elapsed
+        results[fn] = d
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'time': time.time(), 'results': results}, f, indent=1, sort_keys=True)
+        print(f"\nwrote {args.json}")
+#@-others
+if __name__ == '__main__':
+    main()
+#@-leo
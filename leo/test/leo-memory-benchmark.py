@@ -0,0 +1,84 @@
+#@+leo-ver=5-thin
+#@+node:ekr.20191110065225.1: * @file ../test/leo-memory-benchmark.py
+"""
+Report the memory used by the vnodes and positions of a .leo file.
+
+Usage: python leo/test/leo-memory-benchmark.py [path-to-leo-file]
+
+The default file is leo/core/LeoPyRef.leo.
+"""
+# pylint: disable=invalid-name
+import os
+import sys
+import time
+import tracemalloc
+
+# Switches...
+gui = 'nullGui'         # 'nullGui', 'qt',
+kill_leo_output = True  # True: kill all output produced by g.es_print.
+loadPlugins = False     # True: attempt to load plugins.
+readSettings = False    # True: read standard settings files.
+silent = True           # True: don't print signon messages.
+verbose = False         # True: verbose output.
+
+# Import stuff...
+leo_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if leo_dir not in sys.path:
+    sys.path.insert(0, leo_dir)
+import leo.core.leoBridge as leoBridge
+#@+others
+#@+node:ekr.20191110065225.2: ** vnode_size
+def vnode_size(v):
+    """Return the number of bytes used by v, its extension dict and its link lists."""
+    n = sys.getsizeof(v) + sys.getsizeof(v.children) + sys.getsizeof(v.parents)
+    d = getattr(v, '__dict__', None)
+    if d:
+        n += sys.getsizeof(d)
+    return n
+#@+node:ekr.20191110065225.3: ** main
+def main(path):
+    controller = leoBridge.controller(
+        gui=gui,
+        loadPlugins=loadPlugins,
+        readSettings=readSettings,
+        silent=silent,
+        verbose=verbose)
+    g = controller.globals()
+    if kill_leo_output:
+
+        def do_nothing(*args, **keys):
+            pass
+
+        g.es_print = do_nothing
+    # Measure the entire load.
+    tracemalloc.start()
+    c = controller.openLeoFile(path)
+    loaded, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    vnodes = list(c.all_unique_nodes())
+    n = len(vnodes)
+    # Measure the vnodes themselves.
+    v_bytes = sum(vnode_size(v) for v in vnodes)
+    # Measure a list of copied positions.
+    tracemalloc.start()
+    t1 = time.process_time()
+    positions = list(c.all_positions())
+    t2 = time.process_time()
+    p_bytes, p_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    # Measure copy-free traversal.
+    t3 = time.process_time()
+    for p in c.all_positions(copy=False):
+        pass
+    t4 = time.process_time()
+    print(f"{c.shortFileName()}: {n} vnodes, {len(positions)} positions")
+    print(f"load:      {loaded // n:6} bytes/vnode, peak {peak // n} bytes/vnode")
+    print(f"vnodes:    {v_bytes // n:6} bytes/vnode")
+    print(f"positions: {p_bytes // len(positions):6} bytes/position")
+    print(f"all_positions():           {(t2-t1)*1000:6.1f} msec")
+    print(f"all_positions(copy=False): {(t4-t3)*1000:6.1f} msec")
+#@-others
+if __name__ == '__main__':
+    main(sys.argv[1] if len(sys.argv) > 1 else
+        os.path.join(leo_dir, 'leo', 'core', 'LeoPyRef.leo'))
+#@-leo
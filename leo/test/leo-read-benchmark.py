@@ -0,0 +1,115 @@
+#@+leo-ver=5-thin
+#@+node:ekr.20191110095830.4: * @file ../test/leo-read-benchmark.py
+"""
+Compare the peak memory and wall time of Leo's .leo file readers.
+
+Usage: python leo/test/leo-read-benchmark.py [path-to-leo-file | number-of-nodes]
+
+The default is a synthetic .leo file containing 200000 nodes.
+
+Each reader runs in its own process, so that its peak RSS does not
+include the peak RSS of the other reader.
+"""
+# pylint: disable=invalid-name
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+# Switches...
+body_lines = 10         # The number of lines in each synthetic body.
+fanout = 10             # The number of children of each interior node.
+gui = 'nullGui'         # 'nullGui', 'qt',
+loadPlugins = False     # True: attempt to load plugins.
+readSettings = False    # True: read standard settings files.
+silent = True           # True: don't print signon messages.
+verbose = False         # True: verbose output.
+
+leo_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if leo_dir not in sys.path:
+    sys.path.insert(0, leo_dir)
+#@+others
+#@+node:ekr.20191110095830.5: ** make_leo_file
+def make_leo_file(path, n):
+    """Write a .leo file containing n nodes to the given path."""
+    body = ''.join(f"line {i} of the body &amp; some text\n" for i in range(body_lines))
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(
+            '<?xml version="1.0" encoding="utf-8"?>\n'
+            '<leo_file xmlns:leo="http://leoeditor.com/namespaces/leo-python-editor/1.1" >\n'
+            '<leo_header file_format="2"/>\n'
+            '<globals/>\n'
+            '<preferences/>\n'
+            '<find_panel_settings/>\n'
+            '<vnodes>\n')
+        count = 0
+
+        def put_tree(level):
+            nonlocal count
+            gnx = f"bench.20191110.{count}"
+            count += 1
+            f.write(f'<v t="{gnx}"><vh>node {gnx}</vh>\n')
+            if level < levels:
+                for i in range(fanout):
+                    if count < n:
+                        put_tree(level + 1)
+            f.write('</v>\n')
+
+        levels = 1
+        while fanout ** levels < n:
+            levels += 1
+        while count < n:
+            put_tree(1)
+        f.write('</vnodes>\n<tnodes>\n')
+        for i in range(n):
+            f.write(f'<t tx="bench.20191110.{i}">{body}</t>\n')
+        f.write('</tnodes>\n</leo_file>\n')
+#@+node:ekr.20191110095830.6: ** child
+def child(kind, path):
+    """Read path with the given reader and print the results."""
+    import leo.core.leoBridge as leoBridge
+    import leo.core.leoFileCommands as leoFileCommands
+    controller = leoBridge.controller(
+        gui=gui,
+        loadPlugins=loadPlugins,
+        readSettings=readSettings,
+        silent=silent,
+        verbose=verbose)
+    g = controller.globals()
+    c = g.app.newCommander(fileName=None)
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    t1 = time.time()
+    reader = leoFileCommands.FastRead(c, {})
+    if kind == 'old':
+        with open(path, 'rb') as f:
+            s = f.read()
+        v, g_element = reader.readWithElementTree(path, s)
+    else:
+        v, g_element = reader.readWithIterParse(path)
+    t2 = time.time()
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    n = len(reader.gnx2vnode)
+    print(f"{kind:>4}: {n} nodes, {t2-t1:5.2f} sec, peak RSS {after // 1024} MB, "
+        f"read delta {(after - before) // 1024} MB")
+#@+node:ekr.20191110095830.7: ** main
+def main(arg):
+    if arg and not arg.isdigit():
+        path = arg
+    else:
+        n = int(arg or 200000)
+        path = os.path.join(tempfile.gettempdir(), f"leo-read-benchmark-{n}.leo")
+        if not os.path.exists(path):
+            make_leo_file(path, n)
+    size = os.path.getsize(path)
+    print(f"{os.path.basename(path)}: {size // (1024 * 1024)} MB")
+    for kind in ('old', 'new'):
+        subprocess.run([sys.executable, __file__, '--child', kind, path])
+#@-others
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--child']:
+        child(sys.argv[2], sys.argv[3])
+    else:
+        main(sys.argv[1] if len(sys.argv) > 1 else None)
+#@-leo
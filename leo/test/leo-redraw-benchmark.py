@@ -0,0 +1,144 @@
+#@+leo-ver=5-thin
+#@+node:ekr.20191111075629.10: * @file ../test/leo-redraw-benchmark.py
+"""
+Time the diffs that drive incremental redraws of Leo's Qt outline.
+
+Usage: python leo/test/leo-redraw-benchmark.py [number-of-visible-nodes...]
+
+The default size is 10000 visible nodes. For each change (insert, move and
+expand) this prints the number of rows that need new items, and the times
+to flatten and diff the outline, using "level:gnx:headline" strings and
+difflib.SequenceMatcher, and using FastRedraw's integer keys and diff.
+FastRedraw.flatten_rows also creates the positions of all rows.
+"""
+# pylint: disable=invalid-name
+import difflib
+import os
+import sys
+import time
+
+# Switches...
+fanout = 100            # The number of children of each top-level node.
+kill_leo_output = True  # True: kill all output produced by g.es.
+loadPlugins = False     # True: attempt to load plugins.
+readSettings = False    # True: read standard settings files.
+repeat = 3              # The number of times to time each diff.
+silent = True           # True: don't print signon messages.
+
+# Import stuff...
+leo_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if leo_dir not in sys.path:
+    sys.path.insert(0, leo_dir)
+import leo.core.leoBridge as leoBridge
+import leo.core.leoFastRedraw as leoFastRedraw
+import leo.core.leoNodes as leoNodes
+#@+others
+#@+node:ekr.20191111075629.11: ** make_outline
+def make_outline(c, n):
+    """
+    Replace c's outline by about n visible nodes: expanded top-level nodes,
+    each with fanout-1 children. The last top-level node is collapsed, and
+    each of its children has ten children.
+    """
+    hidden = c.hiddenRootNode
+    hidden.children = []
+    count = 0
+
+    def new_node(parent, h):
+        nonlocal count
+        v = leoNodes.VNode(context=c)
+        v._headString = h
+        parent.children.append(v)
+        v.parents.append(parent)
+        count += 1
+        return v
+
+    while count < n:
+        v = new_node(hidden, f"node {count}")
+        v.expand()
+        for i in range(fanout - 1):
+            new_node(v, f"node {count}")
+    v = new_node(hidden, 'collapsed')
+    for i in range(10):
+        child = new_node(v, f"child {i}")
+        for j in range(10):
+            new_node(child, f"grandchild {i}.{j}")
+#@+node:ekr.20191111075629.12: ** flatten_strings
+def flatten_strings(c):
+    """
+    Return "level:gnx:headline" strings for the rows of Leo's Qt outline,
+    as FastRedraw.flatten_outline did before it used integer keys.
+    """
+    aList = []
+    t = leoNodes.Traverser()
+    for v, childIndex, level in t.walk_outline(c):
+        aList.append('%s:%s:%s\n' % (level, v.gnx, v.h))
+        if v.children and not v.isExpanded():
+            t.prune()
+            for child in v.children:
+                aList.append('%s:%s:%s\n' % (level + 1, child.gnx, child.h))
+    return aList
+#@+node:ekr.20191111075629.13: ** main & helpers
+def main(sizes):
+    global g
+    controller = leoBridge.controller(
+        gui='nullGui',
+        loadPlugins=loadPlugins,
+        readSettings=readSettings,
+        silent=silent,
+        verbose=False)
+    g = controller.globals()
+    if kill_leo_output:
+
+        def do_nothing(*args, **keys):
+            pass
+
+        g.es = do_nothing
+    c = g.app.newCommander(fileName=None)
+    changes = (('insert', insert), ('move', move), ('expand', expand))
+    for n in sizes:
+        print(f"\n{n} visible nodes...")
+        for name, change in changes:
+            make_outline(c, n)
+            fr = leoFastRedraw.FastRedraw()
+            a_strings, a_keys = flatten_strings(c), fr.flatten_rows(c)[0]
+            change(c)
+            b_strings = flatten_strings(c)
+            b_keys = fr.flatten_rows(c)[0]
+            t_flatten_strings = timeit(lambda: flatten_strings(c))
+            t_flatten_keys = timeit(lambda: fr.flatten_rows(c))
+            t_strings = timeit(lambda: difflib.SequenceMatcher(
+                None, a_strings, b_strings).get_opcodes())
+            t_keys = timeit(lambda: fr.diff(a_keys, b_keys))
+            n_new = fr.row_map(a_keys, b_keys, fr.diff(a_keys, b_keys)).count(-1)
+            print(f"{name}: {len(a_keys)} -> {len(b_keys)} rows, {n_new} new items")
+            print(
+                f"  strings:  flatten {t_flatten_strings*1000:6.1f} msec, "
+                f"difflib {t_strings*1000:6.1f} msec")
+            print(
+                f"  int keys: flatten {t_flatten_keys*1000:6.1f} msec, "
+                f"diff    {t_keys*1000:6.1f} msec")
+
+def insert(c):
+    """Insert a node after the first top-level node."""
+    c.rootPosition().insertAfter().h = 'inserted'
+
+def move(c):
+    """Move the second top-level node, and its children, to the end of the outline."""
+    p = c.rootPosition().next()
+    last = c.lastTopLevel()
+    p.moveAfter(last)
+
+def expand(c):
+    """Expand the collapsed node."""
+    c.lastTopLevel().expand()
+
+def timeit(f):
+    t1 = time.process_time()
+    for i in range(repeat):
+        f()
+    return (time.process_time() - t1) / repeat
+#@-others
+if __name__ == '__main__':
+    main([int(z) for z in sys.argv[1:]] or [10000])
+#@-leo
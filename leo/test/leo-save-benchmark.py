@@ -0,0 +1,57 @@
+#@+leo-ver=5-thin
+#@+node:ekr.20191110115009.1: * @file ../test/leo-save-benchmark.py
+"""
+Time saves of a synthetic .leo file, with and without Leo's cached
+<v> and <t> elements.
+
+Usage: python leo/test/leo-save-benchmark.py [number-of-nodes...]
+
+The default sizes are 10000 and 100000 nodes.
+"""
+# pylint: disable=invalid-name
+import os
+import sys
+import tempfile
+import time
+
+# Switches...
+body_lines = 10         # The number of lines in each synthetic body.
+fanout = 10             # The number of children of each interior node.
+
+# Import stuff...
+import leo_benchmark
+#@+others
+#@+node:ekr.20191110115009.3: ** main & helpers
+def main(sizes):
+    controller, g = leo_benchmark.open_bridge()
+    path = os.path.join(tempfile.gettempdir(), 'leo-save-benchmark.leo')
+    c = controller.openLeoFile(path)
+    fc = c.fileCommands
+    body = ''.join(f"line {i} of the body & <some> text\n" for i in range(body_lines))
+    for n in sizes:
+        leo_benchmark.make_outline(c, n, fanout, body)
+        print(f"\n{n} nodes...")
+        fc.tnodeCache, fc.vnodeCache = {}, {}
+        timeit('first save', save, c, path)
+        fc.tnodeCache, fc.vnodeCache = {}, {}
+        timeit('save, empty cache', save, c, path)
+        timeit('save, no changes', save, c, path)
+        v = c.hiddenRootNode.children[0].children[0]
+        v.h = v.h + ' changed'
+        v.b = v.b + 'changed\n'
+        timeit('save, one node changed', save, c, path)
+        print(f"{'file size':>30}: {os.path.getsize(path) // 1024:8} KB")
+    os.remove(path)
+
+def save(c, path):
+    c.fileCommands.write_Leo_file(path, outlineOnlyFlag=True)
+
+def timeit(kind, func, c, path):
+    t1 = time.process_time()
+    func(c, path)
+    t2 = time.process_time()
+    print(f"{kind:>30}: {(t2-t1)*1000:8.1f} msec")
+#@-others
+if __name__ == '__main__':
+    main([int(z) for z in sys.argv[1:]] or [10000, 100000])
+#@-leo
@@ -0,0 +1,198 @@
+#@+leo-ver=5-thin
+#@+node:ekr.20191111113947.9: * @file ../test/leo-startup-benchmark.py
+"""
+Start Leo repeatedly with the null gui and report the startup tracer's
+phases for each reference outline.
+
+Usage: python leo/test/leo-startup-benchmark.py [options] [OUTLINE...]
+
+The default outlines are leo/core/LeoPyRef.leo and a synthetic outline
+containing --nodes nodes. Each outline is started cold, in a new home
+directory, and warm, after a first start has filled Leo's caches, with
+@bool lazy-load-plugins both False and True. Cold starts do not clear
+the operating system's file cache.
+
+--baseline FILE compares the results against FILE, by default
+~/.leo/startup-baseline.json. --save writes the results to that file.
+The exit status is 1 if some startup is slower than the baseline by
+more than --threshold.
+"""
+# pylint: disable=invalid-name
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+# Switches...
+fanout = 100            # The number of children of each top-level node.
+repeat = 3              # The number of times to time each start.
+
+leo_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+#@+others
+#@+node:ekr.20191111113947.10: ** make_outline
+def make_outline(path, n):
+    """Write a .leo file containing n nodes to path."""
+    vnodes, tnodes = [], []
+    for i in range(0, n, fanout):
+        vnodes.append(f'<v t="bench.{i}"><vh>node {i}</vh>')
+        for j in range(i + 1, min(n, i + fanout)):
+            vnodes.append(f'<v t="bench.{j}"><vh>node {j}</vh></v>')
+        vnodes.append('</v>')
+    for i in range(n):
+        tnodes.append(f'<t tx="bench.{i}">body of node {i}\nline 2 of node {i}</t>')
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(
+            '<?xml version="1.0" encoding="utf-8"?>\n'
+            '<leo_file xmlns:leo="http://leoeditor.com/namespaces/'
+            'leo-python-editor/1.1" >\n'
+            '<leo_header file_format="2"/>\n'
+            '<vnodes>\n%s\n</vnodes>\n'
+            '<tnodes>\n%s\n</tnodes>\n'
+            '</leo_file>\n' % ('\n'.join(vnodes), '\n'.join(tnodes)))
+#@+node:ekr.20191111113947.11: ** make_home
+def make_home(lazy):
+    """
+    Return a new home directory whose .leo directory contains only a
+    .leoID.txt file and a myLeoSettings.leo file setting lazy-load-plugins.
+    """
+    home = tempfile.mkdtemp(prefix='leo-startup-')
+    leo_home = os.path.join(home, '.leo')
+    os.mkdir(leo_home)
+    with open(os.path.join(leo_home, '.leoID.txt'), 'w') as f:
+        f.write('benchmark')
+    with open(os.path.join(leo_home, 'myLeoSettings.leo'), 'w') as f:
+        f.write(
+            '<?xml version="1.0" encoding="utf-8"?>\n'
+            '<leo_file xmlns:leo="http://leoeditor.com/namespaces/'
+            'leo-python-editor/1.1" >\n'
+            '<leo_header file_format="2"/>\n'
+            '<vnodes>\n'
+            '<v t="benchmark.1"><vh>@settings</vh>\n'
+            f'<v t="benchmark.2"><vh>@bool lazy-load-plugins = {lazy}</vh></v>\n'
+            '</v>\n'
+            '</vnodes>\n'
+            '<tnodes>\n</tnodes>\n'
+            '</leo_file>\n')
+    return home
+#@+node:ekr.20191111113947.12: ** start_leo
+def start_leo(outline, home):
+    """
+    Start Leo with the null gui, in the given home directory. Return the
+    startup tracer's report, with the wall time of the entire process.
+    """
+    fd, report_fn = tempfile.mkstemp(suffix='.json')
+    os.close(fd)
+    args = [
+        sys.executable, os.path.join(leo_dir, 'launchLeo.py'),
+        '--gui=null', '--silent', '--no-splash',
+        f"--startup-report={report_fn}",
+        outline,
+    ]
+    env = dict(os.environ, HOME=home)
+    t1 = time.perf_counter()
+    subprocess.run(args, env=env, cwd=leo_dir,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    t2 = time.perf_counter()
+    try:
+        with open(report_fn, encoding='utf-8') as f:
+            d = json.load(f)
+    except ValueError:
+        sys.exit(f"Leo did not start: {' '.join(args)}")
+    finally:
+        os.remove(report_fn)
+    d['summary']['process'] = t2 - t1
+    return d
+#@+node:ekr.20191111113947.13: ** run_benchmark
+def run_benchmark(outline):
+    """
+    Return a dict whose keys are 'cold' or 'warm' and 'lazy' or 'eager',
+    and whose values are the fastest of repeat startup reports.
+    """
+    results = {}
+    for lazy in (False, True):
+        cold, warm = [], []
+        for i in range(repeat):
+            home = make_home(lazy)
+            try:
+                cold.append(start_leo(outline, home))
+                warm.append(start_leo(outline, home))
+            finally:
+                shutil.rmtree(home, ignore_errors=True)
+        kind = 'lazy' if lazy else 'eager'
+        for start, reports in (('cold', cold), ('warm', warm)):
+            best = min(reports, key=lambda d: d['summary']['process'])
+            results[f"{start} {kind}"] = best
+    return results
+#@+node:ekr.20191111113947.14: ** print_results
+def print_results(name, results, baseline, threshold):
+    """Print the results for one outline. Return True if some start is too slow."""
+    print(f"\n{name}")
+    print('%-12s %8s %8s %8s %8s %7s %7s %7s' % (
+        'start', 'process', 'load', 'settings', 'open', 'modules', 'plugins', 'lazy'))
+    slow = False
+    for key, d in results.items():
+        s = d['summary']
+        phases = {z['name']: z['wall'] for z in d['phases'] if z['depth'] < 3}
+        print('%-12s %8.1f %8.1f %8.1f %8.1f %7s %7s %7s' % (
+            key, 1000 * s['process'], 1000 * s['wall'],
+            1000 * phases.get('LM.readGlobalSettingsFiles', 0.0),
+            1000 * phases.get('LM.openFileByName', 0.0),
+            s['modules'], len(s['loaded_plugins']), len(s['lazy_plugins'])))
+        old = baseline.get(name, {}).get(key)
+        if old:
+            ratio = s['process'] / old['summary']['process']
+            too_slow = ratio > 1.0 + threshold
+            slow = slow or too_slow
+            print('%12s %7.0f%% of baseline, %+d modules%s' % (
+                '', 100 * ratio, s['modules'] - old['summary']['modules'],
+                ' SLOWER' if too_slow else ''))
+    return slow
+#@+node:ekr.20191111113947.15: ** main
+def main():
+    parser = argparse.ArgumentParser(
+        description='Time Leo startup with the null gui.')
+    parser.add_argument('--baseline', metavar='FILE',
+        default=os.path.join(os.path.expanduser('~'), '.leo', 'startup-baseline.json'),
+        help='the baseline results')
+    parser.add_argument('--nodes', type=int, default=100000,
+        help='the size of the synthetic outline; 0: none')
+    parser.add_argument('--save', action='store_true',
+        help='write the results to the baseline file')
+    parser.add_argument('--threshold', type=float, default=0.1,
+        help='the fraction by which startups may be slower than the baseline')
+    parser.add_argument('outlines', metavar='OUTLINE', nargs='*')
+    args = parser.parse_args()
+    outlines = [os.path.abspath(z) for z in args.outlines]
+    tmp_dir = tempfile.mkdtemp(prefix='leo-startup-outlines-')
+    if not outlines:
+        outlines = [os.path.join(leo_dir, 'leo', 'core', 'LeoPyRef.leo')]
+        if args.nodes:
+            fn = os.path.join(tmp_dir, f"synthetic-{args.nodes}.leo")
+            make_outline(fn, args.nodes)
+            outlines.append(fn)
+    try:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline, encoding='utf-8') as f:
+                baseline = json.load(f).get('results', {})
+        results, slow = {}, False
+        for fn in outlines:
+            name = os.path.basename(fn)
+            results[name] = run_benchmark(fn)
+            slow = print_results(name, results[name], baseline, args.threshold) or slow
+        print('\ntimes in msec.')
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    if args.save:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump({'time': time.time(), 'results': results}, f, indent=1, sort_keys=True)
+        print(f"wrote {args.baseline}")
+    return 1 if slow else 0
+#@-others
+if __name__ == '__main__':
+    sys.exit(main())
+#@-leo
@@ -0,0 +1,60 @@
+#@+leo-ver=5-thin
+#@+node:ekr.20191110080651.6: * @file ../test/leo-traversal-benchmark.py
+"""
+Time Leo's traversal methods on synthetic outlines.
+
+Usage: python leo/test/leo-traversal-benchmark.py [number-of-nodes...]
+
+The default sizes are 10000, 100000 and 1000000 nodes.
+"""
+# pylint: disable=invalid-name
+import os
+import sys
+import tempfile
+import time
+
+# Switches...
+fanout = 10             # The number of children of each interior node.
+
+# Import stuff...
+import leo_benchmark
+import leo.core.leoNodes as leoNodes
+#@+others
+#@+node:ekr.20191110080651.8: ** main & helpers
+def main(sizes):
+    controller, g = leo_benchmark.open_bridge()
+    path = os.path.join(tempfile.gettempdir(), 'leo-traversal-benchmark.leo')
+    c = controller.openLeoFile(path)
+    for n in sizes:
+        leo_benchmark.make_outline(c, n, fanout)
+        print(f"\n{n} nodes...")
+        timeit('moveToThreadNext', move_to_thread_next, c)
+        timeit('c.all_positions()', lambda c: list(c.all_positions()), c)
+        timeit('c.all_positions(copy=False)', all_positions_no_copy, c)
+        timeit('c.all_unique_positions()', lambda c: list(c.all_unique_positions()), c)
+        timeit('c.all_nodes()', lambda c: list(c.all_nodes()), c)
+        timeit('p.subtree()', lambda c: list(c.rootPosition().subtree()), c)
+        timeit('Traverser.walk_outline', walk_outline, c)
+
+def all_positions_no_copy(c):
+    for p in c.all_positions(copy=False):
+        pass
+
+def move_to_thread_next(c):
+    p = c.rootPosition()
+    while p:
+        p.moveToThreadNext()
+
+def timeit(kind, func, c):
+    t1 = time.process_time()
+    func(c)
+    t2 = time.process_time()
+    print(f"{kind:>30}: {(t2-t1)*1000:8.1f} msec")
+
+def walk_outline(c):
+    for v, childIndex, level in leoNodes.Traverser().walk_outline(c):
+        pass
+#@-others
+if __name__ == '__main__':
+    main([int(z) for z in sys.argv[1:]] or [10000, 100000, 1000000])
+#@-leo
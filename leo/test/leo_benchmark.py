@@ -0,0 +1,71 @@
+#@+leo-ver=5-thin
+#@+node:ekr.20191111144552.1: * @file ../test/leo_benchmark.py
+"""
+Code shared by the benchmark scripts in leo/test.
+
+Python puts the directory of the running script on sys.path, so the
+scripts can import this module as leo_benchmark.
+"""
+# pylint: disable=invalid-name
+import os
+import sys
+
+# Import stuff...
+leo_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if leo_dir not in sys.path:
+    sys.path.insert(0, leo_dir)
+import leo.core.leoBridge as leoBridge
+import leo.core.leoNodes as leoNodes
+#@+others
+#@+node:ekr.20191111144552.2: ** open_bridge
+def open_bridge(
+    gui='nullGui',          # 'nullGui', 'qt',
+    kill_leo_output=True,   # True: kill all output produced by g.es and g.es_print.
+    loadPlugins=False,      # True: attempt to load plugins.
+    readSettings=False,     # True: read standard settings files.
+    silent=True,            # True: don't print signon messages.
+    verbose=False,          # True: verbose output.
+):
+    """Start Leo's bridge. Return (controller, g)."""
+    controller = leoBridge.controller(
+        gui=gui,
+        loadPlugins=loadPlugins,
+        readSettings=readSettings,
+        silent=silent,
+        verbose=verbose)
+    g = controller.globals()
+    if kill_leo_output:
+
+        def do_nothing(*args, **keys):
+            pass
+
+        g.es = g.es_print = do_nothing
+    return controller, g
+#@+node:ekr.20191111144552.3: ** make_outline
+def make_outline(c, n, fanout=10, body=None):
+    """
+    Replace c's outline by n nodes, each with at most fanout children.
+
+    body: None, the body of all nodes, or a function returning the body of
+    node number i.
+    """
+    hidden = c.hiddenRootNode
+    hidden.children = []
+    parents, count = [hidden], 0
+    while count < n:
+        new_parents = []
+        for parent in parents:
+            for i in range(fanout):
+                if count == n:
+                    break
+                v = leoNodes.VNode(context=c)
+                v._headString = f"node {count}"
+                if body is not None:
+                    v._bodyString = body(count) if callable(body) else body
+                parent.children.append(v)
+                v.parents.append(parent)
+                new_parents.append(v)
+                count += 1
+        parents = new_parents
+#@-others
+#@-leo